@@ -0,0 +1,68 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+from security import metrics
+from security.records import LoginEvent
+
+#configurations
+MAX_CONCURRENT_EVALUATIONS = 16   # evaluations running at once
+MAX_QUEUED_EVALUATIONS = 256      # requests allowed to wait for a slot; beyond this we answer 503
+DEGRADED_QUEUE_FRACTION = 0.5     # once the queue is this full, new evaluations skip ML scoring
+HOT_IP_FAILURES = 10              # failures from an IP (brute-force window) that make it "hot"
+RETRY_AFTER_SECONDS = 1
+
+
+class Overloaded(Exception):
+    """Raised when the evaluation queue is full"""
+
+
+class AdmissionController:
+    """
+    Bounded concurrency with a bounded wait queue in front of evaluation.
+    Only touched from the event loop, so the counters need no lock.
+    """
+
+    def __init__(self, max_concurrent: int = MAX_CONCURRENT_EVALUATIONS, max_queued: int = MAX_QUEUED_EVALUATIONS):
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.active = 0
+        self.waiting = 0
+        self._slots = None   # created lazily inside the running loop
+
+    def saturated(self) -> bool:
+        return self.active >= self.max_concurrent
+
+    def degraded(self) -> bool:
+        return self.waiting >= self.max_queued * DEGRADED_QUEUE_FRACTION
+
+    @asynccontextmanager
+    async def slot(self):
+        """Yields True if the evaluation should run in degraded (rules-only) mode"""
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_concurrent)
+        if self.saturated() and self.waiting >= self.max_queued:
+            raise Overloaded()
+        degraded = self.degraded()
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+        self.active += 1
+        try:
+            yield degraded
+        finally:
+            self.active -= 1
+            self._slots.release()
+
+
+def is_failed_auth(event: LoginEvent) -> bool:
+    """Events from identity providers carry success=false for failed sign-ins"""
+    return event.success is False
+
+
+admission = AdmissionController()
+
+metrics.describe_counter("shed_events_total", "Ingest requests rejected by admission control")
+metrics.register_gauge("admission_active_evaluations", "Evaluations currently running", lambda: admission.active)
+metrics.register_gauge("admission_queued_evaluations", "Requests waiting for an evaluation slot", lambda: admission.waiting)
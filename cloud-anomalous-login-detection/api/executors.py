@@ -0,0 +1,121 @@
+# api/executors.py
+"""
+Sized pools for the blocking work behind the API, so the event loop only
+parses, admits and answers requests:
+
+- io: file and SQLite reads of the query endpoints (IO_THREADS)
+- evaluation: storing and evaluating ingested events (EVAL_THREADS, one per admission slot)
+- ml: processes scoring the models (ML_PROCESSES). Evaluation threads look
+  features up in the score cache themselves and only send the misses there,
+  waiting without holding the GIL, so scoring never competes with the loop.
+  The processes map the shared model file (worker/model_store.py) instead of
+  loading their own copies.
+
+Log records are handed to a queue and written by a listener thread.
+"""
+import logging
+import logging.handlers
+import multiprocessing
+import os
+import queue
+from concurrent.futures import ProcessPoolExecutor
+
+from anyio import CapacityLimiter, to_thread
+
+from api.admission import MAX_CONCURRENT_EVALUATIONS
+from security import rule_engine
+
+#configurations
+IO_THREADS = 8
+EVAL_THREADS = MAX_CONCURRENT_EVALUATIONS
+ML_PROCESSES = max(0, min(4, (os.cpu_count() or 1) - 1))   # 0: score inside the evaluation threads
+LOG_LEVEL = logging.INFO
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+logger = logging.getLogger(__name__)
+
+_limiters = {}
+_ml_pool = None
+_log_listener = None
+
+
+async def run_io(fn, *args):
+    return await to_thread.run_sync(fn, *args, limiter=_limiters["io"])
+
+
+async def run_eval(fn, *args):
+    return await to_thread.run_sync(fn, *args, limiter=_limiters["eval"])
+
+
+def _load_models():
+    # runs once in every ML process, so the first event it scores doesn't wait for the models
+    from worker import ensemble  # noqa: F401
+
+
+def _start_ml_pool():
+    global _ml_pool
+    if ML_PROCESSES <= 0 or not rule_engine.ml_available():
+        _ml_pool = None
+        rule_engine.set_ml_executor(None)
+        return
+    # spawn: forking a process that already runs threads can copy held locks
+    _ml_pool = ProcessPoolExecutor(
+        ML_PROCESSES, mp_context=multiprocessing.get_context("spawn"), initializer=_load_models
+    )
+    rule_engine.set_ml_executor(_ml_pool)
+
+
+def _stop_ml_pool():
+    global _ml_pool
+    rule_engine.set_ml_executor(None)
+    if _ml_pool is not None:
+        _ml_pool.shutdown(wait=True, cancel_futures=True)
+        _ml_pool = None
+
+
+def restart_ml_pool():
+    """New ML processes, e.g. so they load retrained models"""
+    old = _ml_pool
+    # new submissions go to the new pool first; scores already running in the old
+    # one finish, and threads that still submit to it retry on the new one
+    _start_ml_pool()
+    if old is not None:
+        old.shutdown(wait=True)
+
+
+def _start_logging():
+    global _log_listener
+    records = queue.SimpleQueue()
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    _log_listener = logging.handlers.QueueListener(records, handler)
+    _log_listener.start()
+    root = logging.getLogger()
+    root.addHandler(logging.handlers.QueueHandler(records))
+    root.setLevel(LOG_LEVEL)
+
+
+def _stop_logging():
+    global _log_listener
+    root = logging.getLogger()
+    for handler in [h for h in root.handlers if isinstance(h, logging.handlers.QueueHandler)]:
+        root.removeHandler(handler)
+    _log_listener.stop()
+    _log_listener = None
+
+
+def start():
+    """Create the pools; call from inside the running event loop."""
+    if _log_listener is None:
+        _start_logging()
+    _limiters["io"] = CapacityLimiter(IO_THREADS)
+    _limiters["eval"] = CapacityLimiter(EVAL_THREADS)
+    _start_ml_pool()
+    logger.info("pools: %d io threads, %d evaluation threads, %d ML processes",
+                IO_THREADS, EVAL_THREADS, ML_PROCESSES if _ml_pool is not None else 0)
+
+
+def stop():
+    _stop_ml_pool()
+    if _log_listener is not None:
+        _stop_logging()
@@ -1,12 +1,53 @@
-from fastapi import FastAPI, Request
+import logging
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
-import json
 from datetime import datetime
 import os
+import threading
+import zlib
+
+import msgspec
+
+from security.rule_engine import evaluate_batch, evaluate_login, ml_cache_stats, ml_score_stats, reload_models  # ✅ import rule engine
+from security.geoip_enrich import ip_to_geo
+from security.device_filter import revoke_device
+from security import attack_graph, metrics, password_digest, profiler, snapshot
+from security.results_store import count_results, query_results, to_epoch
+from security import retention, rollups, work_queue
+from security.write_behind import result_writer
+from security.dedupe import IDEMPOTENCY_HEADER, event_key, ingest_dedupe
+from security.bruteforce_det import recent_ip_failures, record_failed_login
+from security.records import LoginEvent, encoder, event_decoder, utc_datetime
+from api import executors
+from api.admission import HOT_IP_FAILURES, RETRY_AFTER_SECONDS, Overloaded, admission, is_failed_auth
+
+
+logger = logging.getLogger(__name__)
+
 
-from security.rule_engine import evaluate_login  # ✅ import rule engine
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # sized thread pools / ML processes for everything that would block the loop, queued logging
+    executors.start()
+    # warm restart: last logins, brute-force windows/locks and device filters from the last run
+    restored = snapshot.restore()
+    logger.info("Detector state restored: %s", restored)
+    snapshot.start()
+    # roll the event log over and archive/expire old history in the background
+    retention.start(DATA_FILE, _events_lock)
+    yield
+    retention.stop()
+    # drain buffered results before the process exits
+    result_writer.close()
+    snapshot.stop()
+    executors.stop()
 
-app = FastAPI()
+
+app = FastAPI(lifespan=lifespan)
 
 # Allow frontend (Streamlit) to call backend
 app.add_middleware(
@@ -17,47 +58,456 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-DATA_FILE = "login_events.json"
+class MsgspecResponse(Response):
+    """JSON response encoded with msgspec (handles Structs, skips jsonable_encoder)"""
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return encoder.encode(content)
+
 
-# Ensure raw events file exists
+# Raw events, one JSON object per line so each event is a single append
+DATA_FILE = "login_events.ndjson"
+LEGACY_DATA_FILE = "login_events.json"
+_events_lock = threading.Lock()   # evaluations run in worker threads
+MAX_BATCH_EVENTS = 10000
+MAX_BATCH_BYTES = 32 << 20        # cap on a batch body, as sent and after gzip decompression
+ENQUEUE_EVENTS = True             # also publish accepted events to the work queue for consumers (scripts/send_event.py)
+EVALUATE_ON_INGEST = work_queue.EVALUATE_IN == "api"   # else /ingest only stores and queues events
+
+# Ensure raw events file exists, carrying over events from the old JSON-array file
 if not os.path.exists(DATA_FILE):
-    with open(DATA_FILE, "w") as f:
-        json.dump([], f)
+    legacy = []
+    if os.path.exists(LEGACY_DATA_FILE):
+        with open(LEGACY_DATA_FILE, "rb") as f:
+            legacy = msgspec.json.decode(f.read())
+    with open(DATA_FILE, "wb") as f:
+        f.writelines(encoder.encode(password_digest.redact(ev)) + b"\n" for ev in legacy)
+
+
+def _persist(bodies: list):
+    with metrics.timed("persist_event"), _events_lock, open(DATA_FILE, "ab") as f:
+        f.write(b"".join(body + b"\n" for body in bodies))
+
+
+def _enqueue(bodies: list):
+    """Hand evaluated events to the consumers; the event log still has them if the queue is unavailable"""
+    if not ENQUEUE_EVENTS:
+        return
+    try:
+        with metrics.timed("enqueue"):
+            work_queue.get_queue().enqueue_many(work_queue.EVENTS_STREAM, bodies)
+    except Exception as e:
+        logger.warning("could not enqueue %d event(s): %s", len(bodies), e)
+        metrics.inc("enqueue_failures_total")
+
+
+metrics.describe_counter("enqueue_failures_total", "Ingest batches that could not be published to the work queue")
+
+
+def _record_failures(events):
+    """
+    Count failed sign-ins towards the brute-force windows and the attack graph
+    of this process, which the hot-IP shedding, the failed_prev_5 feature and
+    the coordinated attack rule read.
+    """
+    for event in events:
+        if is_failed_auth(event):
+            record_failed_login(event.user_id, event.ip)
+
+
+def _store_and_enqueue(events: list) -> list:
+    """Store events for the consumers to evaluate (EVALUATE_ON_INGEST off); their queue offsets"""
+    bodies = [encoder.encode(event) for event in events]
+    _persist(bodies)
+    _record_failures(events)
+    # unlike _enqueue this must not fail quietly: nothing else would evaluate the events
+    with metrics.timed("enqueue"):
+        return work_queue.get_queue().enqueue_many(work_queue.EVENTS_STREAM, bodies)
+
+
+def _store_and_evaluate(event: LoginEvent, score_ml: bool):
+    # ✅ Save raw event
+    body = encoder.encode(event)
+    _persist([body])
+    _enqueue([body])
+    _record_failures([event])
+
+    # ✅ Run anomaly detection (this will also persist the result)
+    return evaluate_login(event, score_ml=score_ml)
+
+
+def _overloaded(status_code: int, reason: str) -> JSONResponse:
+    metrics.inc("shed_events_total", reason=reason)
+    return JSONResponse(
+        status_code=status_code,
+        content={"status": "rejected", "reason": reason},
+        headers={"Retry-After": str(RETRY_AFTER_SECONDS)},
+    )
 
 
 @app.post("/ingest")
 async def ingest(request: Request):
-    data = await request.json()
-    data["timestamp"] = datetime.utcnow().isoformat()
+    with metrics.timed("parse"):
+        body = await request.body()
+        try:
+            event = event_decoder.decode(body)
+        except msgspec.DecodeError as e:   # includes ValidationError
+            raise HTTPException(status_code=422, detail=str(e))
+        # from here on (dedupe, event log, queue, /events) only the digest exists
+        password_digest.redact(event)
 
-    # ✅ Save raw event
-    with open(DATA_FILE, "r+") as f:
-        events = json.load(f)
-        events.append(data)
-        f.seek(0)
-        json.dump(events, f, indent=2)
+    # Drop resubmissions before they are stored, evaluated or counted
+    key = event_key(event, request.headers.get(IDEMPOTENCY_HEADER))
+    duplicate, original = ingest_dedupe.check_and_add(key)
+    if duplicate:
+        metrics.inc("duplicate_events_total")
+        return MsgspecResponse({"status": "duplicate", "evaluation": original})
+
+    event.timestamp = datetime.utcnow().isoformat()
+
+    # Under saturation, failed sign-ins from IPs already failing a lot (counted by
+    # _record_failures) are only counted towards brute-force thresholds instead
+    # of waiting for a full evaluation
+    if admission.saturated() and is_failed_auth(event) and recent_ip_failures(event.ip) >= HOT_IP_FAILURES:
+        record_failed_login(event.user_id, event.ip)
+        ingest_dedupe.discard(key)   # shed, not ingested: the retry after Retry-After must get through
+        return _overloaded(429, "hot_ip")
+
+    try:
+        async with admission.slot() as degraded:
+            if EVALUATE_ON_INGEST:
+                result = await executors.run_eval(_store_and_evaluate, event, not degraded)
+            else:
+                offsets = await executors.run_eval(_store_and_enqueue, [event])
+    except Overloaded:
+        ingest_dedupe.discard(key)
+        return _overloaded(503, "queue_full")
+    except Exception:
+        ingest_dedupe.discard(key)   # let the client's retry through
+        raise
+    metrics.inc("events_total")
+
+    if not EVALUATE_ON_INGEST:
+        ingest_dedupe.set_value(key, None)
+        return MsgspecResponse({"status": "queued", "event": event.public(), "offset": offsets[0]}, status_code=202)
+    ingest_dedupe.set_value(key, result)
+
+    # never echo the password back
+    return MsgspecResponse({"status": "success", "event": event.public(), "evaluation": result})
+
+
+async def _read_body(request: Request, limit: int) -> bytes:
+    """request.body() that stops reading past limit bytes (413)"""
+    too_large = HTTPException(status_code=413, detail=f"body larger than {limit} bytes")
+    length = request.headers.get("content-length", "")
+    if length.isdigit() and int(length) > limit:
+        raise too_large
+    chunks, size = [], 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > limit:
+            raise too_large
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+def _gunzip(body: bytes, limit: int) -> bytes:
+    """gzip.decompress that stops producing output past limit bytes (413)"""
+    out, size = [], 0
+    while body:   # concatenated gzip members, like gzip.decompress
+        d = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        try:
+            chunk = d.decompress(body, limit - size + 1)
+        except zlib.error as e:
+            raise HTTPException(status_code=400, detail=f"invalid gzip body: {e}")
+        size += len(chunk)
+        if size > limit or d.unconsumed_tail:
+            raise HTTPException(status_code=413, detail=f"decompressed body larger than {limit} bytes")
+        if not d.eof:
+            raise HTTPException(status_code=400, detail="invalid gzip body: truncated")
+        out.append(chunk)
+        body = d.unused_data.lstrip(b"\x00")   # gzip allows zero padding after a member
+    return b"".join(out)
+
+
+def _decode_batch(body: bytes, content_type: str):
+    """Yield (LoginEvent | None, error | None) per input record, in input order"""
+    if "ndjson" in content_type or not body.lstrip().startswith(b"["):
+        raws = [line for line in body.split(b"\n") if line.strip()]
+    else:
+        try:
+            raws = msgspec.json.decode(body, type=list[msgspec.Raw])
+        except msgspec.DecodeError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+    if len(raws) > MAX_BATCH_EVENTS:
+        raise HTTPException(status_code=413, detail=f"batch larger than {MAX_BATCH_EVENTS} events")
+    for raw in raws:
+        try:
+            event = password_digest.redact(event_decoder.decode(raw))
+            if event.timestamp:
+                # naive UTC like server-assigned timestamps; rejects unparseable ones up front
+                event.timestamp = utc_datetime(event.timestamp).isoformat()
+            yield event, None
+        except (msgspec.DecodeError, ValueError) as e:
+            yield None, str(e)
+
+
+def _store_and_evaluate_batch(events: list, score_ml: bool) -> list:
+    # one append (and one enqueue) for the whole batch
+    bodies = [encoder.encode(event) for event in events]
+    _persist(bodies)
+    _enqueue(bodies)
+    _record_failures(events)
 
-    # ✅ Run anomaly detection (this will also persist to login_results.json)
-    result = evaluate_login(data)
+    # GeoIP once per distinct IP
+    with metrics.timed("geo_lookup"):
+        geo_by_ip = {ip: ip_to_geo(ip) for ip in {event.ip for event in events}}
+    return evaluate_batch(events, geo_by_ip, score_ml=score_ml)
 
-    return {"status": "success", "event": data, "evaluation": result}
+
+@app.post("/ingest/batch")
+async def ingest_batch(request: Request):
+    """
+    Bulk ingest for log shippers: a JSON array or NDJSON body (Content-Type:
+    application/x-ndjson), optionally gzip-compressed (Content-Encoding: gzip);
+    at most MAX_BATCH_BYTES sent and decompressed, and MAX_BATCH_EVENTS events.
+    Events keep their own timestamps if they have one. Results come back in
+    input order; invalid or failing events are reported individually. With
+    EVALUATE_ON_INGEST off, accepted events come back "queued" with their offsets.
+    """
+    with metrics.timed("parse"):
+        body = await _read_body(request, MAX_BATCH_BYTES)
+        if request.headers.get("content-encoding", "").lower() == "gzip" or body[:2] == b"\x1f\x8b":
+            body = _gunzip(body, MAX_BATCH_BYTES)
+        decoded = list(_decode_batch(body, request.headers.get("content-type", "")))
+
+    now = datetime.utcnow().isoformat()
+    items = [None] * len(decoded)
+    accepted = []   # (index, dedupe key, event)
+    for index, (event, error) in enumerate(decoded):
+        if error is not None:
+            items[index] = {"index": index, "status": "error", "error": error}
+            continue
+        key = event_key(event)
+        duplicate, original = ingest_dedupe.check_and_add(key)
+        if duplicate:
+            metrics.inc("duplicate_events_total")
+            items[index] = {"index": index, "status": "duplicate", "evaluation": original}
+            continue
+        event.timestamp = event.timestamp or now
+        accepted.append((index, key, event))
+
+    # per-user, time-ordered evaluation so "last login" rules see the right predecessor
+    accepted.sort(key=lambda item: (item[2].user_id, to_epoch(item[2].timestamp)))
+    try:
+        async with admission.slot() as degraded:
+            events = [event for _, _, event in accepted]
+            if EVALUATE_ON_INGEST:
+                outcomes = await executors.run_eval(_store_and_evaluate_batch, events, not degraded)
+            else:
+                offsets = await executors.run_eval(_store_and_enqueue, events)
+    except Overloaded:
+        for _, key, _ in accepted:
+            ingest_dedupe.discard(key)
+        return _overloaded(503, "queue_full")
+    except Exception:
+        for _, key, _ in accepted:
+            ingest_dedupe.discard(key)
+        raise
+    metrics.inc("events_total", len(accepted))
+
+    if EVALUATE_ON_INGEST:
+        for (index, key, _), outcome in zip(accepted, outcomes):
+            if isinstance(outcome, Exception):
+                ingest_dedupe.discard(key)
+                items[index] = {"index": index, "status": "error", "error": str(outcome)}
+            else:
+                ingest_dedupe.set_value(key, outcome)
+                items[index] = {"index": index, "status": "success", "evaluation": outcome}
+    else:
+        for (index, key, _), offset in zip(accepted, offsets):
+            ingest_dedupe.set_value(key, None)
+            items[index] = {"index": index, "status": "queued", "offset": offset}
+
+    failed = sum(1 for item in items if item["status"] == "error")
+    return MsgspecResponse({
+        "status": "partial" if failed else "success",
+        "received": len(items),
+        "failed": failed,
+        "results": items,
+    })
+
+
+def _redacted(line: bytes) -> bytes:
+    # lines written before passwords were digested on ingest
+    if b'"password":' not in line:
+        return line
+    return encoder.encode(password_digest.redact(msgspec.json.decode(line)))
+
+
+def _read_events() -> bytes:
+    with open(DATA_FILE, "rb") as f:
+        lines = [_redacted(line.rstrip(b"\n")) for line in f if line.strip()]
+    # events are stored as JSON already, splice them instead of decoding + re-encoding
+    return b'{"events":[' + b",".join(lines) + b"]}"
 
 
 @app.get("/events")
 async def get_events():
     """Fetch stored login events"""
-    with open(DATA_FILE, "r") as f:
-        events = json.load(f)
-    return {"events": events}
+    return Response(content=await executors.run_io(_read_events), media_type="application/json")
+
+
+def _result_filters(user_id, since, until, min_risk, reason):
+    try:
+        return {
+            "user_id": user_id,
+            "since": to_epoch(since) if since else None,
+            "until": to_epoch(until) if until else None,
+            "min_risk": min_risk,
+            "reason": reason,
+        }
+    except ValueError:
+        raise HTTPException(status_code=400, detail="since/until must be ISO-8601 timestamps")
 
 
 @app.get("/results")
-async def get_results():
-    """Fetch evaluated login results"""
-    results_file = "login_results.json"
-    if os.path.exists(results_file):
-        with open(results_file, "r") as f:
-            results = json.load(f)
+async def get_results(
+    user_id: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    min_risk: Optional[int] = None,
+    reason: Optional[str] = None,
+    limit: int = 1000,
+    offset: int = 0,
+):
+    """Fetch evaluated login results, newest first. `reason` matches by prefix."""
+    filters = _result_filters(user_id, since, until, min_risk, reason)
+    results = await executors.run_io(lambda: query_results(limit=limit, offset=offset, **filters))
+    return MsgspecResponse({"results": results, "count": len(results)})
+
+
+@app.get("/results/count")
+async def get_results_count(
+    user_id: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    min_risk: Optional[int] = None,
+    reason: Optional[str] = None,
+    group_by: Optional[str] = None,
+    limit: int = 100,
+):
+    """Count matching results, optionally grouped by user_id, country, reason or risk_band"""
+    filters = _result_filters(user_id, since, until, min_risk, reason)
+    try:
+        counts = await executors.run_io(lambda: count_results(group_by=group_by, limit=limit, **filters))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"group_by": group_by, "counts": counts}
+
+
+@app.get("/archive")
+async def get_archive(
+    kind: str = "results",
+    user_id: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    limit: int = retention.DEFAULT_ARCHIVE_LIMIT,
+    offset: int = 0,
+):
+    """Archived events or results (oldest first); only the archives overlapping since/until are read"""
+    filters = _result_filters(user_id, since, until, None, None)
+    try:
+        archived = await executors.run_io(
+            retention.query_archive, kind, filters["since"], filters["until"], user_id, limit, offset
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return MsgspecResponse(archived)
+
+
+@app.get("/archive/manifest")
+async def get_archive_manifest():
+    """Archived time ranges with their aggregates, including expired ones"""
+    return MsgspecResponse(await executors.run_io(retention.manifest))
+
+
+@app.post("/archive/run")
+async def run_retention():
+    """Run a retention pass now (rollover, archiving, expiry)"""
+    return await executors.run_io(retention.run_once)
+
+
+@app.delete("/users/{user_id}/devices/{device_id}")
+async def revoke_user_device(user_id: str, device_id: str):
+    """Forget a device so the user's next login from it is flagged as new"""
+    removed = revoke_device(user_id, "device", device_id)
+    return {"status": "revoked" if removed else "not_found", "user_id": user_id, "device_id": device_id}
+
+
+@app.get("/rollups")
+async def get_rollups(resolution: str = "minute", last: int = 60, top: int = 10):
+    """Pre-aggregated counts for the last `last` minute/hour buckets (for the SOC dashboard)"""
+    try:
+        return rollups.summary(resolution=resolution, last=last, top=top)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/stats/attack-clusters")
+async def get_attack_clusters(top: int = 10):
+    """Largest clusters of IPs and users linked by failed logins in the current window"""
+    return {"clusters": await executors.run_io(attack_graph.top_clusters, top)}
+
+
+@app.post("/models/reload")
+async def reload_ml_models():
+    """Load retrained models from the models directory; memoized scores are invalidated"""
+    score_cache = await executors.run_io(reload_models)
+    # ML processes hold the models they started with
+    await executors.run_io(executors.restart_ml_pool)
+    return {"status": "reloaded", "score_cache": score_cache}
+
+
+@app.get("/stats/queue")
+async def get_queue_stats():
+    """Length of the event stream, and lag / pending messages per consumer group"""
+    return await executors.run_io(work_queue.get_queue().stats, work_queue.EVENTS_STREAM)
+
+
+@app.get("/stats/score-cache")
+async def get_score_cache_stats():
+    """Hit rate and size of the memoized ML scores"""
+    return ml_cache_stats()
+
+
+@app.get("/stats/scores")
+async def get_score_stats():
+    """Live percentiles of the raw IF / AE and combined scores across workers, with drift from training"""
+    return await executors.run_io(ml_score_stats)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Per-stage latency histograms, counters and state-size gauges (Prometheus text format)"""
+    return metrics.render_prometheus()
+
+
+@app.post("/debug/profiler")
+async def toggle_profiler(enabled: bool, interval_ms: float = 10.0):
+    """Switch the sampling profiler on or off at runtime"""
+    if enabled:
+        try:
+            changed = profiler.start(interval_ms / 1000.0)
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
     else:
-        results = []
-    return {"results": results}
+        changed = await executors.run_io(profiler.stop)   # joins the sampler thread
+    return {"running": profiler.is_running(), "changed": changed}
+
+
+@app.get("/debug/profiler", response_class=PlainTextResponse)
+async def get_profile(limit: int = 200):
+    """Collected samples as folded stacks (feed to flamegraph.pl or speedscope)"""
+    return profiler.folded(limit)
@@ -0,0 +1,55 @@
+import time
+
+import requests
+import streamlit as st
+
+from utils import fetch_rollups, series_frame, top_frame
+
+st.set_page_config(page_title="SOC Dashboard", page_icon="🛡️", layout="wide")
+st.title("🛡️ Login Risk Dashboard")
+
+# Every refresh reads the API's rollups, never the raw /results history.
+with st.sidebar:
+    resolution = st.selectbox("Resolution", ["minute", "hour"])
+    last = st.slider("Buckets", min_value=5, max_value=24 * 60 if resolution == "minute" else 30 * 24, value=60)
+    top = st.slider("Top N", min_value=5, max_value=50, value=10)
+    refresh = st.number_input("Refresh every (seconds)", min_value=0, value=5, help="0 disables auto refresh")
+
+try:
+    rollup = fetch_rollups(resolution, last, top)
+except requests.RequestException as e:
+    st.error(f"Could not reach the API: {e}")
+    st.stop()
+
+bands = rollup["risk_bands"]
+c1, c2, c3, c4, c5 = st.columns(5)
+c1.metric("Logins", rollup["total"])
+c2.metric("High risk", bands["high"])
+c3.metric("Medium risk", bands["medium"])
+c4.metric("Low risk", bands["low"])
+c5.metric("Avg risk", f"{rollup['avg_risk']:.1f}")
+
+st.subheader(f"Logins per {resolution} by risk band")
+series = series_frame(rollup)
+if series.empty:
+    st.info("No logins in this window yet.")
+else:
+    st.area_chart(series[["low", "medium", "high"]])
+
+left, right = st.columns(2)
+with left:
+    st.subheader("Top users")
+    st.bar_chart(top_frame(rollup["top_users"], "user"))
+    st.subheader("Top reasons")
+    st.bar_chart(top_frame(rollup["top_reasons"], "reason"))
+with right:
+    st.subheader("Top IPs")
+    st.bar_chart(top_frame(rollup["top_ips"], "ip"))
+    st.subheader("Countries")
+    st.bar_chart(top_frame(rollup["countries"], "country"))
+
+st.caption(f"Window starts {rollup['since']} (UTC)")
+
+if refresh:
+    time.sleep(refresh)
+    st.rerun()
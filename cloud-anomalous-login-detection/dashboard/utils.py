@@ -0,0 +1,28 @@
+import pandas as pd
+import requests
+
+API_URL = "http://localhost:8000"  # change if needed
+REQUEST_TIMEOUT = 5
+
+
+def fetch_rollups(resolution: str = "minute", last: int = 60, top: int = 10) -> dict:
+    """Fetch pre-aggregated rollups; the payload size depends on the window, not on history."""
+    r = requests.get(
+        f"{API_URL}/rollups",
+        params={"resolution": resolution, "last": last, "top": top},
+        timeout=REQUEST_TIMEOUT,
+    )
+    r.raise_for_status()
+    return r.json()
+
+
+def series_frame(rollup: dict) -> pd.DataFrame:
+    """Time series of counts per risk band, indexed by bucket start."""
+    df = pd.DataFrame(rollup.get("series", []), columns=["start", "total", "low", "medium", "high"])
+    df["start"] = pd.to_datetime(df["start"])
+    return df.set_index("start")
+
+
+def top_frame(pairs, label: str) -> pd.DataFrame:
+    """[[key, count], ...] -> DataFrame indexed by key, for bar charts."""
+    return pd.DataFrame(pairs, columns=[label, "count"]).set_index(label)
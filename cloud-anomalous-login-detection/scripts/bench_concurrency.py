@@ -0,0 +1,105 @@
+"""
+Ingest throughput and latency of a running API with 1 vs many concurrent
+clients. Every client sends /ingest requests back to back for DURATION seconds;
+with a non-blocking ingest path, throughput should grow with the client count
+until the evaluation pool (or the CPUs) are busy, instead of staying at the
+1-client rate.
+
+A probe requests a cheap endpoint (PROBE_PATH) every PROBE_INTERVAL meanwhile:
+its latency shows how long the event loop is held by work that should be in
+a pool.
+
+Start the API first (uvicorn api.main:app), then from the project root:
+    python -m scripts.bench_concurrency [url] [clients ...]
+e.g. python -m scripts.bench_concurrency http://localhost:8000 1 100
+"""
+import asyncio
+import random
+import sys
+import time
+
+import aiohttp
+
+URL = "http://localhost:8000"
+CLIENTS = (1, 100)
+DURATION = 10.0     # seconds per run
+WARMUP = 2.0        # seconds of traffic before each run, not counted
+PROBE_PATH = "/stats/score-cache"
+PROBE_INTERVAL = 0.05
+IPS = ["8.8.8.8", "1.1.1.1", "9.9.9.9", "208.67.222.222", "223.236.88.110"]
+
+
+def _event(client: int, n: int) -> dict:
+    return {
+        "user_id": f"bench-{client}-{random.randrange(50)}@example.com",
+        "ip": random.choice(IPS),
+        "device_id": f"device-{random.randrange(3)}",
+        "browser": "bench",
+        # unique per request, so the dedupe window never short-circuits one
+        "idempotency_key": f"{client}-{n}-{random.random()}",
+    }
+
+
+async def _client(session, url: str, client: int, until: float, latencies: list, statuses: dict):
+    n = 0
+    while time.perf_counter() < until:
+        n += 1
+        started = time.perf_counter()
+        async with session.post(f"{url}/ingest", json=_event(client, n)) as response:
+            await response.read()
+        latencies.append(time.perf_counter() - started)
+        statuses[response.status] = statuses.get(response.status, 0) + 1
+
+
+async def _probe(session, url: str, until: float, latencies: list):
+    while time.perf_counter() < until:
+        started = time.perf_counter()
+        async with session.get(f"{url}{PROBE_PATH}") as response:
+            await response.read()
+        latencies.append(time.perf_counter() - started)
+        await asyncio.sleep(PROBE_INTERVAL)
+
+
+def _percentile(latencies: list, q: float) -> float:
+    latencies = sorted(latencies)
+    return latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000 if latencies else float("nan")
+
+
+async def run(url: str, clients: int, duration: float) -> dict:
+    connector = aiohttp.TCPConnector(limit=clients + 1)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        warmup_until = time.perf_counter() + WARMUP
+        await asyncio.gather(*(_client(session, url, c, warmup_until, [], {}) for c in range(clients)))
+
+        latencies, probes, statuses = [], [], {}
+        started = time.perf_counter()
+        until = started + duration
+        await asyncio.gather(
+            _probe(session, url, until, probes),
+            *(_client(session, url, c, until, latencies, statuses) for c in range(clients)),
+        )
+        elapsed = time.perf_counter() - started
+
+    return {
+        "clients": clients,
+        "requests": len(latencies),
+        "req_per_s": len(latencies) / elapsed,
+        "p50_ms": _percentile(latencies, 0.50),
+        "p99_ms": _percentile(latencies, 0.99),
+        "probe_p50_ms": _percentile(probes, 0.50),
+        "probe_p99_ms": _percentile(probes, 0.99),
+        "statuses": statuses,
+    }
+
+
+def main():
+    url = sys.argv[1] if len(sys.argv) > 1 else URL
+    counts = [int(c) for c in sys.argv[2:]] or list(CLIENTS)
+    print(f"{'clients':>8} {'requests':>9} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'probe p50':>10} {'probe p99':>10}  statuses")
+    for clients in counts:
+        r = asyncio.run(run(url, clients, DURATION))
+        print(f"{r['clients']:>8} {r['requests']:>9} {r['req_per_s']:>9.1f} {r['p50_ms']:>8.1f} {r['p99_ms']:>8.1f} {r['probe_p50_ms']:>10.1f} {r['probe_p99_ms']:>10.1f}  {r['statuses']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+CPU time of the /ingest codec work per request, before and after the typed schema:
+
+  before: json.loads -> dict, jsonable_encoder + json.dumps for the response,
+          json.dumps(indent=2) for the persisted event and result
+  after:  msgspec decode+validate -> LoginEvent, msgspec encode for the response,
+          persisted event and result
+
+Run from the project root:  python -m scripts.bench_ingest_codec
+"""
+import json
+import time
+
+from fastapi.encoders import jsonable_encoder
+
+from security.records import LoginResult, encoder, event_decoder
+
+N = 20000
+
+SAMPLE_EVENT = {
+    "user_id": "someone@someone.com",
+    "timestamp": "2025-09-12T18:29:17.014528",
+    "ip": "223.236.88.110",
+    "device_id": "Win32",
+    "browser": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) "
+               "Chrome/140.0.0.0 Safari/537.36 Edg/140.0.0.0",
+    "language": "en-US",
+    "password": "someone",
+}
+SAMPLE_GEO = {
+    "ip": "223.236.88.110", "continent": "Asia", "country": "India",
+    "city": "New Delhi", "latitude": 28.6327, "longitude": 77.2198,
+}
+SAMPLE_RESULT = {
+    "user_id": "someone@someone.com",
+    "risk_score": 30,
+    "reasons": ["New device detected", "New browser detected"],
+    "geo": SAMPLE_GEO,
+    "timestamp": "2025-09-12T18:29:17.014528",
+    "ml": {"if_norm": 0.64, "ae_norm": 0.99},
+    "ml_score": 39.4,
+}
+
+
+def before(body: bytes):
+    data = json.loads(body)
+    data["geo"] = SAMPLE_GEO
+    json.dumps(data, indent=2)                                   # persisted event
+    json.dumps(SAMPLE_RESULT, indent=2)                          # persisted result
+    payload = {"status": "success", "event": data, "evaluation": dict(SAMPLE_RESULT)}
+    return json.dumps(jsonable_encoder(payload)).encode()        # response
+
+
+RESULT = LoginResult(**SAMPLE_RESULT)
+
+
+def after(body: bytes):
+    event = event_decoder.decode(body)
+    encoder.encode(event)                                        # persisted event
+    event.geo = SAMPLE_GEO
+    encoder.encode(RESULT)                                       # persisted result
+    return encoder.encode({"status": "success", "event": event.public(), "evaluation": RESULT})
+
+
+def cpu_per_call(fn, body: bytes) -> float:
+    for _ in range(500):
+        fn(body)
+    start = time.process_time()
+    for _ in range(N):
+        fn(body)
+    return (time.process_time() - start) / N
+
+
+if __name__ == "__main__":
+    body = json.dumps(SAMPLE_EVENT).encode()
+    t_before = cpu_per_call(before, body)
+    t_after = cpu_per_call(after, body)
+    print(f"before (json + dicts):      {t_before * 1e6:8.1f} us CPU / request")
+    print(f"after  (msgspec + structs): {t_after * 1e6:8.1f} us CPU / request")
+    print(f"speedup: {t_before / t_after:.1f}x")
@@ -0,0 +1,86 @@
+"""
+Memory of N scoring worker processes, each loading the models and scoring one event:
+
+  private: every worker unpickles the IsolationForest/scaler and loads the AE with torch
+           (what importing the old worker/ensemble.py did)
+  shared:  every worker attaches read-only to the published model file (worker/model_store.py)
+
+Reports summed RSS and PSS (proportional set size: shared pages are split between the
+processes mapping them, so it is the honest "total" figure). Linux only (/proc/*/smaps_rollup).
+
+Run from the project root:  python -m scripts.bench_model_memory [max_workers]
+"""
+import multiprocessing as mp
+import os
+import sys
+
+FEATURES = [3, 2, 10.0, 5000.0, 1, 4]
+
+
+def _memory_kb() -> dict:
+    out = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            key, _, rest = line.partition(":")
+            if key in ("Rss", "Pss"):
+                out[key] = int(rest.split()[0])
+    return out
+
+
+def _private_worker():
+    import joblib
+    import numpy as np
+    import torch
+    from worker.model_store import MODELS_DIR
+
+    scaler = joblib.load(os.path.join(MODELS_DIR, "scaler.pkl"))
+    if_model = joblib.load(os.path.join(MODELS_DIR, "isolation_forest.joblib"))
+    state = torch.load(os.path.join(MODELS_DIR, "autoencoder.pth"), map_location="cpu")
+    Xs = scaler.transform(np.array(FEATURES, dtype=float).reshape(1, -1))
+    if_model.score_samples(Xs)
+    return (scaler, if_model, state)
+
+
+def _shared_worker():
+    from worker import model_store
+
+    models = model_store.attach()
+    models.score(FEATURES)
+    return models
+
+
+def _run(mode, ready, done, results):
+    keep = _private_worker() if mode == "private" else _shared_worker()  # noqa: F841  (held while measured)
+    ready.wait()                      # every worker has loaded: measure together
+    results.put(_memory_kb())
+    done.wait()
+
+
+def measure(mode: str, workers: int) -> dict:
+    ctx = mp.get_context("spawn")     # fresh interpreters, like separate uvicorn/gunicorn workers
+    ready, done = ctx.Barrier(workers + 1), ctx.Barrier(workers + 1)
+    results = ctx.Queue()
+    procs = [ctx.Process(target=_run, args=(mode, ready, done, results)) for _ in range(workers)]
+    for p in procs:
+        p.start()
+    ready.wait()
+    samples = [results.get() for _ in procs]
+    done.wait()
+    for p in procs:
+        p.join()
+    return {key: sum(s[key] for s in samples) for key in ("Rss", "Pss")}
+
+
+if __name__ == "__main__":
+    from worker import model_store
+
+    max_workers = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    model_store.publish()
+    print(f"{'mode':8} {'workers':>7} {'RSS MiB':>9} {'PSS MiB':>9} {'PSS/extra worker':>17}")
+    for mode in ("private", "shared"):
+        one = measure(mode, 1)
+        many = measure(mode, max_workers)
+        per_extra = (many["Pss"] - one["Pss"]) / max(1, max_workers - 1)
+        for n, m in ((1, one), (max_workers, many)):
+            print(f"{mode:8} {n:7d} {m['Rss'] / 1024:9.1f} {m['Pss'] / 1024:9.1f}"
+                  + (f" {per_extra / 1024:14.1f} MiB" if n == max_workers else ""))
@@ -1,12 +1,19 @@
+import argparse
 import time
+import msgspec
 import requests
 from datetime import datetime, timezone
 from pprint import pprint
 from hashlib import sha1
 
 from security.rule_engine import evaluate_login
+from security import password_digest, snapshot
 from security.explainability import explain_result
 from security.alerts import send_email_alert
+from security.dedupe import DedupeWindow, event_key
+from security.results_store import to_epoch
+from security.records import to_dict
+from security.work_queue import EVALUATE_IN, EVENTS_STREAM, VISIBILITY_TIMEOUT, default_consumer, get_queue
 
 from security.bruteforce_det import (
     record_failed_login,
@@ -21,6 +28,13 @@ POLL_INTERVAL_SECONDS = 3
 AUTH_DEMO_PASSWORD = "test123"  # demo password that counts as successful login
 LOCK_ON_SCORE_THRESHOLD = 70
 SEND_EMAIL_ON_LOCK = False
+PROCESSED_WINDOW = 24 * 60 * 60   # how long processed fingerprints are remembered
+STATE_DIR = "consumer_state"      # brute-force windows/locks snapshots (security/snapshot.py); not the API's
+PROCESSED_MAX_KEYS = 100_000
+QUEUE_GROUP = "scorers"          # consumers in the same group share the events
+QUEUE_BATCH = 100
+QUEUE_BLOCK_SECONDS = 5.0
+MAX_DELIVERIES = 5               # an event failing this often is acked and dropped
 
 # -------------------------
 # Helpers
@@ -97,11 +111,13 @@ def handle_failed_login(user_id: str, ip: str):
 def simulate_auth_using_event(event: dict) -> bool:
     """
     Demo auth check: deterministic. Replace this with real auth call later.
-    If frontend includes a password field:
-      success if event['password'] == AUTH_DEMO_PASSWORD
+    If frontend included a password (stored as its digest):
+      success if it matches AUTH_DEMO_PASSWORD
     Otherwise, treat as success (or change logic as needed).
     """
-    if "password" in event:
+    if "password_digest" in event:
+        return event.get("password_digest") == password_digest.digest(AUTH_DEMO_PASSWORD)
+    if "password" in event:   # events stored before passwords were digested
         return event.get("password") == AUTH_DEMO_PASSWORD
     # default: treat as success (you can change to False if you want failures)
     return True
@@ -145,8 +161,14 @@ def simulate_and_process_event(event: dict):
         print(explain_result(norm))
         return
 
-    # 4) success path: call evaluate_login and print explanation once
-    result = evaluate_login(event)
+    # 4) success path: the API already evaluated and stored the login unless
+    # it only queues events for us (EVALUATE_IN = "consumers")
+    if EVALUATE_IN != "consumers":
+        print(f"[{datetime.now(timezone.utc).isoformat()}] SUCCESSFUL LOGIN for user={user_id} ip={ip} (evaluated by the API)")
+        return
+
+    # call evaluate_login and print explanation once
+    result = to_dict(evaluate_login(event))
     # normalize keys so explain_result always has what's expected
     norm = normalize_result_for_explain(result)
     print(f"[{datetime.now(timezone.utc).isoformat()}] SUCCESSFUL LOGIN for user={user_id} ip={ip} ->")
@@ -162,10 +184,39 @@ def fetch_events():
     r.raise_for_status()
     return r.json().get("events", [])
 
+def process_if_new(ev: dict, processed: DedupeWindow, near_dupes: DedupeWindow) -> bool:
+    """
+    Process ev unless it (or a near-duplicate resubmission) was processed already.
+    If processing raises, ev is forgotten again so a redelivery is processed.
+    """
+    fingerprint = event_fingerprint(ev)
+    already, _ = processed.check_and_add(fingerprint)
+    if already:
+        # already processed this exact event — skip
+        return False
+    # near-duplicate resubmission (same user/ip/device/password within the
+    # dedupe window, by event time) — must not count twice towards brute-force
+    try:
+        event_time = to_epoch(ev.get("timestamp", ""))
+    except ValueError:
+        event_time = None
+    near_key = event_key(ev)
+    resubmitted, _ = near_dupes.check_and_add(near_key, now=event_time)
+    if resubmitted:
+        return False
+    try:
+        simulate_and_process_event(ev)
+    except Exception:
+        processed.discard(fingerprint)
+        near_dupes.discard(near_key)
+        raise
+    return True
+
 def run_polling_loop(poll_interval=POLL_INTERVAL_SECONDS):
     print("Starting event poller. Polling", API_URL + "/events")
     last_index = 0
-    seen = set()
+    processed = DedupeWindow(window=PROCESSED_WINDOW, max_keys=PROCESSED_MAX_KEYS)
+    near_dupes = DedupeWindow()
     try:
         while True:
             events = fetch_events()
@@ -174,28 +225,88 @@ def run_polling_loop(poll_interval=POLL_INTERVAL_SECONDS):
                 time.sleep(poll_interval)
                 continue
 
+            if len(events) < last_index:
+                # file was rewritten or rolled over; rely on the fingerprints instead
+                last_index = 0
             new_events = events[last_index:]
             if new_events:
                 print(f"[{datetime.now(timezone.utc).isoformat()}] Found {len(new_events)} new event(s). Processing...")
             for ev in new_events:
-                fp = event_fingerprint(ev)
-                if fp in seen:
-                    # already processed this exact event — skip
-                    continue
                 try:
-                    simulate_and_process_event(ev)
+                    if process_if_new(ev, processed, near_dupes):
+                        time.sleep(0.5)
                 except Exception as e:
                     print("Error processing event:", e)
-                seen.add(fp)
-                time.sleep(0.5)
+                    time.sleep(0.5)
 
             last_index = len(events)
             time.sleep(poll_interval)
     except KeyboardInterrupt:
         print("Poller stopped by user.")
 
+# -------------------------
+# Work queue consumer
+# -------------------------
+def run_queue_consumer(group=QUEUE_GROUP, consumer=None, from_offset=None):
+    """
+    Take events from the API's work queue as a member of a consumer group.
+    Start several consumers with the same group to share the load; events a
+    crashed consumer had not acked are redelivered once their visibility
+    timeout passes; a slow batch extends it for the messages still to do.
+    from_offset replays the group from that offset.
+    """
+    queue = get_queue()
+    consumer = consumer or default_consumer()
+    queue.create_group(EVENTS_STREAM, group, start=0)   # a new group starts with every kept event
+    if from_offset is not None:
+        queue.reset_group(EVENTS_STREAM, group, from_offset)
+    print(f"Consuming {EVENTS_STREAM!r} as {consumer!r} in group {group!r}")
+    processed = DedupeWindow(window=PROCESSED_WINDOW, max_keys=PROCESSED_MAX_KEYS)
+    near_dupes = DedupeWindow()
+    try:
+        while True:
+            messages = queue.pull(EVENTS_STREAM, group, consumer, count=QUEUE_BATCH, block=QUEUE_BLOCK_SECONDS)
+            done = []
+            touched = time.monotonic()
+            for n, message in enumerate(messages):
+                if time.monotonic() - touched > VISIBILITY_TIMEOUT / 2:
+                    # ack what is done and keep the rest of the batch from being
+                    # redelivered to another consumer meanwhile
+                    queue.ack(EVENTS_STREAM, group, done)
+                    done = []
+                    queue.touch(EVENTS_STREAM, group, consumer, [m.offset for m in messages[n:]])
+                    touched = time.monotonic()
+                try:
+                    process_if_new(msgspec.json.decode(message.body), processed, near_dupes)
+                except Exception as e:
+                    print(f"Error processing event {message.offset} (delivery {message.deliveries}):", e)
+                    if message.deliveries < MAX_DELIVERIES:
+                        continue   # not acked: redelivered after the visibility timeout
+                    print(f"Giving up on event {message.offset}")
+                done.append(message.offset)
+            if done:
+                queue.ack(EVENTS_STREAM, group, done)
+    except KeyboardInterrupt:
+        print("Consumer stopped by user.")
+
 if __name__ == "__main__":
-    run_polling_loop()
+    parser = argparse.ArgumentParser(description="Process ingested login events (brute-force handling, explanations)")
+    parser.add_argument("--mode", choices=("queue", "poll"), default="queue",
+                        help="consume the work queue (default) or poll GET /events over HTTP")
+    parser.add_argument("--group", default=QUEUE_GROUP)
+    parser.add_argument("--consumer", default=None, help="consumer name, unique per process (default host-pid)")
+    parser.add_argument("--from-offset", default=None, help="replay the group from this queue offset")
+    args = parser.parse_args()
+    # warm restart: brute-force windows and locks live in this process, not the API
+    print("Detector state restored:", snapshot.restore(STATE_DIR))
+    snapshot.start()
+    try:
+        if args.mode == "poll":
+            run_polling_loop()
+        else:
+            run_queue_consumer(args.group, args.consumer, args.from_offset)
+    finally:
+        snapshot.stop()
 
 
 # some part of the code below is for simulated logins that i have shown in the readme file, the above one is for bruteforcing.
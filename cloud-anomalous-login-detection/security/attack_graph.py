@@ -0,0 +1,232 @@
+# security/attack_graph.py
+"""
+Coordinated attack detection: a bipartite IP <-> user graph of failed logins
+over a sliding window, with connected components kept in a union-find.
+
+Credential stuffing spread over many IPs keeps every single IP under the
+per-IP thresholds in bruteforce_det, but the IPs share target users, so they
+end up in one component whose combined failures / distinct users give it away.
+
+Each failure is one union (O(alpha(n))). Failures leaving the window are
+subtracted from their component's counters; components are not split on
+expiry, instead the union-find is rebuilt from the live failures once the
+expired ones outnumber them (amortised O(1) per failure, memory bounded by the
+failures in the window).
+
+Until then an expired failure can still hold two live components together.
+Components are counted as stale once one of their failures expired, and a
+stale component that would be flagged triggers a rebuild before it is
+reported, so it is only flagged on live failures. Those rebuilds are
+throttled to SPLIT_DUTY of the time: right after one, a stale component can be
+reported merged for at most (1 / SPLIT_DUTY - 1) times the rebuild's duration.
+"""
+import threading
+import time
+from collections import deque
+
+from security import metrics
+
+#configurations
+GRAPH_WINDOW = 60 * 60            # failures older than this leave the graph (seconds)
+GRAPH_MAX_FAILURES = 1_000_000    # hard cap on failures held; the oldest leave early beyond it
+CLUSTER_MIN_IPS = 3               # smaller clusters are left to the per-IP / per-user rules
+CLUSTER_FAIL_THRESHOLD = 100      # combined failures that flag a cluster...
+CLUSTER_USER_THRESHOLD = 20       # ...or distinct users targeted
+CLUSTER_RISK = 40                 # added to a login's risk score when its user or IP is in a flagged cluster
+SPLIT_DUTY = 0.1                  # share of time rebuilds splitting stale flagged components may take
+
+# Union-find over node ids; ids come from _ip_ids / _user_ids
+_parent = []
+_size = []
+# per-root component counters (live failures, live users, live IPs)
+_failures = []
+_users = []
+_ips = []
+_stale = []      # per-root failures expired since the last rebuild (its joins may be gone)
+# per-node live failure count; a node stops counting for its component at 0
+_degree = []
+_ip_ids = {}
+_user_ids = {}
+
+_events = deque()        # (ts, ip node, user node), oldest first
+_expired = 0             # failures expired since the last rebuild
+_next_split = 0.0        # time.monotonic() before which stale components aren't rebuilt
+_lock = threading.Lock()
+
+
+def _find(x: int) -> int:
+    parent = _parent
+    root = x
+    while parent[root] != root:
+        root = parent[root]
+    while parent[x] != root:      # path compression
+        parent[x], x = root, parent[x]
+    return root
+
+
+def _node(ids: dict, key: str, is_ip: bool) -> int:
+    node = ids.get(key)
+    if node is None:
+        node = ids[key] = len(_parent)
+        _parent.append(node)
+        _size.append(1)
+        _failures.append(0)
+        _users.append(0)
+        _ips.append(0)
+        _stale.append(0)
+        _degree.append(0)
+    if _degree[node] == 0:
+        root = _find(node)
+        if is_ip:
+            _ips[root] += 1
+        else:
+            _users[root] += 1
+    return node
+
+
+def _union(a: int, b: int) -> int:
+    a, b = _find(a), _find(b)
+    if a == b:
+        return a
+    if _size[a] < _size[b]:
+        a, b = b, a
+    _parent[b] = a
+    _size[a] += _size[b]
+    _failures[a] += _failures[b]
+    _users[a] += _users[b]
+    _ips[a] += _ips[b]
+    _stale[a] += _stale[b]
+    return a
+
+
+def _add(ts: float, ip: str, user_id: str):
+    ip_node = _node(_ip_ids, ip, True)
+    user_node = _node(_user_ids, user_id, False)
+    _degree[ip_node] += 1
+    _degree[user_node] += 1
+    root = _union(ip_node, user_node)
+    _failures[root] += 1
+    _events.append((ts, ip_node, user_node))
+
+
+def _expire(now: float):
+    global _expired
+    cutoff = now - GRAPH_WINDOW
+    while _events and (_events[0][0] < cutoff or len(_events) > GRAPH_MAX_FAILURES):
+        _, ip_node, user_node = _events.popleft()
+        root = _find(ip_node)
+        _failures[root] -= 1
+        _stale[root] += 1
+        for node, counter in ((ip_node, _ips), (user_node, _users)):
+            _degree[node] -= 1
+            if _degree[node] == 0:
+                counter[root] -= 1
+        _expired += 1
+    if _expired > len(_events):
+        _rebuild()
+
+
+def _rebuild():
+    """Fresh union-find over the live failures: splits components that only expired failures joined"""
+    global _expired, _next_split
+    started = time.monotonic()
+    live = list(_events)
+    ip_names = {node: ip for ip, node in _ip_ids.items()}
+    user_names = {node: user for user, node in _user_ids.items()}
+    for store in (_parent, _size, _failures, _users, _ips, _stale, _degree, _events):
+        store.clear()
+    _ip_ids.clear()
+    _user_ids.clear()
+    for ts, ip_node, user_node in live:
+        _add(ts, ip_names[ip_node], user_names[user_node])
+    _expired = 0
+    finished = time.monotonic()
+    _next_split = finished + (finished - started) * (1 / SPLIT_DUTY - 1)
+    metrics.inc("attack_graph_rebuilds_total")
+
+
+def _split_stale(roots) -> bool:
+    """Rebuild if one of roots is stale and would be flagged (and rebuilds aren't throttled)"""
+    if time.monotonic() < _next_split:
+        return False
+    if any(_stale[root] and _flagged(_stats(root)) for root in roots):
+        _rebuild()
+        return True
+    return False
+
+
+def _roots_of(user_id: str, ip: str) -> list:
+    roots = []
+    for ids, key in ((_user_ids, user_id), (_ip_ids, ip)):
+        node = ids.get(key) if key is not None else None
+        if node is not None and _degree[node]:
+            roots.append(_find(node))
+    return roots
+
+
+def record_failure(user_id: str, ip: str, now: float = None):
+    now = time.time() if now is None else now
+    with _lock:
+        _add(now, ip, user_id)
+        _expire(now)
+
+
+def _stats(root: int) -> dict:
+    return {"failures": _failures[root], "users": _users[root], "ips": _ips[root]}
+
+
+def _flagged(stats: dict) -> bool:
+    return stats["ips"] >= CLUSTER_MIN_IPS and (
+        stats["failures"] >= CLUSTER_FAIL_THRESHOLD or stats["users"] >= CLUSTER_USER_THRESHOLD
+    )
+
+
+def cluster_of(user_id: str = None, ip: str = None, now: float = None):
+    """Live stats of the component containing the user (or else the IP), None if neither has failures"""
+    now = time.time() if now is None else now
+    with _lock:
+        _expire(now)
+        _split_stale(_roots_of(user_id, ip))
+        roots = _roots_of(user_id, ip)
+        return _stats(roots[0]) if roots else None
+
+
+def coordinated_cluster(user_id: str, ip: str, now: float = None):
+    """Stats of a flagged cluster the user or IP belongs to, else None"""
+    now = time.time() if now is None else now
+    with metrics.timed("attack_graph"):
+        with _lock:
+            _expire(now)
+            _split_stale(_roots_of(user_id, ip))
+            found = None
+            for root in _roots_of(user_id, ip):
+                stats = _stats(root)
+                if _flagged(stats) and (found is None or stats["failures"] > found["failures"]):
+                    found = stats
+            return found
+
+
+def cluster_reason(stats: dict) -> str:
+    return f"Coordinated attack: {stats['ips']} IPs, {stats['users']} users, {stats['failures']} failures"
+
+
+def top_clusters(top: int = 10, now: float = None) -> list:
+    """Largest live components by failures (O(nodes), for dashboards)"""
+    now = time.time() if now is None else now
+    with _lock:
+        _expire(now)
+        roots = {_find(node) for node in range(len(_parent)) if _degree[node]}
+        if _split_stale(roots):
+            roots = {_find(node) for node in range(len(_parent)) if _degree[node]}
+        clusters = sorted((_stats(root) for root in roots), key=lambda s: s["failures"], reverse=True)
+    for stats in clusters[:top]:
+        stats["flagged"] = _flagged(stats)
+    return clusters[:top]
+
+
+def size() -> int:
+    return len(_events)
+
+
+metrics.describe_counter("attack_graph_rebuilds_total", "Rebuilds of the IP/user failure graph after expiry")
+metrics.register_gauge("attack_graph_failures", "Failed logins held in the IP/user graph window", size)
@@ -2,6 +2,8 @@ import time
 import threading 
 from collections import defaultdict, deque
 
+from security import attack_graph, changelog, metrics
+
 #configurations
 USER_FAIL_TTL = 60 * 60        # 1 hour window for user fails
 IP_FAIL_TTL = 60 * 60
@@ -25,10 +27,11 @@ def trim_deque(dq, win_sec):
     while dq and (current_time - dq[0]) > win_sec:
         dq.popleft()
 
-def record_failed_login(user_id: str, ip: str):
-    now = time.time()
+def record_failed_login(user_id: str, ip: str, now: float = None):
+    now = time.time() if now is None else now
     key_ui = (user_id, ip)
     with _lock:
+        changelog.record("fail", user_id, ip, now)
         _user_failures[user_id].append(now)
         _ip_failures[ip].append(now)
         _user_ip_failures[key_ui].append(now)
@@ -38,6 +41,7 @@ def record_failed_login(user_id: str, ip: str):
         trim_deque(_user_failures[user_id], USER_FAIL_TTL)
         trim_deque(_ip_failures[ip], IP_FAIL_TTL)
         trim_deque(_user_ip_failures[key_ui], USER_IP_TTL)
+    attack_graph.record_failure(user_id, ip, now)
 
 def get_bruteforce_status(user_id: str, ip: str):
     now = time.time()
@@ -62,16 +66,74 @@ def get_bruteforce_status(user_id: str, ip: str):
     }
 
 
+def recent_user_failures(user_id: str) -> int:
+    """Failures for user in the window, without creating an entry for unknown users"""
+    with _lock:
+        dq = _user_failures.get(user_id)
+        if not dq:
+            return 0
+        trim_deque(dq, USER_FAIL_TTL)
+        return len(dq)
+
+def recent_ip_failures(ip: str) -> int:
+    with _lock:
+        dq = _ip_failures.get(ip)
+        if not dq:
+            return 0
+        trim_deque(dq, IP_FAIL_TTL)
+        return len(dq)
+
+
 def lock_user(user_id: str, duration: int = LOCK_TTL):
     with _lock:
         _user_locks[user_id] = time.time() + duration
+        changelog.record("lock", user_id, _user_locks[user_id])
+    metrics.inc("locks_total")
 
 def unlock_user_if_expired(user_id: str):
     with _lock:
         if user_id in _user_locks and _user_locks[user_id] <= time.time():
             del _user_locks[user_id]
 
+def export_state() -> dict:
+    """
+    Copy of the windows and locks for a snapshot. Takes no lock: call it with
+    _lock held or on a forked copy of the process.
+    """
+    return {
+        "user_failures": {u: list(dq) for u, dq in _user_failures.items() if dq},
+        "ip_failures": {ip: list(dq) for ip, dq in _ip_failures.items() if dq},
+        "user_ip_failures": [[u, ip, list(dq)] for (u, ip), dq in _user_ip_failures.items() if dq],
+        "locks": dict(_user_locks),
+        "ip_users": {ip: list(users) for ip, users in _ip_user_set.items()},
+    }
+
+def restore_state(state: dict):
+    """Merge a snapshot taken by export_state, dropping what has expired since"""
+    now = time.time()
+    with _lock:
+        for store, key, ttl in ((_user_failures, "user_failures", USER_FAIL_TTL), (_ip_failures, "ip_failures", IP_FAIL_TTL)):
+            for k, stamps in state.get(key, {}).items():
+                live = [t for t in stamps if now - t <= ttl]
+                if live:
+                    store[k].extend(live)
+        for u, ip, stamps in state.get("user_ip_failures", []):
+            live = [t for t in stamps if now - t <= USER_IP_TTL]
+            if live:
+                _user_ip_failures[(u, ip)].extend(live)
+        _user_locks.update((u, exp) for u, exp in state.get("locks", {}).items() if exp > now)
+        for ip, users in state.get("ip_users", {}).items():
+            _ip_user_set[ip].update(users)
+    # the failure graph is rebuilt from the (user, ip) windows
+    restored = sorted((t, u, ip) for u, ip, stamps in state.get("user_ip_failures", []) for t in stamps)
+    for t, u, ip in restored:
+        attack_graph.record_failure(u, ip, t)
+
 def should_take_action(user_id: str, ip: str):
+    with metrics.timed("bruteforce"):
+        return _score_bruteforce(user_id, ip)
+
+def _score_bruteforce(user_id: str, ip: str):
     status = get_bruteforce_status(user_id, ip)
     reasons = []
     score = 0
@@ -87,5 +149,17 @@ def should_take_action(user_id: str, ip: str):
     if status["distinct_users_from_ip"] >= CREDENTIAL_STUFFING_THRESHOLD:
         reasons.append("IP attempting many different users (credential stuffing)")
         score += 70
+    cluster = attack_graph.coordinated_cluster(user_id, ip)
+    if cluster:
+        reasons.append(attack_graph.cluster_reason(cluster))
+        score += 70
     return score, reasons
 
+
+# The windows and locks are per process: the API's count the failed sign-ins it
+# ingested, each consumer's (scripts/send_event.py) the events it processed.
+metrics.register_gauge("bruteforce_user_windows", "Users with a failed-login window in this process", lambda: len(_user_failures))
+metrics.register_gauge("bruteforce_ip_windows", "IPs with a failed-login window in this process", lambda: len(_ip_failures))
+metrics.register_gauge("bruteforce_user_ip_windows", "(user, IP) pairs with a failed-login window in this process", lambda: len(_user_ip_failures))
+metrics.register_gauge("bruteforce_ip_user_sets", "IPs with a set of targeted users (credential stuffing) in this process", lambda: len(_ip_user_set))
+metrics.register_gauge("bruteforce_locked_users", "Users with a lock entry in this process (expired ones until unlocked)", lambda: len(_user_locks))
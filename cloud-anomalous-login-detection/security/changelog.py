@@ -0,0 +1,81 @@
+# security/changelog.py
+"""
+Append-only log of detector state changes made since the last snapshot
+(see security/snapshot.py). Each record is a msgpack array [op, *args]
+framed by its length; nothing is recorded until a log has been opened.
+"""
+import os
+import struct
+import threading
+
+import msgspec
+
+_FRAME = struct.Struct("<I")
+_encoder = msgspec.msgpack.Encoder()
+_decoder = msgspec.msgpack.Decoder()
+
+_file = None        # open log, None while not logging (e.g. during restore)
+_size = 0
+_lock = threading.Lock()
+
+
+def record(op: str, *args):
+    """Append one change; cheap no-op when no log is open."""
+    if _file is None:
+        return
+    data = _encoder.encode((op, *args))
+    global _size
+    with _lock:
+        if _file is not None:
+            _file.write(_FRAME.pack(len(data)) + data)
+            _size += _FRAME.size + len(data)
+
+
+def open_log(path: str):
+    """Switch to a new log file; records from now on go there."""
+    global _file, _size
+    new = open(path, "ab", buffering=1 << 16)
+    with _lock:
+        old, _file = _file, new
+        _size = new.tell()
+    if old is not None:
+        old.close()
+
+
+def flush(sync: bool = False):
+    with _lock:
+        if _file is None:
+            return
+        _file.flush()
+        if sync:
+            os.fsync(_file.fileno())
+
+
+def close():
+    global _file
+    with _lock:
+        old, _file = _file, None
+    if old is not None:
+        old.close()
+
+
+def size() -> int:
+    """Bytes in the current log"""
+    return _size
+
+
+def read_log(path: str):
+    """Yield the records of a log; a torn record at the end (crash mid-write) is ignored."""
+    with open(path, "rb") as f:
+        data = f.read()
+    pos = 0
+    while pos + _FRAME.size <= len(data):
+        (length,) = _FRAME.unpack_from(data, pos)
+        start = pos + _FRAME.size
+        if start + length > len(data):
+            break
+        try:
+            yield _decoder.decode(data[start:start + length])
+        except msgspec.DecodeError:
+            break
+        pos = start + length
@@ -0,0 +1,38 @@
+# security/cold_rows.py
+
+from bisect import bisect_left
+
+
+class ColdRows:
+    """
+    Per-user rows restored from a snapshot (security/snapshot.py) that have not
+    been turned back into live objects yet. Modules keep their restored state in
+    columns and take() a user's row the first time the user is seen again, so a
+    restart only has to decode the columns.
+
+    users is sorted (rows are found by binary search, so no index has to be built)
+    and may be shared between modules; `present` is per module.
+    """
+
+    __slots__ = ("users", "present", "remaining")
+
+    def __init__(self, users: list, present: bytearray):
+        self.users = users
+        self.present = present
+        self.remaining = present.count(1)
+
+    def take(self, user_id):
+        """Row of user_id, handed out once; None if there is none (left)."""
+        row = bisect_left(self.users, user_id)
+        if row == len(self.users) or self.users[row] != user_id or not self.present[row]:
+            return None
+        self.present[row] = 0
+        self.remaining -= 1
+        return row
+
+    def items(self):
+        """(user_id, row) for rows not taken yet"""
+        present = self.present
+        for row, user_id in enumerate(self.users):
+            if present[row]:
+                yield user_id, row
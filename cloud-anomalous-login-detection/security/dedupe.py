@@ -0,0 +1,102 @@
+# security/dedupe.py
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from security import metrics, password_digest
+
+#configurations
+DEDUPE_WINDOW = 2.0            # seconds: a repeat of the same key inside this window is a duplicate
+DEDUPE_MAX_KEYS = 100_000      # hard cap on remembered keys, oldest evicted first
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+
+_PENDING = object()
+
+
+def _field(event, name):
+    return event.get(name) if isinstance(event, dict) else getattr(event, name, None)
+
+
+def event_key(event, idempotency_key: str = None) -> str:
+    """
+    Client idempotency key if given, else user|ip|device. The password digest
+    is folded in when present so brute-force attempts with different passwords are
+    not collapsed; only resubmissions of the same attempt are.
+    event is a LoginEvent or an equivalent dict.
+    """
+    key = idempotency_key or _field(event, "idempotency_key")
+    if key:
+        return f"idem|{key}"
+    derived = f"{_field(event, 'user_id')}|{_field(event, 'ip')}|{_field(event, 'device_id')}"
+    digest = _field(event, "password_digest")
+    if digest is None and _field(event, "password") is not None:
+        digest = password_digest.digest(_field(event, "password"))
+    if digest is not None:
+        derived += "|" + digest
+    return derived
+
+
+class DedupeWindow:
+    """
+    Recently seen keys with a fixed expiry (counted from the first sighting) and a
+    fixed upper bound on entries. Keys are stored as 16-byte digests, so memory is
+    bounded by max_keys regardless of key length.
+    """
+
+    def __init__(self, window: float = DEDUPE_WINDOW, max_keys: int = DEDUPE_MAX_KEYS):
+        self.window = window
+        self.max_keys = max_keys
+        self._entries = OrderedDict()   # digest -> [expires_at, value], in insertion order
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _digest(key: str) -> bytes:
+        return hashlib.blake2b(key.encode(), digest_size=16).digest()
+
+    def _expire(self, now: float):
+        entries = self._entries
+        while entries:
+            digest, entry = next(iter(entries.items()))
+            if entry[0] > now and len(entries) < self.max_keys:
+                break
+            del entries[digest]
+
+    def check_and_add(self, key: str, now: float = None):
+        """
+        Returns (is_duplicate, value). value is whatever set_value() stored for the
+        first occurrence, or None if that one is still being processed.
+        """
+        now = time.time() if now is None else now
+        digest = self._digest(key)
+        with self._lock:
+            self._expire(now)
+            entry = self._entries.get(digest)
+            if entry is not None and entry[0] > now:
+                value = entry[1]
+                return True, (None if value is _PENDING else value)
+            self._entries[digest] = [now + self.window, _PENDING]
+            self._entries.move_to_end(digest)
+            return False, None
+
+    def set_value(self, key: str, value):
+        with self._lock:
+            entry = self._entries.get(self._digest(key))
+            if entry is not None:
+                entry[1] = value
+
+    def discard(self, key: str):
+        """Forget a key, e.g. when processing its first occurrence failed and a retry must go through."""
+        with self._lock:
+            self._entries.pop(self._digest(key), None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# Shared window used by /ingest
+ingest_dedupe = DedupeWindow()
+
+metrics.describe_counter("duplicate_events_total", "Events dropped as duplicates before evaluation")
+metrics.register_gauge("dedupe_keys", "Keys held in the ingest dedupe window", lambda: len(ingest_dedupe))
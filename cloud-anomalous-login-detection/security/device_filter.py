@@ -0,0 +1,297 @@
+import hashlib
+import math
+import random
+import threading
+import time
+from array import array
+
+from security import changelog, metrics
+
+#configurations
+DEVICE_FILTER_CAPACITY = 16                    # distinct devices/browsers remembered per user
+DEVICE_FILTER_FP_RATE = 0.01                   # chance an unseen device is reported as known
+DEVICE_FILTER_MAX_AGE = 30 * 24 * 60 * 60      # a device unseen for this long is forgotten
+BUCKET_SIZE = 4
+MAX_KICKS = 64
+
+
+def _fingerprint_bits(fp_rate: float) -> int:
+    # a cuckoo filter with b slots per bucket needs ~log2(2b / p) bits per fingerprint
+    if not 0 < fp_rate < 1:
+        raise ValueError(f"false positive rate must be between 0 and 1, got {fp_rate}")
+    bits = math.ceil(math.log2(2 * BUCKET_SIZE / fp_rate))
+    if bits > 16:
+        raise ValueError(f"false positive rate {fp_rate} needs {bits}-bit fingerprints, slots hold 16 "
+                         f"(lowest is {2 * BUCKET_SIZE / 2 ** 16:.2g})")
+    return max(4, bits)
+
+
+_fingerprint_bits(DEVICE_FILTER_FP_RATE / 2)   # an unachievable DEVICE_FILTER_FP_RATE fails at import
+
+
+class CuckooFilter:
+    """
+    Approximate set of hashed keys: constant time lookups, supports deletion,
+    and costs `fingerprint_bits` (at most 2 bytes) per slot.
+    """
+
+    __slots__ = ("_slots", "_num_buckets", "_fp_mod", "count")
+
+    def __init__(self, capacity: int = DEVICE_FILTER_CAPACITY, fp_rate: float = DEVICE_FILTER_FP_RATE):
+        wanted = max(1, math.ceil(capacity / (BUCKET_SIZE * 0.95)))
+        self._num_buckets = 1 << (wanted - 1).bit_length()   # power of two so xor stays in range
+        self._fp_mod = (1 << _fingerprint_bits(fp_rate)) - 1
+        self._slots = array("H", bytes(2 * self._num_buckets * BUCKET_SIZE))
+        self.count = 0
+
+    def _locate(self, key: bytes):
+        h = int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "little")
+        fp = (h >> 32) % self._fp_mod + 1              # 0 marks an empty slot
+        i1 = h & (self._num_buckets - 1)
+        return fp, i1, self._alt_index(i1, fp)
+
+    def _alt_index(self, index: int, fp: int) -> int:
+        return (index ^ (fp * 0x5BD1E995)) & (self._num_buckets - 1)
+
+    def _bucket_find(self, index: int, fp: int) -> int:
+        base = index * BUCKET_SIZE
+        for pos in range(base, base + BUCKET_SIZE):
+            if self._slots[pos] == fp:
+                return pos
+        return -1
+
+    def __contains__(self, key: bytes) -> bool:
+        fp, i1, i2 = self._locate(key)
+        return self._bucket_find(i1, fp) >= 0 or self._bucket_find(i2, fp) >= 0
+
+    def add(self, key: bytes) -> bool:
+        """Insert key; returns False when the filter is too full to place it."""
+        fp, i1, i2 = self._locate(key)
+        for index in (i1, i2):
+            pos = self._bucket_find(index, 0)
+            if pos >= 0:
+                self._slots[pos] = fp
+                self.count += 1
+                return True
+
+        # both buckets full: evict residents to their alternate bucket
+        saved = self._slots.tobytes()
+        index = random.choice((i1, i2))
+        for _ in range(MAX_KICKS):
+            pos = index * BUCKET_SIZE + random.randrange(BUCKET_SIZE)
+            fp, self._slots[pos] = self._slots[pos], fp
+            index = self._alt_index(index, fp)
+            empty = self._bucket_find(index, 0)
+            if empty >= 0:
+                self._slots[empty] = fp
+                self.count += 1
+                return True
+        self._slots = array("H", saved)
+        return False
+
+    def to_state(self) -> tuple:
+        return self._fp_mod, self._slots.tobytes()
+
+    @classmethod
+    def from_state(cls, fp_mod: int, slots: bytes) -> "CuckooFilter":
+        f = cls.__new__(cls)
+        f._fp_mod = fp_mod
+        f._slots = array("H", slots)
+        f._num_buckets = len(f._slots) // BUCKET_SIZE
+        f.count = len(f._slots) - f._slots.count(0)
+        return f
+
+    def discard(self, key: bytes) -> bool:
+        fp, i1, i2 = self._locate(key)
+        for index in (i1, i2):
+            pos = self._bucket_find(index, fp)
+            if pos >= 0:
+                self._slots[pos] = 0
+                self.count -= 1
+                return True
+        return False
+
+
+def _generation_filter() -> CuckooFilter:
+    # a lookup can be a false positive in either generation, so each gets half the rate
+    return CuckooFilter(fp_rate=DEVICE_FILTER_FP_RATE / 2)
+
+
+class _DeviceHistory:
+    """
+    Two generations of filters. Lookups check both, inserts go to the current one,
+    and the old generation is dropped every MAX_AGE / 2 so stale devices age out.
+    """
+
+    __slots__ = ("current", "previous", "rotated_at")
+
+    def __init__(self, now: float):
+        self.current = _generation_filter()
+        self.previous = None
+        self.rotated_at = now
+
+    def rotate(self, now: float):
+        self.previous = self.current
+        self.current = _generation_filter()
+        self.rotated_at = now
+
+    def age(self, now: float):
+        elapsed = now - self.rotated_at
+        if elapsed > DEVICE_FILTER_MAX_AGE / 2:
+            self.rotate(now)
+            if elapsed > DEVICE_FILTER_MAX_AGE:
+                self.previous = None
+
+    def __contains__(self, key: bytes) -> bool:
+        return key in self.current or (self.previous is not None and key in self.previous)
+
+
+# In-memory store, user_id -> _DeviceHistory
+_histories = {}
+
+# Histories restored from a snapshot, moved into _histories when the user is next seen:
+# ColdRows plus a _ColdFilters
+_cold = None
+_cold_filters = None
+
+_lock = threading.Lock()
+
+
+class _ColdFilters:
+    """
+    Snapshot columns. Every filter has the same size, so current filters are one
+    blob at row * stride; the few previous generations are packed at their own positions.
+    """
+
+    __slots__ = ("fp_mod", "stride", "rotated_at", "previous_pos", "current", "previous")
+
+    def __init__(self, fp_mod: int, stride: int, rotated_at: list, previous_pos: list, current: bytes, previous: bytes):
+        self.fp_mod = fp_mod
+        self.stride = stride              # bytes per filter
+        self.rotated_at = rotated_at
+        self.previous_pos = previous_pos  # filter index in `previous`, -1 for none
+        self.current = current
+        self.previous = previous
+
+    def _filter(self, blob: bytes, index: int) -> CuckooFilter:
+        start = index * self.stride
+        return CuckooFilter.from_state(self.fp_mod, blob[start:start + self.stride])
+
+    def history(self, row: int) -> _DeviceHistory:
+        history = _DeviceHistory.__new__(_DeviceHistory)
+        history.rotated_at = self.rotated_at[row]
+        history.current = self._filter(self.current, row)
+        pos = self.previous_pos[row]
+        history.previous = self._filter(self.previous, pos) if pos >= 0 else None
+        return history
+
+
+def _key(kind: str, value) -> bytes:
+    return f"{kind}\x00{value}".encode()
+
+
+def _history(user_id: str):
+    """Caller holds _lock"""
+    history = _histories.get(user_id)
+    if history is None and _cold is not None:
+        row = _cold.take(user_id)
+        if row is not None:
+            history = _histories[user_id] = _cold_filters.history(row)
+    return history
+
+
+def device_seen(user_id: str, kind: str, value) -> bool:
+    """kind is a namespace such as "device" or "browser"."""
+    with _lock:
+        history = _history(user_id)
+        if history is None:
+            return False
+        history.age(time.time())
+        return _key(kind, value) in history
+
+
+def remember_device(user_id: str, kind: str, value):
+    now = time.time()
+    key = _key(kind, value)
+    with _lock:
+        history = _history(user_id)
+        if history is None:
+            history = _histories[user_id] = _DeviceHistory(now)
+        history.age(now)
+        if key in history.current:
+            return
+        changelog.record("device", user_id, kind, value)
+        if not history.current.add(key):
+            # more distinct devices than capacity: start a fresh generation early
+            history.rotate(now)
+            history.current.add(key)
+
+
+def revoke_device(user_id: str, kind: str, value) -> bool:
+    """
+    Forget a device so its next login is flagged again. A false-positive collision
+    can make this also forget one other device of the same user.
+    """
+    key = _key(kind, value)
+    with _lock:
+        history = _history(user_id)
+        if history is None:
+            return False
+        changelog.record("revoke", user_id, kind, value)
+        removed = history.current.discard(key)
+        if history.previous is not None:
+            removed = history.previous.discard(key) or removed
+        return removed
+
+
+def forget_user(user_id: str):
+    with _lock:
+        changelog.record("forget", user_id)
+        _histories.pop(user_id, None)
+        if _cold is not None:
+            _cold.take(user_id)
+
+
+def export_state() -> tuple:
+    """
+    (fp_mod, filter size in bytes, user_id -> (rotated_at, current slots, previous
+    slots or None)) for a snapshot. Takes no lock: call it with _lock held or on
+    a forked copy of the process.
+    """
+    fp_mod, slots = _generation_filter().to_state()
+    stride = len(slots)
+    state = {}
+
+    def add(user_id, rotated_at, current, previous):
+        if current[0] != fp_mod or len(current[1]) != stride:
+            return   # filter from an older configuration: the user relearns their devices
+        if previous is not None and (previous[0] != fp_mod or len(previous[1]) != stride):
+            previous = None
+        state[user_id] = (rotated_at, current[1], previous[1] if previous is not None else None)
+
+    for user_id, h in _histories.items():
+        add(user_id, h.rotated_at, h.current.to_state(), h.previous.to_state() if h.previous is not None else None)
+    if _cold is not None:
+        cold = _cold_filters
+        for user_id, row in _cold.items():
+            if user_id not in _histories:
+                pos = cold.previous_pos[row]
+                add(user_id, cold.rotated_at[row],
+                    (cold.fp_mod, cold.current[row * cold.stride:(row + 1) * cold.stride]),
+                    (cold.fp_mod, cold.previous[pos * cold.stride:(pos + 1) * cold.stride]) if pos >= 0 else None)
+    return fp_mod, stride, state
+
+
+def restore_state(cold, fp_mod: int, stride: int, rotated_at: list, previous_pos: list, current: bytes, previous: bytes):
+    """Adopt histories restored from a snapshot; see security/cold_rows.py"""
+    global _cold, _cold_filters
+    with _lock:
+        _cold_filters = _ColdFilters(fp_mod, stride, rotated_at, previous_pos, current, previous)
+        _cold = cold
+
+
+def tracked_users() -> int:
+    return len(_histories) + (_cold.remaining if _cold is not None else 0)
+
+
+metrics.register_gauge("device_filter_users", "Users with a known-device filter", tracked_users)
@@ -0,0 +1,103 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+#configurations
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# In-memory registry, exposed in Prometheus text format by /metrics
+_stage_histograms = {}   # stage -> [bucket counts..., +Inf count], sum
+_counters = {}           # (name, labels) -> value
+_counter_help = {}       # name -> help text
+_gauges = {}             # name -> (help text, callable returning a number)
+
+_lock = threading.Lock()
+
+
+def observe(stage: str, seconds: float):
+    idx = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+    with _lock:
+        hist = _stage_histograms.get(stage)
+        if hist is None:
+            hist = _stage_histograms[stage] = [[0] * (len(LATENCY_BUCKETS) + 1), 0.0]
+        hist[0][idx] += 1
+        hist[1] += seconds
+
+
+@contextmanager
+def timed(stage: str):
+    """Record the wall time of the with-block under ingest_stage_seconds{stage=...}"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - start)
+
+
+def describe_counter(name: str, help_text: str):
+    _counter_help[name] = help_text
+
+
+def inc(name: str, amount: float = 1, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def register_gauge(name: str, help_text: str, fn):
+    """fn is called at scrape time, so it must be cheap (len() of a store etc.)"""
+    _gauges[name] = (help_text, fn)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _fmt_labels(labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+def render_prometheus() -> str:
+    lines = []
+    with _lock:
+        hists = {stage: (list(h[0]), h[1]) for stage, h in _stage_histograms.items()}
+        counters = dict(_counters)
+
+    lines.append("# HELP ingest_stage_seconds Time spent in each ingest stage")
+    lines.append("# TYPE ingest_stage_seconds histogram")
+    for stage, (counts, total) in sorted(hists.items()):
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS, counts):
+            cumulative += count
+            lines.append(f'ingest_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+        cumulative += counts[-1]
+        lines.append(f'ingest_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {cumulative}')
+        lines.append(f'ingest_stage_seconds_sum{{stage="{stage}"}} {total}')
+        lines.append(f'ingest_stage_seconds_count{{stage="{stage}"}} {cumulative}')
+
+    seen = set()
+    for (name, labels), value in sorted(counters.items()):
+        if name not in seen:
+            seen.add(name)
+            lines.append(f"# HELP {name} {_counter_help.get(name, name)}")
+            lines.append(f"# TYPE {name} counter")
+        lines.append(f"{name}{_fmt_labels(labels)} {value}")
+
+    for name, (help_text, fn) in sorted(_gauges.items()):
+        try:
+            value = fn()
+        except Exception:
+            continue
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {value}")
+
+    return "\n".join(lines) + "\n"
+
+
+describe_counter("events_total", "Login events accepted by /ingest")
+describe_counter("alerts_total", "Evaluations at or above the alert risk threshold")
+describe_counter("locks_total", "Users locked by the brute-force detector")
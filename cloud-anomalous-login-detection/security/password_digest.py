@@ -0,0 +1,60 @@
+# security/password_digest.py
+"""
+Passwords submitted with login events never reach the event log, the work
+queue or /events: ingest swaps them for a keyed digest (HMAC-SHA256), which is
+all the brute-force handling needs to tell attempts apart or compare against a
+known password. The key is generated once per installation (KEY_FILE, owner
+read-only) and shared by every process started in the same directory, so
+digests match across the API and the consumers but can't be checked against a
+password list without it.
+"""
+import hashlib
+import hmac
+import os
+import threading
+
+#configurations
+KEY_FILE = "password_digest.key"
+KEY_BYTES = 32
+
+_key = None
+_key_lock = threading.Lock()
+
+
+def _load_key() -> bytes:
+    global _key
+    if _key is None:
+        with _key_lock:
+            if _key is None:
+                if not os.path.exists(KEY_FILE):
+                    tmp = f"{KEY_FILE}.{os.getpid()}.tmp"
+                    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+                    with os.fdopen(fd, "wb") as f:
+                        f.write(os.urandom(KEY_BYTES))
+                        f.flush()
+                        os.fsync(f.fileno())
+                    try:
+                        os.link(tmp, KEY_FILE)   # fails if another process got there first; keep theirs
+                    except FileExistsError:
+                        pass
+                    finally:
+                        os.remove(tmp)
+                with open(KEY_FILE, "rb") as f:
+                    _key = f.read()
+    return _key
+
+
+def digest(password: str) -> str:
+    return hmac.new(_load_key(), str(password).encode(), hashlib.sha256).hexdigest()
+
+
+def redact(event):
+    """Replace a LoginEvent's (or event dict's) password with its digest, in place; returns event"""
+    if isinstance(event, dict):
+        password = event.pop("password", None)
+        if password is not None:
+            event["password_digest"] = digest(password)
+    elif event.password is not None:
+        event.password_digest = digest(event.password)
+        event.password = None
+    return event
@@ -0,0 +1,79 @@
+import sys
+import threading
+import time
+from collections import Counter
+
+#configurations
+DEFAULT_INTERVAL = 0.01      # seconds between samples
+MIN_INTERVAL = 0.001         # shorter intervals would keep the sampler busy holding the GIL
+MAX_STACKS = 5000            # distinct stacks kept, further new stacks are counted as "(other)"
+MAX_DEPTH = 64
+
+# Sampling profiler: a background thread periodically grabs the stack of every
+# other thread, so it costs nothing while stopped and very little while running.
+_samples = Counter()
+_state = {"thread": None, "stop": None, "interval": DEFAULT_INTERVAL, "started_at": None}
+
+_lock = threading.Lock()
+
+
+def _collapse(frame) -> str:
+    parts = []
+    while frame is not None and len(parts) < MAX_DEPTH:
+        code = frame.f_code
+        parts.append(f"{code.co_filename.rsplit('/', 1)[-1]}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(parts))
+
+
+def _run(stop: threading.Event, interval: float):
+    own_id = threading.get_ident()
+    while not stop.wait(interval):
+        frames = sys._current_frames()
+        with _lock:
+            for thread_id, frame in frames.items():
+                if thread_id == own_id:
+                    continue
+                stack = _collapse(frame)
+                if stack not in _samples and len(_samples) >= MAX_STACKS:
+                    stack = "(other)"
+                _samples[stack] += 1
+
+
+def start(interval: float = DEFAULT_INTERVAL, reset: bool = True) -> bool:
+    """Start sampling; returns False if already running"""
+    if not interval >= MIN_INTERVAL:   # also rejects nan
+        raise ValueError(f"interval must be at least {MIN_INTERVAL * 1000:g} ms")
+    with _lock:
+        if _state["thread"] is not None:
+            return False
+        if reset:
+            _samples.clear()
+        stop = threading.Event()
+        thread = threading.Thread(target=_run, args=(stop, interval), name="sampling-profiler", daemon=True)
+        _state.update(thread=thread, stop=stop, interval=interval, started_at=time.time())
+    thread.start()
+    return True
+
+
+def stop() -> bool:
+    """Stop sampling and wait for the sampler to exit (up to one interval); False if not running"""
+    with _lock:
+        thread, stop_event = _state["thread"], _state["stop"]
+        if thread is None:
+            return False
+        _state.update(thread=None, stop=None)
+    stop_event.set()
+    thread.join()
+    return True
+
+
+def is_running() -> bool:
+    return _state["thread"] is not None
+
+
+def folded(limit: int = 200) -> str:
+    """Samples in folded-stack format ("a;b;c count"), readable by flamegraph tools"""
+    with _lock:
+        top = _samples.most_common(limit)
+    return "\n".join(f"{stack} {count}" for stack, count in top) + "\n"
@@ -0,0 +1,90 @@
+# security/records.py
+
+from datetime import datetime, timezone
+from typing import Annotated, Optional
+
+import msgspec
+
+# Fixed-field records used on the ingest, evaluation and persistence paths.
+# msgspec Structs are slotted, validate on decode, and encode/decode JSON far
+# faster than json + free-form dicts.
+
+NonEmpty = Annotated[str, msgspec.Meta(min_length=1, max_length=1024)]
+
+# Risk score bands, shared by alerting (rule_engine), the rollups and the
+# risk_band grouping of /results, so they always agree
+HIGH_RISK = 70      # "high", and counted as an alert
+MEDIUM_RISK = 30
+
+
+def risk_band(score: float) -> str:
+    if score >= HIGH_RISK:
+        return "high"
+    if score >= MEDIUM_RISK:
+        return "medium"
+    return "low"
+
+
+class LoginEvent(msgspec.Struct, omit_defaults=True):
+    """A login as posted to /ingest. Unknown fields are ignored."""
+    user_id: NonEmpty
+    ip: NonEmpty
+    device_id: str = "unknown"
+    browser: str = "unknown"
+    language: Optional[str] = None
+    password: Optional[str] = None          # replaced by password_digest on ingest, never stored
+    password_digest: Optional[str] = None   # see security/password_digest.py
+    success: Optional[bool] = None          # set by identity providers for failed sign-ins
+    idempotency_key: Optional[str] = None
+    timestamp: Optional[str] = None         # assigned by the server on ingest
+    geo: Optional[dict] = None              # filled in during evaluation
+
+    def public(self) -> "LoginEvent":
+        """Copy safe to echo back or expose: no password or password digest"""
+        return msgspec.structs.replace(self, password=None, password_digest=None)
+
+
+class LoginResult(msgspec.Struct, omit_defaults=True):
+    user_id: str
+    risk_score: int
+    reasons: list
+    geo: dict
+    timestamp: str
+    ml: Optional[dict] = None
+    ml_score: Optional[float] = None
+    degraded: bool = False
+
+
+class LastLogin(msgspec.Struct, gc=False):
+    geo: dict
+    timestamp: datetime     # naive UTC, see utc_datetime
+
+
+def utc_datetime(timestamp: str) -> datetime:
+    """ISO timestamp -> naive UTC datetime; offsets are converted, naive timestamps are taken as UTC"""
+    dt = datetime.fromisoformat(timestamp)
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+
+event_decoder = msgspec.json.Decoder(LoginEvent)
+result_decoder = msgspec.json.Decoder(LoginResult)
+encoder = msgspec.json.Encoder()
+
+
+def as_event(event) -> LoginEvent:
+    """Accept a LoginEvent or a plain dict (e.g. read back from /events)"""
+    if isinstance(event, LoginEvent):
+        return event
+    return msgspec.convert(event, LoginEvent)
+
+
+def as_result(result) -> LoginResult:
+    if isinstance(result, LoginResult):
+        return result
+    return msgspec.convert(result, LoginResult)
+
+
+def to_dict(record) -> dict:
+    return msgspec.to_builtins(record)
@@ -0,0 +1,242 @@
+# security/results_store.py
+
+import os
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+import msgspec
+
+from security.records import HIGH_RISK, MEDIUM_RISK, LoginResult, as_result, encoder
+
+#configurations
+RESULTS_DB = "login_results.db"
+LEGACY_RESULTS_FILE = "login_results.json"   # imported once into the db if present
+DEFAULT_QUERY_LIMIT = 1000
+MAX_QUERY_LIMIT = 10000
+GROUP_BY_FIELDS = ("user_id", "country", "reason", "risk_band")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    ts REAL NOT NULL,               -- epoch seconds, UTC
+    risk_score INTEGER NOT NULL,
+    ip TEXT,
+    country TEXT,
+    body TEXT NOT NULL              -- the full result as JSON
+);
+CREATE INDEX IF NOT EXISTS idx_results_user_ts ON results(user_id, ts);
+CREATE INDEX IF NOT EXISTS idx_results_ts ON results(ts);
+CREATE INDEX IF NOT EXISTS idx_results_risk_ts ON results(risk_score, ts);
+
+CREATE TABLE IF NOT EXISTS result_reasons (
+    result_id INTEGER NOT NULL,
+    reason TEXT NOT NULL,
+    ts REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_reasons_reason_ts ON result_reasons(reason, ts);
+CREATE INDEX IF NOT EXISTS idx_reasons_result ON result_reasons(result_id);
+"""
+
+# records.risk_band in SQL
+_RISK_BAND = (
+    f"CASE WHEN r.risk_score >= {HIGH_RISK} THEN 'high' WHEN r.risk_score >= {MEDIUM_RISK} THEN 'medium' ELSE 'low' END"
+)
+
+_SYNC_MODES = {"OFF": "OFF", "NORMAL": "NORMAL", "FULL": "FULL"}
+
+_local = threading.local()
+_write_lock = threading.Lock()
+_init_lock = threading.Lock()
+_initialized = set()
+
+
+def to_epoch(timestamp: str) -> float:
+    """ISO timestamp -> epoch seconds; naive timestamps are treated as UTC."""
+    dt = datetime.fromisoformat(timestamp)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+def _connection(path: str = None) -> sqlite3.Connection:
+    path = path or RESULTS_DB
+    conns = getattr(_local, "conns", None)
+    if conns is None:
+        conns = _local.conns = {}
+    conn = conns.get(path)
+    if conn is None:
+        conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conns[path] = conn
+        with _init_lock:
+            if path not in _initialized:
+                conn.executescript(_SCHEMA)
+                _import_legacy(conn)
+                _initialized.add(path)
+    return conn
+
+
+def _row(result: LoginResult):
+    geo = result.geo or {}
+    return (
+        result.user_id,
+        to_epoch(result.timestamp),
+        int(result.risk_score),
+        geo.get("ip"),
+        geo.get("country"),
+        encoder.encode(result).decode(),
+    )
+
+
+def _insert(conn: sqlite3.Connection, results):
+    for result in results:
+        row = _row(result)
+        cur = conn.execute(
+            "INSERT INTO results (user_id, ts, risk_score, ip, country, body) VALUES (?, ?, ?, ?, ?, ?)", row
+        )
+        conn.executemany(
+            "INSERT INTO result_reasons (result_id, reason, ts) VALUES (?, ?, ?)",
+            [(cur.lastrowid, reason, row[1]) for reason in result.reasons],
+        )
+
+
+def _import_legacy(conn: sqlite3.Connection):
+    if not os.path.exists(LEGACY_RESULTS_FILE):
+        return
+    if conn.execute("PRAGMA user_version").fetchone()[0] >= 1:
+        return
+    with open(LEGACY_RESULTS_FILE, "rb") as f:
+        try:
+            legacy = msgspec.json.decode(f.read())
+        except msgspec.DecodeError:
+            legacy = []
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        _insert(conn, [as_result(r) for r in legacy])
+        conn.execute("PRAGMA user_version = 1")
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def insert_results(results, path: str = None, synchronous: str = None):
+    """
+    Insert evaluated results in a single transaction. synchronous ("OFF", "NORMAL",
+    "FULL") sets how hard the commit syncs; FULL costs one fsync per call.
+    """
+    conn = _connection(path)
+    with _write_lock:
+        if synchronous is not None:
+            conn.execute(f"PRAGMA synchronous={_SYNC_MODES[synchronous]}")
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            _insert(conn, results)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+
+def insert_result(result: LoginResult, path: str = None):
+    insert_results([result], path)
+
+
+def oldest_result_ts(path: str = None):
+    """Epoch seconds of the oldest stored result, None if there are none"""
+    return _connection(path).execute("SELECT MIN(ts) FROM results").fetchone()[0]
+
+
+def iter_results(since: float, until: float, path: str = None):
+    """(id, JSON body) of the results with since <= ts < until, oldest first, streamed"""
+    yield from _connection(path).execute(
+        "SELECT id, body FROM results WHERE ts >= ? AND ts < ? ORDER BY ts, id", (since, until)
+    )
+
+
+def delete_results_batch(since: float, until: float, max_id: int, batch_size: int, path: str = None) -> int:
+    """
+    Delete up to batch_size results with since <= ts < until and id <= max_id in
+    one short transaction; returns how many went. Call repeatedly so inserts can
+    interleave with a large delete.
+    """
+    picked = "SELECT id FROM results WHERE ts >= ? AND ts < ? AND id <= ? ORDER BY id LIMIT ?"
+    params = (since, until, max_id, batch_size)
+    conn = _connection(path)
+    with _write_lock:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(f"DELETE FROM result_reasons WHERE result_id IN ({picked})", params)
+            deleted = conn.execute(f"DELETE FROM results WHERE id IN ({picked})", params).rowcount
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    return deleted
+
+
+def _filters(user_id=None, since=None, until=None, min_risk=None, reason=None):
+    clauses, params = [], []
+    if user_id is not None:
+        clauses.append("r.user_id = ?")
+        params.append(user_id)
+    if since is not None:
+        clauses.append("r.ts >= ?")
+        params.append(since)
+    if until is not None:
+        clauses.append("r.ts < ?")
+        params.append(until)
+    if min_risk is not None:
+        clauses.append("r.risk_score >= ?")
+        params.append(min_risk)
+    if reason is not None:
+        # prefix match, so "Impossible travel" finds "Impossible travel: 812 km in 0.50 hr"
+        sub = "SELECT result_id FROM result_reasons WHERE reason >= ? AND reason < ?"
+        params += [reason, reason + "\U0010ffff"]
+        if since is not None:
+            sub += " AND ts >= ?"
+            params.append(since)
+        if until is not None:
+            sub += " AND ts < ?"
+            params.append(until)
+        clauses.append(f"r.id IN ({sub})")
+    where = (" WHERE " + " AND ".join(clauses)) if clauses else ""
+    return where, params
+
+
+def query_results(user_id=None, since=None, until=None, min_risk=None, reason=None,
+                  limit: int = DEFAULT_QUERY_LIMIT, offset: int = 0, path: str = None):
+    """
+    Newest first. since/until are epoch seconds, reason is a prefix of one of the
+    result's reasons.
+    """
+    where, params = _filters(user_id, since, until, min_risk, reason)
+    limit = max(0, min(limit, MAX_QUERY_LIMIT))
+    rows = _connection(path).execute(
+        f"SELECT r.body FROM results r{where} ORDER BY r.ts DESC LIMIT ? OFFSET ?",
+        params + [limit, offset],
+    ).fetchall()
+    return [msgspec.json.decode(body) for (body,) in rows]
+
+
+def count_results(user_id=None, since=None, until=None, min_risk=None, reason=None,
+                  group_by: str = None, limit: int = 100, path: str = None):
+    """Total count, or counts per group_by value (one of GROUP_BY_FIELDS), largest first."""
+    where, params = _filters(user_id, since, until, min_risk, reason)
+    conn = _connection(path)
+    if group_by is None:
+        return conn.execute(f"SELECT COUNT(*) FROM results r{where}", params).fetchone()[0]
+    if group_by not in GROUP_BY_FIELDS:
+        raise ValueError(f"group_by must be one of {', '.join(GROUP_BY_FIELDS)}")
+
+    if group_by == "reason":
+        sql = f"SELECT rr.reason, COUNT(*) FROM results r JOIN result_reasons rr ON rr.result_id = r.id{where} GROUP BY rr.reason"
+    elif group_by == "risk_band":
+        sql = f"SELECT {_RISK_BAND} AS band, COUNT(*) FROM results r{where} GROUP BY band"
+    else:
+        sql = f"SELECT r.{group_by}, COUNT(*) FROM results r{where} GROUP BY r.{group_by}"
+    rows = conn.execute(sql + " ORDER BY 2 DESC LIMIT ?", params + [limit]).fetchall()
+    return {key if key is not None else "unknown": count for key, count in rows}
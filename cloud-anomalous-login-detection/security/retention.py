@@ -0,0 +1,460 @@
+# security/retention.py
+"""
+Retention for the raw event log and the evaluated results.
+
+- hot: the current login_events.ndjson segment and the last HOT_WINDOW of
+  results in the results db, in full detail.
+- archived: older history as gzip NDJSON under ARCHIVE_DIR, with
+  SENSITIVE_FIELDS dropped. manifest.json lists every archive with its time
+  range and aggregates, and query_archive() reads the archives a range touches.
+- expired: archives older than ARCHIVE_TTL are deleted; only their manifest
+  aggregates are kept.
+
+Each pass also trims work queue messages all consumer groups are done with.
+
+The event log rolls over once it reaches ROLLOVER_BYTES or ROLLOVER_INTERVAL.
+Results are archived per UTC day and deleted from the db in PURGE_BATCH sized
+transactions, so ingest never waits long on the db write lock. Archives are
+recorded in the manifest as pending before they are moved into place, so a pass
+interrupted by a crash is finished by the next one rather than repeated.
+"""
+import glob
+import gzip
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+import msgspec
+
+from security import metrics, results_store, work_queue
+from security.records import risk_band
+from security.rollups import reason_kind
+
+logger = logging.getLogger(__name__)
+
+#configurations
+ARCHIVE_DIR = "archive"
+ROLLOVER_BYTES = 64 << 20          # roll the event log over at this size...
+ROLLOVER_INTERVAL = 24 * 60 * 60   # ...or once the current segment is this old (seconds)
+HOT_WINDOW = 7 * 24 * 60 * 60      # results newer than this stay in the results db
+ARCHIVE_TTL = 90 * 24 * 60 * 60    # archives whose newest record is older than this are deleted
+SENSITIVE_FIELDS = ("password", "password_digest")   # never written to an archive
+PURGE_BATCH = 500                  # results deleted per transaction (~10 ms of write lock)
+PURGE_PAUSE = 0.01                 # seconds between delete transactions
+CHECK_INTERVAL = 60                # seconds between retention passes
+TOP_AGGREGATES = 20                # reasons / countries kept per archive
+DEFAULT_ARCHIVE_LIMIT = 1000
+MAX_ARCHIVE_LIMIT = 10000
+
+KINDS = ("events", "results")
+DAY = 24 * 60 * 60
+_SEGMENT_SUFFIX = ".rolling"
+
+_lock = threading.Lock()            # manifest reads/writes
+_pass_lock = threading.Lock()       # one retention pass at a time
+_events_path = None
+_events_lock = None
+_thread = None
+_stop = threading.Event()
+
+
+def _manifest_path() -> str:
+    return os.path.join(ARCHIVE_DIR, "manifest.json")
+
+
+def _load_manifest() -> dict:
+    try:
+        with open(_manifest_path(), "rb") as f:
+            return msgspec.json.decode(f.read())
+    except FileNotFoundError:
+        return {"archives": [], "events_segment_started": None, "pending_delete": None, "pending_archive": None}
+
+
+def _save_manifest(manifest: dict):
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    tmp = _manifest_path() + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(msgspec.json.encode(manifest))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, _manifest_path())
+
+
+def _iso(epoch: float) -> str:
+    return datetime.fromtimestamp(epoch, tz=timezone.utc).isoformat()
+
+
+class _Aggregates:
+    """Counts kept in the manifest for an archive (and after it expires)"""
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        self.count = 0
+        self.first = None
+        self.last = None
+        self.users = set()
+        self.failed = 0
+        self.bands = Counter()
+        self.reasons = Counter()
+        self.countries = Counter()
+
+    def add(self, record: dict, ts: float):
+        self.count += 1
+        self.first = ts if self.first is None else min(self.first, ts)
+        self.last = ts if self.last is None else max(self.last, ts)
+        self.users.add(record.get("user_id"))
+        if self.kind == "events":
+            if record.get("success") is False:
+                self.failed += 1
+            return
+        self.bands[risk_band(record.get("risk_score", 0))] += 1
+        for reason in record.get("reasons") or ():
+            self.reasons[reason_kind(reason)] += 1
+        self.countries[(record.get("geo") or {}).get("country") or "unknown"] += 1
+
+    def to_dict(self) -> dict:
+        out = {"count": self.count, "distinct_users": len(self.users)}
+        if self.kind == "events":
+            out["failed"] = self.failed
+        else:
+            out["risk_bands"] = dict(self.bands)
+            out["reasons"] = dict(self.reasons.most_common(TOP_AGGREGATES))
+            out["countries"] = dict(self.countries.most_common(TOP_AGGREGATES))
+        return out
+
+
+def _compact_line(line: bytes, kind: str, aggregates: _Aggregates):
+    """Decoded record without sensitive fields (None if unreadable), folded into aggregates"""
+    try:
+        record = msgspec.json.decode(line)
+        ts = results_store.to_epoch(record["timestamp"])
+    except (msgspec.DecodeError, KeyError, TypeError, ValueError):
+        return None
+    for field in SENSITIVE_FIELDS:
+        record.pop(field, None)
+    aggregates.add(record, ts)
+    return record
+
+
+def _write_archive(kind: str, name: str, lines) -> dict:
+    """
+    Compress lines into a new archive's .tmp file; returns its manifest entry
+    (None if nothing was kept). _publish() moves it into place.
+    """
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    path = os.path.join(ARCHIVE_DIR, f"{kind}-{name}.ndjson.gz")
+    suffix = 1
+    while os.path.exists(path):   # e.g. late results for a day that was archived already
+        path = os.path.join(ARCHIVE_DIR, f"{kind}-{name}.{suffix}.ndjson.gz")
+        suffix += 1
+    aggregates = _Aggregates(kind)
+    tmp = path + ".tmp"
+    with gzip.open(tmp, "wb") as out:
+        for line in lines:
+            record = _compact_line(line, kind, aggregates)
+            if record is not None:
+                out.write(msgspec.json.encode(record) + b"\n")
+    if not aggregates.count:
+        os.remove(tmp)
+        return None
+    with open(tmp, "rb+") as f:
+        os.fsync(f.fileno())
+    return {
+        "kind": kind,
+        "path": os.path.basename(path),
+        "since": aggregates.first,
+        "until": aggregates.last,
+        "since_iso": _iso(aggregates.first),
+        "until_iso": _iso(aggregates.last),
+        "bytes": os.path.getsize(tmp),
+        "created": time.time(),
+        "expired": None,
+        "aggregates": aggregates.to_dict(),
+    }
+
+
+def _publish(entry: dict, segment: str = None, delete: dict = None) -> bool:
+    """
+    Move a written archive into place and into the manifest, then remove the
+    event log segment it came from / queue its results for deletion (False if
+    the archive file went missing). The
+    manifest records it as pending first, so a pass interrupted anywhere in
+    here is finished by the next one instead of archiving the records again.
+    """
+    pending = {"entry": entry, "segment": segment, "delete": delete}
+    with _lock:
+        manifest = _load_manifest()
+        manifest["pending_archive"] = pending
+        _save_manifest(manifest)
+    return _finish_publish(pending)
+
+
+def _finish_publish(pending: dict) -> bool:
+    entry = pending["entry"]
+    path = os.path.join(ARCHIVE_DIR, entry["path"])
+    if os.path.exists(path + ".tmp"):
+        os.replace(path + ".tmp", path)
+    published = os.path.exists(path)   # else the .tmp was lost: the records are archived again
+    if published and pending["segment"] and os.path.exists(pending["segment"]):
+        os.remove(pending["segment"])
+    with _lock:
+        manifest = _load_manifest()
+        if published:
+            manifest["archives"].append(entry)
+            if pending["delete"]:
+                manifest["pending_delete"] = pending["delete"]
+        manifest["pending_archive"] = None
+        _save_manifest(manifest)
+    if published:
+        metrics.inc("retention_archived_total", entry["aggregates"]["count"], kind=entry["kind"])
+    return published
+
+
+def _recover():
+    """Finish publishing an archive an interrupted pass left pending"""
+    pending = _load_manifest().get("pending_archive")
+    if pending:
+        _finish_publish(pending)
+
+
+# ---- event log ----
+
+def _roll_events(now: float) -> bool:
+    """Swap the event log for an empty one if it is due; the old one is left as a segment"""
+    manifest = _load_manifest()
+    started = manifest.get("events_segment_started")
+    if started is None:
+        with _lock:
+            manifest["events_segment_started"] = now
+            _save_manifest(manifest)
+        return False
+    try:
+        size = os.path.getsize(_events_path)
+    except FileNotFoundError:
+        return False
+    if not size or (size < ROLLOVER_BYTES and now - started < ROLLOVER_INTERVAL):
+        return False
+
+    segment = f"{_events_path}.{int(now * 1000)}{_SEGMENT_SUFFIX}"
+    empty = f"{_events_path}.tmp"
+    open(empty, "wb").close()
+    with _events_lock:
+        # readers always find a file at _events_path
+        os.link(_events_path, segment)
+        os.replace(empty, _events_path)
+    with _lock:
+        manifest = _load_manifest()
+        manifest["events_segment_started"] = now
+        _save_manifest(manifest)
+    metrics.inc("retention_rollovers_total")
+    return True
+
+
+def _archive_segments() -> int:
+    """Compress rolled-over segments (including ones left by a crash) into archives"""
+    archived = 0
+    for segment in sorted(glob.glob(f"{_events_path}.*{_SEGMENT_SUFFIX}")):
+        name = segment[len(_events_path) + 1:-len(_SEGMENT_SUFFIX)]
+        with open(segment, "rb") as f:
+            entry = _write_archive("events", name, (line for line in f if line.strip()))
+        if entry is None:
+            os.remove(segment)
+        else:
+            _publish(entry, segment=segment)
+            archived += entry["aggregates"]["count"]
+    return archived
+
+
+# ---- results ----
+
+def _delete_archived(pending: dict) -> int:
+    """Delete the results of an archived day in small transactions"""
+    deleted = 0
+    while not _stop.is_set():
+        n = results_store.delete_results_batch(pending["since"], pending["until"], pending["max_id"], PURGE_BATCH)
+        deleted += n
+        metrics.inc("retention_purged_rows_total", n)
+        if n < PURGE_BATCH:
+            break
+        time.sleep(PURGE_PAUSE)
+    else:
+        return deleted     # stopping: the manifest still has the deletion pending
+    with _lock:
+        manifest = _load_manifest()
+        manifest["pending_delete"] = None
+        _save_manifest(manifest)
+    return deleted
+
+
+def _archive_results(now: float) -> int:
+    """Move every whole UTC day older than HOT_WINDOW from the db into archives"""
+    pending = _load_manifest().get("pending_delete")
+    if pending:
+        _delete_archived(pending)     # interrupted last time; the archive exists already
+    archived = 0
+    cutoff = (now - HOT_WINDOW) // DAY * DAY
+    while not _stop.is_set():
+        oldest = results_store.oldest_result_ts()
+        if oldest is None or oldest >= cutoff:
+            break
+        since = oldest // DAY * DAY
+        until = since + DAY
+        max_id = 0
+
+        def lines():
+            nonlocal max_id
+            for row_id, body in results_store.iter_results(since, until):
+                max_id = max(max_id, row_id)
+                yield body.encode()
+
+        entry = _write_archive("results", datetime.fromtimestamp(since, tz=timezone.utc).strftime("%Y%m%d"), lines())
+        pending = {"since": since, "until": until, "max_id": max_id}
+        if entry is None:
+            with _lock:
+                manifest = _load_manifest()
+                manifest["pending_delete"] = pending
+                _save_manifest(manifest)
+        elif not _publish(entry, delete=pending):
+            break
+        _delete_archived(pending)
+        archived += entry["aggregates"]["count"] if entry else 0
+    return archived
+
+
+# ---- expiry ----
+
+def _expire(now: float) -> int:
+    """Delete archive files past ARCHIVE_TTL; their manifest entries keep the aggregates"""
+    expired = 0
+    with _lock:
+        manifest = _load_manifest()
+        for entry in manifest["archives"]:
+            if entry["expired"] is None and entry["until"] < now - ARCHIVE_TTL:
+                try:
+                    os.remove(os.path.join(ARCHIVE_DIR, entry["path"]))
+                except FileNotFoundError:
+                    pass
+                entry["expired"] = now
+                expired += 1
+        if expired:
+            _save_manifest(manifest)
+    return expired
+
+
+def run_once(now: float = None) -> dict:
+    """One retention pass: roll over, archive, expire"""
+    now = time.time() if now is None else now
+    with _pass_lock, metrics.timed("retention_pass"):
+        _recover()
+        rolled = _roll_events(now) if _events_path else False
+        events = _archive_segments() if _events_path else 0
+        results = _archive_results(now)
+        expired = _expire(now)
+        trimmed = _trim_queue()
+    return {"rolled_over": rolled, "archived_events": events, "archived_results": results,
+            "expired_archives": expired, "trimmed_queue_messages": trimmed}
+
+
+def _trim_queue() -> int:
+    """Drop work queue messages every consumer group is done with (kept KEEP_ACKED for replay)"""
+    if not os.path.exists(work_queue.QUEUE_DB) and work_queue.QUEUE_BACKEND == "sqlite":
+        return 0
+    try:
+        return work_queue.get_queue().trim(work_queue.EVENTS_STREAM)
+    except Exception as e:
+        logger.warning("could not trim the work queue: %s", e)
+        return 0
+
+
+def _run():
+    while not _stop.wait(CHECK_INTERVAL):
+        try:
+            run_once()
+        except Exception as e:
+            logger.exception("retention pass failed: %s", e)
+            metrics.inc("retention_failures_total")
+
+
+def start(events_path: str, events_lock: threading.Lock):
+    """Manage the event log at events_path (appended to under events_lock) and the results db in the background."""
+    global _thread, _events_path, _events_lock
+    if _thread is not None:
+        return
+    _events_path, _events_lock = events_path, events_lock
+    _stop.clear()
+    _thread = threading.Thread(target=_run, name="retention", daemon=True)
+    _thread.start()
+
+
+def stop():
+    global _thread
+    if _thread is None:
+        return
+    _stop.set()
+    _thread.join()
+    _thread = None
+
+
+# ---- reading ----
+
+def manifest() -> dict:
+    with _lock:
+        return _load_manifest()
+
+
+def query_archive(kind: str, since: float = None, until: float = None, user_id: str = None,
+                  limit: int = DEFAULT_ARCHIVE_LIMIT, offset: int = 0) -> dict:
+    """
+    Archived records of kind ("events" or "results") with since <= ts < until,
+    oldest first. Only archives whose range overlaps the query are read.
+    """
+    if kind not in KINDS:
+        raise ValueError(f"kind must be one of {', '.join(KINDS)}")
+    limit = max(0, min(limit, MAX_ARCHIVE_LIMIT))
+    entries = sorted(
+        (e for e in manifest()["archives"]
+         if e["kind"] == kind
+         and (since is None or e["until"] >= since)
+         and (until is None or e["since"] < until)),
+        key=lambda e: e["since"],
+    )
+    records, skipped = [], 0
+    expired = [e["path"] for e in entries if e["expired"] is not None]
+    for entry in entries:
+        if entry["expired"] is not None or len(records) >= limit:
+            continue
+        with gzip.open(os.path.join(ARCHIVE_DIR, entry["path"]), "rb") as f:
+            for line in f:
+                record = msgspec.json.decode(line)
+                if user_id is not None and record.get("user_id") != user_id:
+                    continue
+                ts = results_store.to_epoch(record["timestamp"])
+                if (since is not None and ts < since) or (until is not None and ts >= until):
+                    continue
+                if skipped < offset:
+                    skipped += 1
+                    continue
+                records.append(record)
+                if len(records) >= limit:
+                    break
+    return {
+        "records": records,
+        "count": len(records),
+        "archives_read": [e["path"] for e in entries if e["expired"] is None],
+        "expired_archives": expired,
+        "expired_aggregates": [e["aggregates"] for e in entries if e["expired"] is not None],
+    }
+
+
+def _archive_bytes() -> int:
+    return sum(e["bytes"] for e in manifest()["archives"] if e["expired"] is None)
+
+
+metrics.describe_counter("retention_rollovers_total", "Event log rollovers")
+metrics.describe_counter("retention_archived_total", "Records written to archives")
+metrics.describe_counter("retention_purged_rows_total", "Archived results deleted from the results db")
+metrics.describe_counter("retention_failures_total", "Retention passes that failed")
+metrics.register_gauge("archive_bytes", "Compressed bytes in live (not expired) archives", _archive_bytes)
@@ -0,0 +1,125 @@
+# security/rollups.py
+
+import threading
+import time
+from collections import Counter, OrderedDict
+from datetime import datetime, timezone
+
+from security.records import LoginResult, risk_band
+from security.results_store import to_epoch
+
+#configurations
+RESOLUTIONS = {"minute": 60, "hour": 60 * 60}
+RETENTION_BUCKETS = {"minute": 24 * 60, "hour": 30 * 24}   # one day of minutes, 30 days of hours
+TOP_TRACKED = 200          # per-bucket counters are pruned back to this many keys (approximate top-k)
+
+
+def reason_kind(reason: str) -> str:
+    """'Impossible travel: 812 km in 0.50 hr' -> 'Impossible travel'"""
+    return reason.split(":", 1)[0]
+
+
+class _Bucket:
+    __slots__ = ("total", "risk_sum", "bands", "users", "ips", "reasons", "countries")
+
+    def __init__(self):
+        self.total = 0
+        self.risk_sum = 0
+        self.bands = Counter()
+        self.users = Counter()
+        self.ips = Counter()
+        self.reasons = Counter()
+        self.countries = Counter()
+
+
+def _bump(counter: Counter, key):
+    counter[key] += 1
+    if len(counter) > 2 * TOP_TRACKED:
+        kept = counter.most_common(TOP_TRACKED)
+        counter.clear()
+        counter.update(dict(kept))
+
+
+# In-memory rollups, resolution -> OrderedDict(bucket_start -> _Bucket)
+_buckets = {name: OrderedDict() for name in RESOLUTIONS}
+
+_lock = threading.Lock()
+
+
+def record_result(result: LoginResult):
+    """Fold one evaluation result into every resolution; O(1) per result."""
+    ts = to_epoch(result.timestamp)
+    geo = result.geo or {}
+    score = result.risk_score
+    with _lock:
+        for name, width in RESOLUTIONS.items():
+            start = int(ts // width) * width
+            buckets = _buckets[name]
+            bucket = buckets.get(start)
+            if bucket is None:
+                newest = next(reversed(buckets), start)
+                bucket = buckets[start] = _Bucket()
+                if start < newest:
+                    # late event: keep buckets ordered by start
+                    for key in sorted(buckets):
+                        buckets.move_to_end(key)
+                oldest_kept = next(reversed(buckets)) - RETENTION_BUCKETS[name] * width
+                while buckets and next(iter(buckets)) < oldest_kept:
+                    buckets.popitem(last=False)
+                if start not in buckets:
+                    continue
+            bucket.total += 1
+            bucket.risk_sum += score
+            bucket.bands[risk_band(score)] += 1
+            _bump(bucket.users, result.user_id)
+            _bump(bucket.ips, geo.get("ip") or "unknown")
+            _bump(bucket.countries, geo.get("country") or "unknown")
+            for reason in result.reasons:
+                _bump(bucket.reasons, reason_kind(reason))
+
+
+def _iso(epoch: float) -> str:
+    return datetime.fromtimestamp(epoch, tz=timezone.utc).isoformat()
+
+
+def summary(resolution: str = "minute", last: int = 60, top: int = 10, now: float = None) -> dict:
+    """
+    Aggregate the last `last` buckets of `resolution`. Cost depends on the window,
+    not on how many results have been recorded.
+    """
+    if resolution not in RESOLUTIONS:
+        raise ValueError(f"resolution must be one of {', '.join(RESOLUTIONS)}")
+    width = RESOLUTIONS[resolution]
+    last = max(1, min(last, RETENTION_BUCKETS[resolution]))
+    now = time.time() if now is None else now
+    first_start = (int(now // width) - last + 1) * width
+
+    total = risk_sum = 0
+    bands, users, ips, reasons, countries = Counter(), Counter(), Counter(), Counter(), Counter()
+    series = []
+    with _lock:
+        for start, bucket in reversed(_buckets[resolution].items()):
+            if start < first_start:
+                break
+            total += bucket.total
+            risk_sum += bucket.risk_sum
+            bands.update(bucket.bands)
+            users.update(bucket.users)
+            ips.update(bucket.ips)
+            reasons.update(bucket.reasons)
+            countries.update(bucket.countries)
+            series.append({"start": _iso(start), "total": bucket.total, **{b: bucket.bands[b] for b in ("low", "medium", "high")}})
+    series.reverse()
+
+    return {
+        "resolution": resolution,
+        "since": _iso(first_start),
+        "total": total,
+        "avg_risk": (risk_sum / total) if total else 0.0,
+        "risk_bands": {b: bands[b] for b in ("low", "medium", "high")},
+        "top_users": users.most_common(top),
+        "top_ips": ips.most_common(top),
+        "top_reasons": reasons.most_common(top),
+        "countries": countries.most_common(top),
+        "series": series,
+    }
@@ -1,69 +1,151 @@
 # security/rule_engine.py
 
-import json
-import os
-from datetime import datetime
+import logging
+import time
+from concurrent.futures import BrokenExecutor, CancelledError
 from geopy.distance import geodesic
 from security.geoip_enrich import ip_to_geo
 from security.explainability import explain_result
+from security.device_filter import device_seen, remember_device
+from security.write_behind import result_writer
+from security.rollups import record_result
+from security.bruteforce_det import recent_user_failures
+from security.records import HIGH_RISK, LastLogin, LoginEvent, LoginResult, as_event, utc_datetime
+from security import attack_graph, changelog, metrics
+
+logger = logging.getLogger(__name__)
 
 # In-memory store of last logins
 user_last_login = {}
 
-# File to store evaluated results
-RESULTS_FILE = "login_results.json"
+# Last logins restored from a snapshot, moved into user_last_login when the user is next seen:
+# ColdRows plus the (timestamps, geo_ids, geos) columns
+_cold = None
+_cold_columns = None
+
+# Results at or above this score are counted as alerts (the "high" risk band)
+ALERT_RISK_THRESHOLD = HIGH_RISK
+
+# delta_minutes used by the models for a user's first login (matches worker/features.py)
+FIRST_LOGIN_DELTA_MINUTES = 99999.0
+
+_ensemble = None   # worker.ensemble once loaded, False if the models can't be loaded
+_ml_executor = None   # process pool scoring the models (api/executors.py); None scores in the calling thread
+
+
+def _ml_scorer():
+    global _ensemble
+    if _ensemble is None:
+        try:
+            from worker import ensemble
+        except Exception as e:   # models or torch unavailable: run rules only
+            logger.warning("ML scoring disabled: %s", e)
+            ensemble = False
+        _ensemble = ensemble
+    return _ensemble or None
+
 
-# Initialize file if not exists
-if not os.path.exists(RESULTS_FILE):
-    with open(RESULTS_FILE, "w") as f:
-        json.dump([], f)
+def ml_available() -> bool:
+    return _ml_scorer() is not None
 
 
-def evaluate_login(event: dict) -> dict:
+def set_ml_executor(executor):
+    """Score in executor's processes from now on (None: in the evaluating thread)"""
+    global _ml_executor
+    _ml_executor = executor
+
+
+def _raw_scores(rows):
     """
-    Evaluate a login event with anomaly rules and store results.
-    event = {
-        "user_id": str,
-        "timestamp": str (ISO format),
-        "ip": str,
-        "device_id": str,
-        "browser": str
-    }
+    Model scores for the rows the score cache missed, in the ML processes if
+    there are any. The cache, its stats, the ml_scoring timing and the score
+    sketches stay in this process, so hits cost no round trip.
     """
-    user_id = event["user_id"]
-    reasons = []
-    risk = 0
+    global _ml_executor
+    executor = _ml_executor
+    while executor is not None:
+        try:
+            return executor.submit(_ensemble.raw_scores, rows).result()
+        except BrokenExecutor as e:
+            if _ml_executor is executor:
+                _ml_executor = None
+                logger.warning("ML process pool unusable, scoring in-process from now on: %s", e)
+        except (RuntimeError, CancelledError):
+            pass   # shut down under us: replaced by a new pool (/models/reload) or stopping
+        # retry on the pool that replaced it, if any
+        executor = _ml_executor if _ml_executor is not executor else None
+    return _ensemble.raw_scores(rows)
 
-    # Geo lookup
-    geo = ip_to_geo(event["ip"])
-    event["geo"] = geo
-    now = datetime.fromisoformat(event["timestamp"])
 
+def _last_login(user_id: str):
     last = user_last_login.get(user_id)
+    if last is None and _cold is not None:
+        row = _cold.take(user_id)
+        if row is not None:
+            timestamps, geo_ids, geos = _cold_columns
+            last = user_last_login[user_id] = LastLogin(
+                geo=geos[geo_ids[row]], timestamp=utc_datetime(timestamps[row])
+            )
+    return last
+
+
+def reload_models() -> dict:
+    """Reload the ML models after retraining; cached scores are dropped"""
+    ensemble = _ml_scorer()
+    if ensemble is None:
+        return {"enabled": False}
+    ensemble.reload_models()
+    return ensemble.cache_stats()
+
+
+def ml_cache_stats() -> dict:
+    ensemble = _ml_scorer()
+    return ensemble.cache_stats() if ensemble is not None else {"enabled": False}
+
+
+def ml_score_stats() -> dict:
+    ensemble = _ml_scorer()
+    return ensemble.score_summary() if ensemble is not None else {"enabled": False}
+
+
+def _apply_rules(event: LoginEvent, geo: dict):
+    """Run the rules for one event, update per-user state, return (result, model features)."""
+    user_id = event.user_id
+    reasons = []
+    risk = 0
+    event.geo = geo
+    now = utc_datetime(event.timestamp)
+
+    rules_started = time.perf_counter()
+    last = _last_login(user_id)
+    dist = 0.0
+    device_change = 0
 
     if last:
         # Impossible travel
         try:
             dist = geodesic(
-                (last["geo"]["latitude"], last["geo"]["longitude"]),
+                (last.geo["latitude"], last.geo["longitude"]),
                 (geo["latitude"], geo["longitude"])
             ).km
-            time_diff = (now - last["timestamp"]).total_seconds() / 3600.0
+            time_diff = (now - last.timestamp).total_seconds() / 3600.0
             if time_diff > 0 and dist / time_diff > 800:  # ~plane speed
                 risk += 50
                 reasons.append(
                     f"Impossible travel: {dist:.0f} km in {time_diff:.2f} hr"
                 )
-        except Exception:
-            pass
+        except (KeyError, TypeError, ValueError) as e:
+            # missing or invalid coordinates for one of the two locations
+            logger.debug("impossible travel skipped for %s: %s", user_id, e)
 
         # New device
-        if event["device_id"] != last["device_id"]:
+        if not device_seen(user_id, "device", event.device_id):
+            device_change = 1
             risk += 20
             reasons.append("New device detected")
 
         # New browser
-        if event["browser"] != last["browser"]:
+        if not device_seen(user_id, "browser", event.browser):
             risk += 10
             reasons.append("New browser detected")
 
@@ -73,32 +155,140 @@ def evaluate_login(event: dict) -> dict:
         reasons.append("Unusual login time")
 
     # New country
-    if last and geo["country"] != last["geo"]["country"]:
+    if last and geo["country"] != last.geo["country"]:
         risk += 30
         reasons.append(f"New country: {geo['country']}")
 
-    # Save last login
-    user_last_login[user_id] = {
-        "geo": geo,
-        "timestamp": now,
-        "device_id": event["device_id"],
-        "browser": event["browser"],
-    }
-
-    result = {
-        "user_id": user_id,
-        "risk_score": min(risk, 100),
-        "reasons": reasons or ["No anomalies detected"],
-        "geo": geo,
-        "timestamp": event["timestamp"],
-    }
-
-    # Persist results to JSON file
-    with open(RESULTS_FILE, "r+") as f:
-        results = json.load(f)
-        results.append(result)
-        f.seek(0)
-        json.dump(results, f, indent=2)
-
-    print(explain_result(result))
+    # User or IP part of a cluster of failures spread over many IPs
+    cluster = attack_graph.coordinated_cluster(user_id, event.ip)
+    if cluster:
+        risk += attack_graph.CLUSTER_RISK
+        reasons.append(attack_graph.cluster_reason(cluster))
+
+    features = [
+        now.hour,
+        now.weekday(),
+        (now - last.timestamp).total_seconds() / 60.0 if last else FIRST_LOGIN_DELTA_MINUTES,
+        dist,
+        device_change,
+        min(recent_user_failures(user_id), 5),
+    ]
+
+    # Save last login; devices/browsers go to the per-user filter instead of raw strings
+    user_last_login[user_id] = LastLogin(geo=geo, timestamp=now)
+    changelog.record("login", user_id, geo, event.timestamp)
+    remember_device(user_id, "device", event.device_id)
+    remember_device(user_id, "browser", event.browser)
+    metrics.observe("rules", time.perf_counter() - rules_started)
+
+    result = LoginResult(
+        user_id=user_id,
+        risk_score=min(risk, 100),
+        reasons=reasons or ["No anomalies detected"],
+        geo=geo,
+        timestamp=event.timestamp,
+    )
+
+    return result, features
+
+
+def _attach_ml(result: LoginResult, ensemble, if_norm: float, ae_norm: float):
+    result.ml = {"if_norm": float(if_norm), "ae_norm": float(ae_norm)}
+    result.ml_score = ensemble.combine(result.risk_score, if_norm, ae_norm)
+
+
+def _finish(result: LoginResult, score_ml: bool):
+    if not score_ml:
+        result.degraded = True
+        metrics.inc("degraded_evaluations_total")
+    if result.risk_score >= ALERT_RISK_THRESHOLD:
+        metrics.inc("alerts_total")
+    record_result(result)
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("%s: %s", result.user_id, explain_result({"risk_score": result.risk_score, "reasons": result.reasons}))
+
+
+def evaluate_login(event: LoginEvent, score_ml: bool = True) -> LoginResult:
+    """
+    Evaluate a login event with anomaly rules (and the ML ensemble unless
+    score_ml is False, e.g. under overload) and store results.
+    event is a LoginEvent (plain dicts with the same fields are converted) and
+    must have its timestamp set.
+    """
+    event = as_event(event)
+
+    # Geo lookup
+    with metrics.timed("geo_lookup"):
+        geo = ip_to_geo(event.ip)
+
+    result, features = _apply_rules(event, geo)
+
+    ensemble = _ml_scorer() if score_ml else None
+    if ensemble is not None:
+        scored = ensemble.score_features(features, _raw_scores)
+        _attach_ml(result, ensemble, scored["if_norm"], scored["ae_norm"])
+    _finish(result, score_ml)
+
+    # Hand the result to the write-behind writer; it is committed to the results store in groups
+    with metrics.timed("persist_result"):
+        result_writer.submit(result)
     return result
+
+
+def evaluate_batch(events, geo_by_ip: dict, score_ml: bool = True) -> list:
+    """
+    Evaluate events in the given order (callers sort by user and time) using
+    pre-resolved geo lookups, one vectorised ML pass and a single persistence
+    hand-off. Returns one LoginResult or Exception per event, in order.
+    """
+    outcomes = []
+    scored_rows = []   # (position, features) of events that passed the rules
+    for event in events:
+        try:
+            result, features = _apply_rules(event, geo_by_ip[event.ip])
+            scored_rows.append((len(outcomes), features))
+            outcomes.append(result)
+        except Exception as e:
+            outcomes.append(e)
+
+    ensemble = _ml_scorer() if score_ml else None
+    if ensemble is not None and scored_rows:
+        if_norms, ae_norms = ensemble.score_batch([features for _, features in scored_rows], _raw_scores)
+        for (pos, _), if_norm, ae_norm in zip(scored_rows, if_norms, ae_norms):
+            _attach_ml(outcomes[pos], ensemble, if_norm, ae_norm)
+
+    results = [o for o in outcomes if isinstance(o, LoginResult)]
+    for result in results:
+        _finish(result, score_ml)
+    with metrics.timed("persist_result"):
+        result_writer.submit_many(results)
+    return outcomes
+
+
+def export_state() -> dict:
+    """
+    user_id -> (ISO timestamp, geo) of every remembered last login, for a
+    snapshot (normally taken on a forked copy of the process).
+    """
+    # list() copies the items atomically, so this is also safe while evaluations run
+    state = {user_id: (last.timestamp.isoformat(), last.geo) for user_id, last in list(user_last_login.items())}
+    if _cold is not None:
+        timestamps, geo_ids, geos = _cold_columns
+        for user_id, row in _cold.items():
+            state.setdefault(user_id, (timestamps[row], geos[geo_ids[row]]))
+    return state
+
+
+def restore_state(cold, timestamps: list, geo_ids: list, geos: list):
+    """Adopt last logins restored from a snapshot; see security/cold_rows.py"""
+    global _cold, _cold_columns
+    _cold_columns = (timestamps, geo_ids, geos)
+    _cold = cold
+
+
+def remembered_users() -> int:
+    return len(user_last_login) + (_cold.remaining if _cold is not None else 0)
+
+
+metrics.describe_counter("degraded_evaluations_total", "Evaluations that skipped ML scoring because of overload")
+metrics.register_gauge("user_last_login_entries", "Users with a remembered last login", remembered_users)
@@ -0,0 +1,363 @@
+# security/snapshot.py
+"""
+Warm restarts: periodic binary snapshots of the in-memory detector state
+(last logins, brute-force windows and locks, known-device filters) plus the
+change log written since (security/changelog.py).
+
+A snapshot forks the process and the child serialises its copy-on-write view
+of the state, so ingest only pauses for the fork itself. Restore loads the
+newest snapshot and replays every change log from its generation on.
+
+The state is per process, so each process needs a directory of its own: restore()
+takes an exclusive lock on the first of STATE_DIR, STATE_DIR.1, STATE_DIR.2, ...
+that no other live process holds. N uvicorn workers (or consumers) sharing a
+working directory therefore each get one of N directories, and get a
+directory back after a restart.
+"""
+import glob
+import itertools
+import logging
+import math
+import operator
+import os
+import threading
+import time
+import warnings
+
+import msgspec
+
+try:
+    import fcntl
+except ImportError:   # no flock(): one process per state directory is up to the deployment
+    fcntl = None
+
+from security import bruteforce_det, changelog, device_filter, metrics, rule_engine
+from security.cold_rows import ColdRows
+from security.records import LastLogin, utc_datetime
+
+logger = logging.getLogger(__name__)
+
+#configurations
+STATE_DIR = "detector_state"
+SNAPSHOT_INTERVAL = 5 * 60            # seconds between snapshots...
+SNAPSHOT_LOG_MAX_BYTES = 8 << 20      # ...or sooner once the change log grows past this (bounds replay time)
+LOG_FLUSH_INTERVAL = 1.0              # change log is flushed this often; a crash loses at most this much
+CHILD_TIMEOUT = 120                   # a snapshot child still running after this is killed
+
+SNAPSHOT_FILE = "snapshot.msgpack"
+LOCK_FILE = "lock"
+_CAN_FORK = hasattr(os, "fork")
+
+
+class Snapshot(msgspec.Struct, array_like=True):
+    generation: int                   # replay change logs with this generation or newer
+    taken_at: float
+    users: list[str]                  # sorted; row order of the per-user columns below
+    login_timestamps: list[str]       # last login per row, "" for none
+    login_geo_ids: list[int]          # index into geos
+    geos: list[dict]                  # distinct geo lookups
+    device_fp_mod: int
+    device_stride: int                # bytes per device filter
+    device_rotated_at: list[float]    # nan for users without a device history
+    device_current: bytes             # current filter of row i at i * stride
+    device_previous_pos: list[int]    # previous filter index in device_previous, -1 for none
+    device_previous: bytes
+    bruteforce: dict
+
+
+_encoder = msgspec.msgpack.Encoder()
+_decoder = msgspec.msgpack.Decoder(Snapshot)
+
+_state_dir = None                     # directory this process claimed, see _claim_state_dir
+_dir_lock = None                      # open LOCK_FILE holding the claim
+_generation = 0                       # generation of the change log currently being written
+_last_snapshot = 0.0
+_snapshot_lock = threading.Lock()     # one snapshot at a time
+_thread = None
+_stop = threading.Event()
+
+
+def _claim_state_dir(base: str) -> str:
+    """Lock the first of base, base.1, base.2, ... no other process holds"""
+    global _state_dir, _dir_lock
+    if _state_dir is not None:
+        return _state_dir
+    for slot in itertools.count():
+        path = base if slot == 0 else f"{base}.{slot}"
+        os.makedirs(path, exist_ok=True)
+        if fcntl is None:
+            break
+        f = open(os.path.join(path, LOCK_FILE), "ab")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)   # released by the kernel if this process dies
+        except BlockingIOError:
+            f.close()
+            continue
+        _dir_lock = f
+        break
+    _state_dir = path
+    return path
+
+
+def _log_path(generation: int) -> str:
+    return os.path.join(_state_dir, f"changes.{generation:08d}.log")
+
+
+def _log_generations() -> list:
+    gens = []
+    for path in glob.glob(os.path.join(_state_dir, "changes.*.log")):
+        try:
+            gens.append(int(os.path.basename(path).split(".")[1]))
+        except ValueError:
+            continue
+    return sorted(gens)
+
+
+def _collect(generation: int) -> Snapshot:
+    logins = rule_engine.export_state()
+    fp_mod, stride, devices = device_filter.export_state()
+    users = sorted(logins.keys() | devices.keys())   # restore looks rows up by binary search
+
+    timestamps, geo_ids, geos, geo_index = [], [], [], {}
+    rotated_at, current, previous_pos, previous = [], [], [], []
+    no_filter = bytes(stride)
+    for user_id in users:
+        login = logins.get(user_id)
+        if login is None:
+            timestamps.append("")
+            geo_ids.append(-1)
+        else:
+            timestamp, geo = login
+            try:
+                key = tuple(geo.items())
+            except (AttributeError, TypeError):
+                key = id(geo)
+            gid = geo_index.get(key)
+            if gid is None:
+                gid = geo_index[key] = len(geos)
+                geos.append(geo)
+            timestamps.append(timestamp)
+            geo_ids.append(gid)
+
+        history = devices.get(user_id)
+        if history is None:
+            rotated_at.append(math.nan)
+            current.append(no_filter)
+            previous_pos.append(-1)
+        else:
+            rotated, cur, prev = history
+            rotated_at.append(rotated)
+            current.append(cur)
+            if prev is None:
+                previous_pos.append(-1)
+            else:
+                previous_pos.append(len(previous))
+                previous.append(prev)
+
+    return Snapshot(
+        generation=generation,
+        taken_at=time.time(),
+        users=users,
+        login_timestamps=timestamps,
+        login_geo_ids=geo_ids,
+        geos=geos,
+        device_fp_mod=fp_mod,
+        device_stride=stride,
+        device_rotated_at=rotated_at,
+        device_current=b"".join(current),
+        device_previous_pos=previous_pos,
+        device_previous=b"".join(previous),
+        bruteforce=bruteforce_det.export_state(),
+    )
+
+
+def _write(snap: Snapshot):
+    path = os.path.join(_state_dir, SNAPSHOT_FILE)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(_encoder.encode(snap))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _wait_child(pid: int) -> bool:
+    deadline = time.monotonic() + CHILD_TIMEOUT
+    while True:
+        done, status = os.waitpid(pid, os.WNOHANG)
+        if done:
+            return os.waitstatus_to_exitcode(status) == 0
+        if time.monotonic() > deadline:
+            os.kill(pid, 9)
+            os.waitpid(pid, 0)
+            return False
+        time.sleep(0.01)
+
+
+def take_snapshot() -> bool:
+    """Snapshot all detector state; returns True once it is safely on disk."""
+    global _generation, _last_snapshot
+    with _snapshot_lock, metrics.timed("snapshot"):
+        generation = _generation + 1
+        snap = None
+        # hold the state locks so no change is half applied, and start the next
+        # change log at exactly the point the snapshot captures; releasing them
+        # before the fork would let changes in that belong to neither
+        with device_filter._lock, bruteforce_det._lock:
+            changelog.open_log(_log_path(generation))
+            _generation = generation
+            pid = None
+            if _CAN_FORK:
+                # Forking a threaded process is safe here because of what the child
+                # does not do. It inherits every lock held at the fork (these two,
+                # and whatever other threads held: changelog, metrics, logging,
+                # sqlite) and none is ever released in it, but it takes none of
+                # them: the export_state() functions read without locking, _write()
+                # uses a new file, and os._exit() skips atexit handlers and the
+                # flushing of inherited buffers (the open change log). It logs
+                # nothing and records no metrics. Python 3.12+ warns about any fork
+                # with threads running; that warning is about the general case.
+                with warnings.catch_warnings():
+                    warnings.simplefilter("ignore", DeprecationWarning)
+                    pid = os.fork()
+            if pid == 0:
+                code = 1
+                try:
+                    _write(_collect(generation))
+                    code = 0
+                finally:
+                    os._exit(code)   # never run the parent's atexit/cleanup in the child
+            if pid is None:
+                # no fork(): copy under the locks (pauses ingest for the copy, not the write)
+                snap = _collect(generation)
+        try:
+            if snap is not None:
+                _write(snap)
+                ok = True
+            else:
+                ok = _wait_child(pid)
+        except Exception as e:
+            logger.exception("snapshot failed: %s", e)
+            ok = False
+
+    _last_snapshot = time.time()
+    if not ok:
+        # keep every change log; the previous snapshot plus the logs still restore everything
+        metrics.inc("snapshot_failures_total")
+        return False
+    for old in _log_generations():
+        if old < generation:
+            os.remove(_log_path(old))
+    metrics.inc("snapshots_total")
+    return True
+
+
+def _replay(record):
+    op, *args = record
+    if op == "login":
+        user_id, geo, timestamp = args
+        rule_engine.user_last_login[user_id] = LastLogin(geo=geo, timestamp=utc_datetime(timestamp))
+    elif op == "fail":
+        bruteforce_det.record_failed_login(*args)
+    elif op == "lock":
+        user_id, expires = args
+        bruteforce_det.restore_state({"locks": {user_id: expires}})
+    elif op == "device":
+        device_filter.remember_device(*args)
+    elif op == "revoke":
+        device_filter.revoke_device(*args)
+    elif op == "forget":
+        device_filter.forget_user(*args)
+
+
+def restore(state_dir: str = None) -> dict:
+    """
+    Claim a state directory (state_dir, default STATE_DIR, or a numbered sibling),
+    load its latest snapshot and replay the change logs after it. Call before start() (nothing
+    is logged until then) and before serving traffic.
+    """
+    global _generation
+    started = time.perf_counter()
+    _claim_state_dir(state_dir or STATE_DIR)
+    from_generation = 0
+    users = 0
+    path = os.path.join(_state_dir, SNAPSHOT_FILE)
+    if os.path.exists(path):
+        try:
+            with open(path, "rb") as f:
+                snap = _decoder.decode(f.read())
+            # per-user state stays in columns until each user is next seen (security/cold_rows.py)
+            rule_engine.restore_state(
+                ColdRows(snap.users, bytearray(map(bool, snap.login_timestamps))),
+                snap.login_timestamps, snap.login_geo_ids, snap.geos,
+            )
+            device_filter.restore_state(
+                # nan != nan marks rows without a device history
+                ColdRows(snap.users, bytearray(map(operator.eq, snap.device_rotated_at, snap.device_rotated_at))),
+                snap.device_fp_mod, snap.device_stride, snap.device_rotated_at,
+                snap.device_previous_pos, snap.device_current, snap.device_previous,
+            )
+            bruteforce_det.restore_state(snap.bruteforce)
+            from_generation = snap.generation
+            users = len(snap.users)
+        except (OSError, msgspec.DecodeError, ValueError) as e:
+            logger.warning("ignoring unreadable snapshot: %s", e)
+
+    replayed = 0
+    generations = [g for g in _log_generations() if g >= from_generation]
+    for generation in generations:
+        for record in changelog.read_log(_log_path(generation)):
+            try:
+                _replay(record)
+            except Exception as e:
+                logger.warning("skipping change log record: %s", e)
+                continue
+            replayed += 1
+    _generation = max([from_generation, *generations])
+    return {
+        "state_dir": _state_dir,
+        "snapshot_users": users,
+        "from_generation": from_generation,
+        "replayed_changes": replayed,
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+def _run():
+    while not _stop.wait(LOG_FLUSH_INTERVAL):
+        changelog.flush()
+        if time.time() - _last_snapshot >= SNAPSHOT_INTERVAL or changelog.size() >= SNAPSHOT_LOG_MAX_BYTES:
+            take_snapshot()
+
+
+def start(state_dir: str = None):
+    """Start logging changes and snapshotting in the background (restore() first to keep the old state)."""
+    global _thread, _last_snapshot, _generation
+    if _thread is not None:
+        return
+    _claim_state_dir(state_dir or STATE_DIR)
+    # a fresh log: appending to the restored one would replay its records twice after the next snapshot
+    _generation += 1
+    changelog.open_log(_log_path(_generation))
+    _last_snapshot = time.time()
+    _stop.clear()
+    _thread = threading.Thread(target=_run, name="state-snapshot", daemon=True)
+    _thread.start()
+
+
+def stop(final_snapshot: bool = True):
+    """Stop the background thread; a final snapshot makes the next start replay nothing."""
+    global _thread
+    if _thread is None:
+        return
+    _stop.set()
+    _thread.join()
+    _thread = None
+    if not (final_snapshot and take_snapshot()):
+        changelog.flush(sync=True)
+    changelog.close()
+
+
+metrics.describe_counter("snapshots_total", "Detector state snapshots written")
+metrics.describe_counter("snapshot_failures_total", "Detector state snapshots that failed (change logs kept)")
+metrics.register_gauge("changelog_bytes", "Bytes in the change log since the last snapshot", changelog.size)
@@ -0,0 +1,335 @@
+# security/work_queue.py
+"""
+Durable work queue between the API and the scorers, with Redis Streams
+semantics: append-only streams, consumer groups that share a stream's
+messages, at-least-once delivery (a pulled message stays pending until it is
+acked; once its visibility timeout passes it is handed to the next consumer
+that pulls), batch pulls and replay from an offset.
+
+The default backend is a SQLite file (QUEUE_DB) that any process on the host
+can share. QUEUE_BACKEND = "redis" uses Redis Streams at QUEUE_URL instead;
+it needs the redis package. Offsets are ints for SQLite and stream IDs
+("1700000000000-0") for Redis.
+"""
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+import msgspec
+
+#configurations
+QUEUE_BACKEND = "sqlite"              # "sqlite" or "redis"
+QUEUE_DB = "work_queue.db"
+QUEUE_URL = "redis://localhost:6379/0"
+VISIBILITY_TIMEOUT = 30.0             # seconds a pulled message stays invisible to other consumers
+DEFAULT_PULL = 100
+POLL_INTERVAL = 0.05                  # how often a blocking pull re-checks an empty SQLite stream
+KEEP_ACKED = 24 * 60 * 60             # acked messages are kept this long for replay (seconds)
+# Where queued login events are evaluated, exactly once:
+#   "api": /ingest evaluates inline; consumers only do the auth / brute-force handling
+#   "consumers": /ingest only stores and queues the event; consumers evaluate it
+EVALUATE_IN = "api"
+
+EVENTS_STREAM = "login_events"
+
+
+class Message(msgspec.Struct):
+    offset: object                    # int (SQLite) or str (Redis)
+    body: bytes
+    deliveries: int = 1               # >1: a previous consumer did not ack in time (0: replayed, not delivered)
+
+
+def default_consumer() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    offset INTEGER PRIMARY KEY AUTOINCREMENT,
+    stream TEXT NOT NULL,
+    body BLOB NOT NULL,
+    enqueued_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_messages_stream ON messages(stream, offset);
+
+CREATE TABLE IF NOT EXISTS groups (
+    stream TEXT NOT NULL,
+    name TEXT NOT NULL,
+    next_offset INTEGER NOT NULL,   -- first offset never delivered to the group
+    PRIMARY KEY (stream, name)
+);
+
+CREATE TABLE IF NOT EXISTS pending (
+    stream TEXT NOT NULL,
+    grp TEXT NOT NULL,
+    offset INTEGER NOT NULL,
+    consumer TEXT NOT NULL,
+    visible_at REAL NOT NULL,       -- redelivered to whoever pulls after this
+    deliveries INTEGER NOT NULL,
+    PRIMARY KEY (stream, grp, offset)
+);
+CREATE INDEX IF NOT EXISTS idx_pending_visible ON pending(stream, grp, visible_at);
+"""
+
+
+class SqliteQueue:
+    def __init__(self, path: str = None):
+        self.path = path or QUEUE_DB
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._initialized = False
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            with self._init_lock:
+                if not self._initialized:
+                    conn.executescript(_SCHEMA)
+                    self._initialized = True
+        return conn
+
+    def _transaction(self, fn):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")   # serialises pulls across processes
+        try:
+            out = fn(conn)
+            conn.execute("COMMIT")
+            return out
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def enqueue(self, stream: str, body: bytes) -> int:
+        return self.enqueue_many(stream, [body])[0]
+
+    def enqueue_many(self, stream: str, bodies: list) -> list:
+        now = time.time()
+
+        def add(conn):
+            return [
+                conn.execute("INSERT INTO messages (stream, body, enqueued_at) VALUES (?, ?, ?)", (stream, body, now)).lastrowid
+                for body in bodies
+            ]
+        return self._transaction(add)
+
+    def _last_offset(self, conn, stream: str) -> int:
+        return conn.execute("SELECT COALESCE(MAX(offset), 0) FROM messages WHERE stream = ?", (stream,)).fetchone()[0]
+
+    def create_group(self, stream: str, group: str, start="$"):
+        """Consumer group reading from start: "$" (new messages only), 0 (everything kept) or an offset"""
+        def create(conn):
+            first = self._last_offset(conn, stream) + 1 if start == "$" else int(start)
+            conn.execute("INSERT OR IGNORE INTO groups (stream, name, next_offset) VALUES (?, ?, ?)", (stream, group, first))
+        self._transaction(create)
+
+    def pull(self, stream: str, group: str, consumer: str, count: int = DEFAULT_PULL,
+             visibility_timeout: float = VISIBILITY_TIMEOUT, block: float = 0) -> list:
+        """
+        Up to count messages for consumer: timed-out pending ones first, then
+        new ones. Waits up to block seconds for a message if there is none.
+        """
+        deadline = time.monotonic() + block
+        while True:
+            messages = self._transaction(lambda conn: self._pull(conn, stream, group, consumer, count, visibility_timeout))
+            if messages or time.monotonic() >= deadline:
+                return messages
+            time.sleep(POLL_INTERVAL)
+
+    def _pull(self, conn, stream, group, consumer, count, visibility_timeout):
+        now = time.time()
+        row = conn.execute("SELECT next_offset FROM groups WHERE stream = ? AND name = ?", (stream, group)).fetchone()
+        if row is None:
+            raise KeyError(f"no consumer group {group!r} on stream {stream!r}")
+        messages = []
+        expired = conn.execute(
+            "SELECT p.offset, m.body, p.deliveries FROM pending p JOIN messages m ON m.offset = p.offset"
+            " WHERE p.stream = ? AND p.grp = ? AND p.visible_at <= ? ORDER BY p.offset LIMIT ?",
+            (stream, group, now, count),
+        ).fetchall()
+        for offset, body, deliveries in expired:
+            conn.execute(
+                "UPDATE pending SET consumer = ?, visible_at = ?, deliveries = ? WHERE stream = ? AND grp = ? AND offset = ?",
+                (consumer, now + visibility_timeout, deliveries + 1, stream, group, offset),
+            )
+            messages.append(Message(offset, body, deliveries + 1))
+        if len(messages) < count:
+            fresh = conn.execute(
+                "SELECT offset, body FROM messages WHERE stream = ? AND offset >= ? ORDER BY offset LIMIT ?",
+                (stream, row[0], count - len(messages)),
+            ).fetchall()
+            if fresh:
+                conn.executemany(
+                    "INSERT INTO pending (stream, grp, offset, consumer, visible_at, deliveries) VALUES (?, ?, ?, ?, ?, 1)",
+                    [(stream, group, offset, consumer, now + visibility_timeout) for offset, _ in fresh],
+                )
+                conn.execute(
+                    "UPDATE groups SET next_offset = ? WHERE stream = ? AND name = ?", (fresh[-1][0] + 1, stream, group)
+                )
+                messages.extend(Message(offset, body) for offset, body in fresh)
+        return messages
+
+    def ack(self, stream: str, group: str, offsets: list) -> int:
+        def delete(conn):
+            return sum(
+                conn.execute("DELETE FROM pending WHERE stream = ? AND grp = ? AND offset = ?", (stream, group, offset)).rowcount
+                for offset in offsets
+            )
+        return self._transaction(delete)
+
+    def touch(self, stream: str, group: str, consumer: str, offsets: list, visibility_timeout: float = VISIBILITY_TIMEOUT):
+        """Extend the visibility timeout of messages consumer is still working on"""
+        visible_at = time.time() + visibility_timeout
+        self._transaction(lambda conn: conn.executemany(
+            "UPDATE pending SET consumer = ?, visible_at = ? WHERE stream = ? AND grp = ? AND offset = ?",
+            [(consumer, visible_at, stream, group, offset) for offset in offsets],
+        ))
+
+    def replay(self, stream: str, from_offset=0, count: int = DEFAULT_PULL) -> list:
+        """Messages from from_offset on, regardless of groups and acks (still kept ones only)"""
+        rows = self._conn().execute(
+            "SELECT offset, body FROM messages WHERE stream = ? AND offset >= ? ORDER BY offset LIMIT ?",
+            (stream, int(from_offset), count),
+        ).fetchall()
+        return [Message(offset, body, 0) for offset, body in rows]
+
+    def reset_group(self, stream: str, group: str, offset):
+        """Redeliver the group everything from offset on (pending messages are dropped)"""
+        def reset(conn):
+            conn.execute("DELETE FROM pending WHERE stream = ? AND grp = ?", (stream, group))
+            conn.execute("UPDATE groups SET next_offset = ? WHERE stream = ? AND name = ?", (int(offset), stream, group))
+        self._transaction(reset)
+
+    def trim(self, stream: str, keep_seconds: float = KEEP_ACKED) -> int:
+        """Delete messages older than keep_seconds that every group has received and acked"""
+        def delete(conn):
+            floor = conn.execute(
+                "SELECT MIN(o) FROM (SELECT next_offset AS o FROM groups WHERE stream = ?"
+                " UNION ALL SELECT offset AS o FROM pending WHERE stream = ?)",
+                (stream, stream),
+            ).fetchone()[0]
+            if floor is None:
+                floor = self._last_offset(conn, stream) + 1
+            return conn.execute(
+                "DELETE FROM messages WHERE stream = ? AND offset < ? AND enqueued_at < ?",
+                (stream, floor, time.time() - keep_seconds),
+            ).rowcount
+        return self._transaction(delete)
+
+    def stats(self, stream: str) -> dict:
+        conn = self._conn()
+        last = self._last_offset(conn, stream)
+        groups = {}
+        for name, next_offset in conn.execute("SELECT name, next_offset FROM groups WHERE stream = ?", (stream,)):
+            pending = conn.execute(
+                "SELECT COUNT(*) FROM pending WHERE stream = ? AND grp = ?", (stream, name)
+            ).fetchone()[0]
+            groups[name] = {"next_offset": next_offset, "lag": max(0, last + 1 - next_offset), "pending": pending}
+        length = conn.execute("SELECT COUNT(*) FROM messages WHERE stream = ?", (stream,)).fetchone()[0]
+        return {"backend": "sqlite", "length": length, "last_offset": last, "groups": groups}
+
+
+class RedisStreamQueue:
+    """The same interface on Redis Streams (XADD / XREADGROUP / XAUTOCLAIM / XACK)"""
+
+    def __init__(self, url: str = None):
+        import redis   # optional dependency, only needed for this backend
+        self.redis = redis
+        self.client = redis.Redis.from_url(url or QUEUE_URL)
+
+    def enqueue(self, stream: str, body: bytes) -> str:
+        return self.client.xadd(stream, {"body": body}).decode()
+
+    def enqueue_many(self, stream: str, bodies: list) -> list:
+        pipe = self.client.pipeline(transaction=False)
+        for body in bodies:
+            pipe.xadd(stream, {"body": body})
+        return [offset.decode() for offset in pipe.execute()]
+
+    def create_group(self, stream: str, group: str, start="$"):
+        try:
+            self.client.xgroup_create(stream, group, id=start, mkstream=True)
+        except self.redis.ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    def pull(self, stream: str, group: str, consumer: str, count: int = DEFAULT_PULL,
+             visibility_timeout: float = VISIBILITY_TIMEOUT, block: float = 0) -> list:
+        _, claimed, _ = self.client.xautoclaim(
+            stream, group, consumer, min_idle_time=int(visibility_timeout * 1000), count=count
+        )
+        claimed = [(offset.decode(), fields[b"body"]) for offset, fields in claimed if fields]
+        deliveries = self._deliveries(stream, group, [offset for offset, _ in claimed])
+        messages = [Message(offset, body, n) for (offset, body), n in zip(claimed, deliveries)]
+        if len(messages) < count:
+            reply = self.client.xreadgroup(
+                group, consumer, {stream: ">"}, count=count - len(messages),
+                block=int(block * 1000) if block and not messages else None,
+            )
+            for _, entries in reply or ():
+                messages.extend(Message(offset.decode(), fields[b"body"]) for offset, fields in entries)
+        return messages
+
+    def _deliveries(self, stream: str, group: str, offsets: list) -> list:
+        """Delivery counts of pending messages (XAUTOCLAIM counted the claim already)"""
+        pipe = self.client.pipeline(transaction=False)
+        for offset in offsets:
+            pipe.xpending_range(stream, group, min=offset, max=offset, count=1)
+        return [entry[0]["times_delivered"] if entry else 1 for entry in pipe.execute()] if offsets else []
+
+    def ack(self, stream: str, group: str, offsets: list) -> int:
+        return self.client.xack(stream, group, *offsets) if offsets else 0
+
+    def touch(self, stream: str, group: str, consumer: str, offsets: list, visibility_timeout: float = VISIBILITY_TIMEOUT):
+        # claiming a message resets its idle time; JUSTID leaves its delivery count alone
+        if offsets:
+            self.client.xclaim(stream, group, consumer, 0, offsets, justid=True)
+
+    def replay(self, stream: str, from_offset="-", count: int = DEFAULT_PULL) -> list:
+        start = "-" if from_offset in (0, "0") else from_offset
+        return [Message(offset.decode(), fields[b"body"], 0) for offset, fields in self.client.xrange(stream, min=start, count=count)]
+
+    def reset_group(self, stream: str, group: str, offset):
+        self.client.xgroup_setid(stream, group, id=offset)
+
+    def trim(self, stream: str, keep_seconds: float = KEEP_ACKED) -> int:
+        # stream IDs start with the enqueue time in ms; unlike SQLite this doesn't check acks
+        return self.client.xtrim(stream, minid=f"{int((time.time() - keep_seconds) * 1000)}-0", approximate=True)
+
+    def stats(self, stream: str) -> dict:
+        try:
+            groups = self.client.xinfo_groups(stream)
+            length = self.client.xlen(stream)
+        except self.redis.ResponseError:
+            return {"backend": "redis", "length": 0, "groups": {}}
+        return {
+            "backend": "redis",
+            "length": length,
+            "groups": {
+                g["name"].decode(): {"pending": g["pending"], "lag": g.get("lag"), "last_delivered": g["last-delivered-id"].decode()}
+                for g in groups
+            },
+        }
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_queue():
+    """The process-wide queue for QUEUE_BACKEND"""
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                if QUEUE_BACKEND == "redis":
+                    _queue = RedisStreamQueue(QUEUE_URL)
+                elif QUEUE_BACKEND == "sqlite":
+                    _queue = SqliteQueue(QUEUE_DB)
+                else:
+                    raise ValueError("QUEUE_BACKEND must be 'sqlite' or 'redis'")
+    return _queue
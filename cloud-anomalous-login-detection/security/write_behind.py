@@ -0,0 +1,182 @@
+# security/write_behind.py
+
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+from security import metrics
+from security.records import encoder
+from security.results_store import insert_results
+
+logger = logging.getLogger(__name__)
+
+#configurations
+DURABILITY = "group"        # "none": no fsync, "group": one fsync per group, "per-event": sync write inside submit()
+BUFFER_SIZE = 10000         # submissions held in memory before submit() starts to push back
+GROUP_MAX_SIZE = 500        # flush once this many results are buffered...
+GROUP_MAX_DELAY = 0.05      # ...or once the oldest buffered result is this old (seconds)
+SUBMIT_TIMEOUT = 1.0        # how long submit() waits for room before writing inline
+RETRY_DELAY = 0.5
+MAX_WRITE_ATTEMPTS = 5      # a group failing this often goes to the dead-letter file
+DEAD_LETTER_FILE = "results_dead_letter.ndjson"   # one result per line, for inspection / re-import
+
+_SYNC_FOR = {"none": "OFF", "group": "FULL", "per-event": "FULL"}
+_STOP = object()
+
+
+class WriteBehindWriter:
+    """
+    Buffers results in a bounded queue and persists them from a background thread
+    in groups, so the caller never waits on disk (except in "per-event" mode or
+    when the buffer is full).
+
+    sink(results, synchronous=...) must write the whole list as one transaction.
+    A group the sink keeps failing on is appended to dead_letter_path instead,
+    so one bad group can't stall the writer (and shutdown) behind it.
+    """
+
+    def __init__(self, sink, durability: str = DURABILITY, buffer_size: int = BUFFER_SIZE,
+                 group_size: int = GROUP_MAX_SIZE, max_delay: float = GROUP_MAX_DELAY,
+                 dead_letter_path: str = DEAD_LETTER_FILE):
+        if durability not in _SYNC_FOR:
+            raise ValueError(f"durability must be one of {', '.join(_SYNC_FOR)}")
+        self.sink = sink
+        self.durability = durability
+        self.dead_letter_path = dead_letter_path
+        self.group_size = group_size
+        self.max_delay = max_delay
+        self._queue = queue.Queue(maxsize=buffer_size)
+        self._thread = None
+        self._closed = False
+        self._start_lock = threading.Lock()
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="result-writer", daemon=True)
+                self._thread.start()
+
+    def submit(self, result):
+        self.submit_many([result])
+
+    def submit_many(self, results: list):
+        """Queue results as one unit; they are committed in the same group."""
+        if not results:
+            return
+        if self.durability == "per-event" or self._closed:
+            self._write(results)
+            return
+        self._ensure_started()
+        try:
+            self._queue.put(results, timeout=SUBMIT_TIMEOUT)
+        except queue.Full:
+            # storage can't keep up: apply backpressure by writing on the caller's thread
+            metrics.inc("write_behind_inline_writes_total")
+            self._write(results)
+
+    def pending(self) -> int:
+        """Submissions (single results or batches) waiting in the buffer"""
+        return self._queue.qsize()
+
+    def flush(self):
+        """Block until everything submitted so far is persisted."""
+        if self._thread is not None:
+            self._queue.join()
+
+    def close(self):
+        """Drain the buffer and stop the writer thread."""
+        if self._closed:
+            return
+        self._closed = True
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join()
+            # anything that raced in behind the stop marker
+            leftovers = []
+            while True:
+                try:
+                    leftovers.extend(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+                self._queue.task_done()
+            if leftovers:
+                self._commit(leftovers)
+
+    def _write(self, group):
+        with metrics.timed("flush_group"):
+            self.sink(group, synchronous=_SYNC_FOR[self.durability])
+        metrics.inc("write_behind_groups_total")
+        metrics.inc("write_behind_results_total", len(group))
+
+    def _commit(self, group):
+        """_write with retries; the group goes to the dead-letter file once they run out"""
+        # while closing, don't hold shutdown up with retries
+        attempts = 1 if self._closed else MAX_WRITE_ATTEMPTS
+        for attempt in range(1, attempts + 1):
+            try:
+                self._write(group)
+                return
+            except Exception as e:
+                metrics.inc("write_behind_errors_total")
+                if attempt == attempts:
+                    logger.error("result write failed %d time(s), dead-lettering %d result(s): %s", attempt, len(group), e)
+                else:
+                    logger.warning("result write failed (attempt %d/%d), retrying: %s", attempt, attempts, e)
+                    time.sleep(RETRY_DELAY)
+        self._dead_letter(group)
+
+    def _dead_letter(self, group):
+        try:
+            with open(self.dead_letter_path, "ab") as f:
+                f.write(b"".join(encoder.encode(result) + b"\n" for result in group))
+                f.flush()
+                os.fsync(f.fileno())
+        except OSError:
+            logger.exception("could not write %d result(s) to %s, they are lost", len(group), self.dead_letter_path)
+            metrics.inc("write_behind_lost_total", len(group))
+            return
+        metrics.inc("write_behind_dead_letter_total", len(group))
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is _STOP:
+                self._queue.task_done()
+                break
+            group = list(item)
+            units = 1
+            deadline = time.monotonic() + self.max_delay
+            while len(group) < self.group_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    self._queue.task_done()
+                    break
+                group.extend(item)
+                units += 1
+
+            self._commit(group)
+            for _ in range(units):
+                self._queue.task_done()
+
+
+result_writer = WriteBehindWriter(insert_results)
+atexit.register(result_writer.close)
+
+metrics.describe_counter("write_behind_groups_total", "Groups committed by the result writer")
+metrics.describe_counter("write_behind_results_total", "Results committed by the result writer")
+metrics.describe_counter("write_behind_inline_writes_total", "Results written on the request thread because the buffer was full")
+metrics.describe_counter("write_behind_errors_total", "Failed group commit attempts")
+metrics.describe_counter("write_behind_dead_letter_total", "Results written to the dead-letter file after failed commits")
+metrics.describe_counter("write_behind_lost_total", "Results lost because neither the store nor the dead-letter file took them")
+metrics.register_gauge("write_behind_buffered", "Submissions waiting in the write-behind buffer", result_writer.pending)
@@ -0,0 +1,47 @@
+# tests/conftest.py
+import os
+import sys
+import types
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# The GeoLite2 database (data/GeoLite2-City.mmdb) is downloaded separately, and
+# security.geoip_enrich opens it on import; without it the API tests resolve
+# IPs from this table instead.
+GEO = {
+    "8.8.8.8": ("United States", "Mountain View", 37.4, -122.1),
+    "1.1.1.1": ("Australia", "Sydney", -33.9, 151.2),
+}
+
+
+def _ip_to_geo(ip: str) -> dict:
+    country, city, lat, lon = GEO.get(ip, ("Private", None, 0.0, 0.0))
+    return {"ip": ip, "continent": None, "country": country, "city": city, "latitude": lat, "longitude": lon}
+
+
+if not os.path.exists(os.path.join(ROOT, "data", "GeoLite2-City.mmdb")):
+    _geoip = types.ModuleType("security.geoip_enrich")
+    _geoip.ip_to_geo = _ip_to_geo
+    sys.modules["security.geoip_enrich"] = _geoip
+
+
+@pytest.fixture(scope="session")
+def workdir(tmp_path_factory):
+    """The API keeps its files (event log, dbs, state) in the working directory"""
+    path = tmp_path_factory.mktemp("api")
+    cwd = os.getcwd()
+    os.chdir(path)
+    yield path
+    os.chdir(cwd)
+
+
+@pytest.fixture(scope="session")
+def client(workdir):
+    from fastapi.testclient import TestClient
+    from api.main import app
+
+    with TestClient(app) as client:
+        yield client
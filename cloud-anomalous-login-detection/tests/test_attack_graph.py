@@ -0,0 +1,57 @@
+# tests/test_attack_graph.py
+import time
+
+import pytest
+
+from security import attack_graph as graph
+
+
+@pytest.fixture(autouse=True)
+def empty_graph(monkeypatch):
+    with graph._lock:
+        graph._events.clear()
+        graph._rebuild()
+    monkeypatch.setattr(graph, "_next_split", 0.0)
+
+
+def _attack(prefix: str, ips: int, users: int, now: float):
+    # every user fails from two IPs, so they all end up in one component
+    for u in range(users):
+        graph.record_failure(f"{prefix}-user-{u}", f"{prefix}-ip-{u % ips}", now)
+        graph.record_failure(f"{prefix}-user-{u}", f"{prefix}-ip-{(u + 1) % ips}", now)
+
+
+def test_expired_failure_no_longer_merges_live_clusters():
+    start = time.time()
+    half = graph.CLUSTER_USER_THRESHOLD // 2 + 1   # flagged together, not on their own
+    # one IP failing against both groups' users joins them...
+    graph.record_failure("a-user-0", "bridge", start)
+    graph.record_failure("b-user-0", "bridge", start)
+    _attack("a", 3, half, start + 60)
+    _attack("b", 3, half, start + 60)
+    assert graph.coordinated_cluster("a-user-1", None, start + 120)["users"] == 2 * half
+
+    # ...until it leaves the window; fewer failures expired than are live, so
+    # only the stale-component check splits them
+    later = start + graph.GRAPH_WINDOW + 30
+    assert graph.coordinated_cluster("a-user-1", None, later) is None
+    assert graph.cluster_of("a-user-1", None, later)["users"] == half
+    assert all(not c["flagged"] for c in graph.top_clusters(now=later))
+
+
+def test_live_cluster_stays_flagged_after_unrelated_expiry():
+    start = time.time()
+    graph.record_failure("someone", "elsewhere", start)
+    _attack("a", 3, graph.CLUSTER_USER_THRESHOLD, start + 60)
+    later = start + graph.GRAPH_WINDOW + 30
+    assert graph.coordinated_cluster("a-user-1", "a-ip-1", later)["users"] == graph.CLUSTER_USER_THRESHOLD
+
+
+def test_api_failures_feed_the_graph(client):
+    for u in range(graph.CLUSTER_USER_THRESHOLD):
+        for ip in (f"10.1.0.{u % 4}", f"10.1.0.{(u + 1) % 4}"):
+            r = client.post("/ingest", json={"user_id": f"api-user-{u}", "ip": ip, "success": False})
+            assert r.status_code == 200
+    clusters = client.get("/stats/attack-clusters").json()["clusters"]
+    assert clusters[0]["flagged"]
+    assert clusters[0]["users"] == graph.CLUSTER_USER_THRESHOLD
@@ -0,0 +1,25 @@
+# tests/test_device_filter.py
+import pytest
+
+from security import device_filter
+
+
+def test_two_generations_stay_within_the_configured_rate():
+    history = device_filter._DeviceHistory(now=0.0)
+    for generation in range(2):
+        for i in range(device_filter.DEVICE_FILTER_CAPACITY):
+            assert history.current.add(f"known-{generation}-{i}".encode())
+        if generation == 0:
+            history.rotate(now=1.0)
+
+    trials = 200_000
+    false_positives = sum(f"unseen-{i}".encode() in history for i in range(trials))
+    assert false_positives / trials <= device_filter.DEVICE_FILTER_FP_RATE
+
+
+def test_rates_16_bit_fingerprints_cannot_reach_are_rejected():
+    assert device_filter._fingerprint_bits(2 * device_filter.BUCKET_SIZE / 2 ** 16) == 16
+    with pytest.raises(ValueError):
+        device_filter._fingerprint_bits(1e-6)
+    with pytest.raises(ValueError):
+        device_filter._fingerprint_bits(0)
@@ -0,0 +1,23 @@
+# tests/test_ensemble.py
+import pytest
+
+ensemble = pytest.importorskip("worker.ensemble")   # needs the trained models
+
+
+def _counting_scorer(calls):
+    def scorer(rows):
+        calls.append(len(rows))
+        return [(0.1, 0.2) for _ in rows]
+    return scorer
+
+
+def test_percentile_mode_scores_every_row(monkeypatch):
+    if ensemble.cache is None:
+        pytest.skip("score cache disabled")
+    monkeypatch.setattr(ensemble, "NORMALIZATION", "percentile")
+    calls = []
+    row = [12, 3, 5.0, 1.0, 0, 0]
+    ensemble.score_features(row, _counting_scorer(calls))
+    ensemble.score_features(row, _counting_scorer(calls))
+    assert calls == [1, 1]
+    assert ensemble.cache_stats() == {"enabled": False}
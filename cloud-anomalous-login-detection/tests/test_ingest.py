@@ -0,0 +1,55 @@
+# tests/test_ingest.py
+import gzip
+
+from api import main
+from api.admission import HOT_IP_FAILURES
+from security import bruteforce_det
+
+
+def test_failed_sign_ins_make_an_ip_hot_and_are_shed_when_saturated(client, monkeypatch):
+    ip = "10.0.0.1"
+    for i in range(HOT_IP_FAILURES):
+        r = client.post("/ingest", json={"user_id": f"victim-{i}", "ip": ip, "success": False})
+        assert r.status_code == 200
+    assert bruteforce_det.recent_ip_failures(ip) == HOT_IP_FAILURES
+
+    event = {"user_id": "victim-x", "ip": ip, "success": False}
+    monkeypatch.setattr(main.admission, "saturated", lambda: True)
+    r = client.post("/ingest", json=event)
+    assert r.status_code == 429
+    assert r.json()["reason"] == "hot_ip"
+    assert r.headers["Retry-After"]
+
+    # shed, not ingested: the retry is evaluated rather than answered as a duplicate
+    monkeypatch.setattr(main.admission, "saturated", lambda: False)
+    r = client.post("/ingest", json=event)
+    assert r.status_code == 200
+    assert r.json()["status"] == "success"
+
+
+def test_other_ips_are_not_shed(client, monkeypatch):
+    monkeypatch.setattr(main.admission, "saturated", lambda: True)
+    r = client.post("/ingest", json={"user_id": "someone", "ip": "10.0.0.2", "success": False})
+    assert r.status_code == 200
+
+
+def test_gzip_batches_are_decompressed(client):
+    body = gzip.compress(b'{"user_id": "gz-1", "ip": "8.8.8.8"}\n') + gzip.compress(b'{"user_id": "gz-2", "ip": "8.8.8.8"}\n')
+    r = client.post("/ingest/batch", content=body,
+                    headers={"Content-Type": "application/x-ndjson", "Content-Encoding": "gzip"})
+    assert r.status_code == 200
+    assert r.json()["received"] == 2
+
+
+def test_oversized_batches_are_rejected_before_they_are_buffered(client, monkeypatch):
+    monkeypatch.setattr(main, "MAX_BATCH_BYTES", 1 << 16)
+    bomb = gzip.compress(b" " * (main.MAX_BATCH_BYTES + 1))   # a few hundred bytes on the wire
+    assert len(bomb) < main.MAX_BATCH_BYTES
+    r = client.post("/ingest/batch", content=bomb, headers={"Content-Encoding": "gzip"})
+    assert r.status_code == 413
+
+    r = client.post("/ingest/batch", content=b" " * (main.MAX_BATCH_BYTES + 1))
+    assert r.status_code == 413
+
+    r = client.post("/ingest/batch", content=gzip.compress(b"[]")[:-4], headers={"Content-Encoding": "gzip"})
+    assert r.status_code == 400
@@ -0,0 +1,29 @@
+# tests/test_passwords.py
+from api.main import DATA_FILE
+from scripts import send_event
+from security import password_digest, work_queue
+
+
+def test_passwords_are_not_stored_queued_or_served(client):
+    password = "hunter2-plaintext"
+    event = {"user_id": "pw-user", "ip": "8.8.8.8", "password": password}
+    r = client.post("/ingest", json=event)
+    assert r.status_code in (200, 202)
+    r = client.post("/ingest/batch", json=[dict(event, user_id="pw-batch-user")])
+    assert r.status_code == 200
+    assert password not in r.text
+
+    assert password not in client.get("/events").text
+    with open(DATA_FILE) as f:
+        assert password not in f.read()
+    bodies = b"".join(m.body for m in work_queue.get_queue().replay(work_queue.EVENTS_STREAM, count=100_000))
+    assert b"pw-batch-user" in bodies
+    assert password.encode() not in bodies
+
+
+def test_consumer_checks_the_digest():
+    good = password_digest.redact({"user_id": "u", "password": send_event.AUTH_DEMO_PASSWORD})
+    bad = password_digest.redact({"user_id": "u", "password": "wrong"})
+    assert "password" not in good
+    assert send_event.simulate_auth_using_event(good)
+    assert not send_event.simulate_auth_using_event(bad)
@@ -0,0 +1,11 @@
+# tests/test_profiler.py
+
+
+def test_profiler_rejects_busy_loop_intervals(client):
+    for interval in ("0", "-5", "0.5", "nan"):
+        r = client.post("/debug/profiler", params={"enabled": "true", "interval_ms": interval})
+        assert r.status_code == 422
+    r = client.post("/debug/profiler", params={"enabled": "true", "interval_ms": "5"})
+    assert r.json() == {"running": True, "changed": True}
+    r = client.post("/debug/profiler", params={"enabled": "false"})
+    assert r.json() == {"running": False, "changed": True}
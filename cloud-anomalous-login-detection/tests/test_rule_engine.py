@@ -0,0 +1,35 @@
+# tests/test_rule_engine.py
+from concurrent.futures import ThreadPoolExecutor
+
+from security import rule_engine
+
+
+class _Scorer:
+    @staticmethod
+    def raw_scores(rows):
+        return [len(row) for row in rows]
+
+
+class _ReplacedPool:
+    """A pool /models/reload swaps out and shuts down while a thread is submitting to it"""
+
+    def __init__(self, replacement):
+        self.replacement = replacement
+
+    def submit(self, fn, *args):
+        rule_engine.set_ml_executor(self.replacement)
+        raise RuntimeError("cannot schedule new futures after shutdown")
+
+
+def test_scoring_moves_to_the_pool_that_replaced_a_shut_down_one(monkeypatch):
+    monkeypatch.setattr(rule_engine, "_ensemble", _Scorer)
+    with ThreadPoolExecutor(1) as new:
+        monkeypatch.setattr(rule_engine, "_ml_executor", _ReplacedPool(new))
+        assert rule_engine._raw_scores([[1, 2], [3]]) == [2, 1]
+        assert rule_engine._ml_executor is new
+
+
+def test_scoring_falls_back_in_process_when_the_pool_is_gone(monkeypatch):
+    monkeypatch.setattr(rule_engine, "_ensemble", _Scorer)
+    monkeypatch.setattr(rule_engine, "_ml_executor", _ReplacedPool(None))
+    assert rule_engine._raw_scores([[1, 2, 3]]) == [3]
@@ -0,0 +1,31 @@
+# tests/test_score_stats.py
+import os
+import subprocess
+import sys
+
+from worker import score_stats
+from worker.quantile_sketch import KLLSketch
+
+
+def _publish_as(pid: int, scores: int):
+    path = os.path.join(score_stats.SKETCH_DIR, f"{score_stats._host}-{pid}.sketch")
+    sketch = KLLSketch(score_stats.SKETCH_K)
+    for i in range(scores):
+        sketch.update(float(i))
+    blob = sketch.to_bytes()
+    with open(path, "wb") as f:
+        f.write((len(blob).to_bytes(4, "little") + blob) * len(score_stats.SCORES))
+    return path
+
+
+def test_sketches_of_exited_processes_are_not_merged(tmp_path, monkeypatch):
+    monkeypatch.setattr(score_stats, "SKETCH_DIR", str(tmp_path))
+    monkeypatch.setattr(score_stats, "sketches", {name: KLLSketch(score_stats.SKETCH_K) for name in score_stats.SCORES})
+    crashed = subprocess.Popen([sys.executable, "-c", "pass"])
+    crashed.wait()
+
+    stale = _publish_as(crashed.pid, 100)
+    _publish_as(os.getppid(), 7)   # a live peer
+
+    assert score_stats.merged()["if_raw"].n == 7
+    assert not os.path.exists(stale)
@@ -0,0 +1,24 @@
+# tests/test_send_event.py
+import pytest
+
+from scripts import send_event
+from security.dedupe import DedupeWindow
+
+
+def test_event_failing_to_process_is_processed_on_redelivery(monkeypatch):
+    event = {"user_id": "u", "ip": "8.8.8.8", "timestamp": "2026-10-19T10:00:00"}
+    calls = []
+
+    def process(ev):
+        calls.append(ev)
+        if len(calls) == 1:
+            raise RuntimeError("scorer unavailable")
+
+    monkeypatch.setattr(send_event, "simulate_and_process_event", process)
+    processed, near_dupes = DedupeWindow(), DedupeWindow()
+    with pytest.raises(RuntimeError):
+        send_event.process_if_new(event, processed, near_dupes)
+
+    assert send_event.process_if_new(event, processed, near_dupes) is True
+    assert send_event.process_if_new(event, processed, near_dupes) is False
+    assert len(calls) == 2
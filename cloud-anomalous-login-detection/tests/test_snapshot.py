@@ -0,0 +1,36 @@
+# tests/test_snapshot.py
+import os
+import subprocess
+import sys
+
+from conftest import ROOT
+
+CLAIM = """
+import sys
+sys.path.insert(0, sys.argv[1])
+import conftest   # the same GeoIP stand-in as the tests
+from security import snapshot
+print(snapshot.restore("state")["state_dir"], flush=True)
+sys.stdin.read()
+"""
+
+
+def _claim(cwd):
+    proc = subprocess.Popen([sys.executable, "-c", CLAIM, os.path.join(ROOT, "tests")], cwd=cwd, text=True,
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    return proc, proc.stdout.readline().strip()
+
+
+def test_processes_sharing_a_directory_get_their_own_state(tmp_path):
+    first, first_dir = _claim(tmp_path)
+    second, second_dir = _claim(tmp_path)
+    try:
+        assert (first_dir, second_dir) == ("state", "state.1")
+    finally:
+        first.communicate("")
+        second.communicate("")
+
+    # a restarted process takes a free directory back
+    again, again_dir = _claim(tmp_path)
+    again.communicate("")
+    assert again_dir == "state"
@@ -0,0 +1,102 @@
+# tests/test_write_behind.py
+"""
+Crash recovery of the write-behind result writer: a process killed while a
+group is being committed loses at most that group, never part of it.
+
+Run from the project root: python -m pytest tests
+"""
+import os
+import sqlite3
+import subprocess
+import sys
+import textwrap
+
+import pytest
+
+from security.records import LoginResult
+from security.write_behind import WriteBehindWriter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GROUP_SIZE = 50
+GROUPS = 10
+CRASH_GROUP = 6   # the writer is killed halfway through committing this group
+
+# Child process: writes GROUPS groups through the writer and SIGKILLs itself
+# after inserting half the rows of CRASH_GROUP, inside the transaction.
+_CHILD = textwrap.dedent("""
+    import functools, os, signal, sys
+    from security import results_store
+    from security.records import LoginResult
+    from security.write_behind import WriteBehindWriter
+
+    db, group_size, groups, crash_group = sys.argv[1], *map(int, sys.argv[2:])
+    real_insert = results_store._insert
+    committed = []
+
+    def insert(conn, results):
+        if len(committed) == crash_group:
+            real_insert(conn, results[:len(results) // 2])
+            os.kill(os.getpid(), signal.SIGKILL)
+        real_insert(conn, results)
+        committed.append(results[0].user_id)
+
+    results_store._insert = insert
+    writer = WriteBehindWriter(functools.partial(results_store.insert_results, path=db),
+                               durability="group", group_size=group_size)
+    for g in range(groups):
+        writer.submit_many([
+            LoginResult(user_id=f"group-{g}", risk_score=i % 100, reasons=["test"], geo={},
+                        timestamp="2026-10-19T10:00:00")
+            for i in range(group_size)
+        ])
+        writer.flush()
+    writer.close()
+""")
+
+
+def _group_counts(db: str) -> dict:
+    with sqlite3.connect(db) as conn:
+        return dict(conn.execute("SELECT user_id, COUNT(*) FROM results GROUP BY user_id"))
+
+
+def test_killed_mid_flush_keeps_committed_groups_whole(tmp_path):
+    db = str(tmp_path / "results.db")
+    child = subprocess.run(
+        [sys.executable, "-c", _CHILD, db, str(GROUP_SIZE), str(GROUPS), str(CRASH_GROUP)],
+        cwd=tmp_path, env={**os.environ, "PYTHONPATH": ROOT}, capture_output=True, timeout=60,
+    )
+    assert child.returncode == -9, child.stderr.decode()
+
+    # reopening rolls the interrupted transaction back
+    counts = _group_counts(db)
+    assert counts == {f"group-{g}": GROUP_SIZE for g in range(CRASH_GROUP)}
+    with sqlite3.connect(db) as conn:
+        orphans = conn.execute(
+            "SELECT COUNT(*) FROM result_reasons WHERE result_id NOT IN (SELECT id FROM results)"
+        ).fetchone()[0]
+    assert orphans == 0
+
+
+def test_failing_group_is_dead_lettered_not_retried_forever(tmp_path, monkeypatch):
+    monkeypatch.setattr("security.write_behind.RETRY_DELAY", 0)
+    dead_letters = tmp_path / "dead.ndjson"
+    written = []
+
+    def sink(results, synchronous=None):
+        if results[0].user_id == "poison":
+            raise sqlite3.OperationalError("disk I/O error")
+        written.extend(results)
+
+    writer = WriteBehindWriter(sink, group_size=1, dead_letter_path=str(dead_letters))
+    make = lambda user_id: LoginResult(user_id=user_id, risk_score=0, reasons=[], geo={}, timestamp="2026-10-19T10:00:00")
+    writer.submit(make("poison"))
+    writer.submit(make("fine"))
+    writer.close()
+
+    assert [r.user_id for r in written] == ["fine"]
+    assert dead_letters.read_bytes().count(b"\n") == 1
+    assert b'"poison"' in dead_letters.read_bytes()
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
@@ -1,51 +1,127 @@
 # worker/ensemble.py
-import os, joblib, json, math, numpy as np, torch
-from sklearn.preprocessing import StandardScaler
+import math, numpy as np
 
-MODELS_DIR = "models"
-NUM_FEATURES = ["hour_of_day","day_of_week","delta_minutes","geodistance_km","device_change","failed_prev_5"]
+try:
+    from security import metrics
+    timed = metrics.timed
+except ImportError:   # run from worker/ without the project root on sys.path
+    from contextlib import nullcontext
+    metrics = None
+    def timed(stage): return nullcontext()
+try:
+    import model_store, score_cache, score_stats   # run from worker/ ("worker" there would be worker.py)
+except ImportError:
+    from worker import model_store, score_cache, score_stats
 
-scaler = joblib.load(os.path.join(MODELS_DIR,"scaler.pkl"))
-if_model = joblib.load(os.path.join(MODELS_DIR,"isolation_forest.joblib"))
-with open(os.path.join(MODELS_DIR,"if_stats.json")) as f: if_stats = json.load(f)
-with open(os.path.join(MODELS_DIR,"ae_stats.json")) as f: ae_stats = json.load(f)
+MODELS_DIR = model_store.MODELS_DIR
+NUM_FEATURES = ["hour_of_day","day_of_week","delta_minutes","geodistance_km","device_change","failed_prev_5"]
 
-# load AE structure then state
-class AE(torch.nn.Module):
-    def __init__(self, dim):
-        super().__init__()
-        self.enc = torch.nn.Sequential(torch.nn.Linear(dim, max(4,dim//2)), torch.nn.ReLU(), torch.nn.Linear(max(4,dim//2), max(2,dim//3)), torch.nn.ReLU())
-        self.dec = torch.nn.Sequential(torch.nn.Linear(max(2,dim//3), max(4,dim//2)), torch.nn.ReLU(), torch.nn.Linear(max(4,dim//2), dim))
-    def forward(self,x): return self.dec(self.enc(x))
+#configurations
+NORMALIZATION = "logistic"     # "logistic": on the training mean/std, "percentile": rank in the live score distribution
+PERCENTILE_MIN_COUNT = 1000    # percentile mode falls back to logistic until this many scores were seen
 
+# scaler, IsolationForest and AE weights are mapped read-only from the shared model file
+# (published from MODELS_DIR on first use), so extra scoring processes don't add copies
+models = model_store.load()
+if_stats = models.meta["if_stats"]
+ae_stats = models.meta["ae_stats"]
 dim = len(NUM_FEATURES)
-ae = AE(dim)
-ae.load_state_dict(torch.load(os.path.join(MODELS_DIR,"autoencoder.pth"), map_location="cpu"))
-ae.eval()
+
+# memoized scores for quantized feature vectors (see worker/score_cache.py), None when disabled
+cache = score_cache.ScoreCache(models, NUM_FEATURES, ae_stats) if score_cache.SCORE_CACHE_SIZE > 0 else None
+
+def reload_models():
+    """Pick up retrained models (republishing the shared store if the files changed) and drop cached scores"""
+    global models, if_stats, ae_stats
+    models = model_store.load()
+    if_stats = models.meta["if_stats"]
+    ae_stats = models.meta["ae_stats"]
+    if cache is not None:
+        cache.reset(models, ae_stats)
+
+def _cache_enabled():
+    # the cache's error bound is checked against the normalisation at insertion;
+    # percentile mode normalises on a distribution that keeps moving after that
+    return cache is not None and NORMALIZATION != "percentile"
+
+def cache_stats():
+    return cache.stats() if _cache_enabled() else {"enabled": False}
 
 def logistic(z): return 1.0/(1.0+math.exp(-z))
+def _percentile_ready(name):
+    return NORMALIZATION == "percentile" and score_stats.sketches[name].n >= PERCENTILE_MIN_COUNT
 def normalize_if(raw):
+    if _percentile_ready("if_raw"):
+        return score_stats.sketches["if_raw"].cdf(raw)
     mean = if_stats.get("if_mean",0.0); std = if_stats.get("if_std",1.0)
     z = (raw - mean) / (std + 1e-9)
     return logistic(z)
 def normalize_ae(err):
+    if _percentile_ready("ae_err"):
+        return score_stats.sketches["ae_err"].cdf(err)
     mean = ae_stats.get("ae_mean",0.0); std = ae_stats.get("ae_std",1.0)
     z = (err - mean) / (std + 1e-9)
-    return logistic(z)
+    return logistic(max(-500.0, min(500.0, z)))
 
-def score_features(feature_vector):
-    X = np.array(feature_vector, dtype=float).reshape(1,-1)
-    Xs = scaler.transform(X)
-    raw_if = -if_model.score_samples(Xs)[0]   # higher -> more anomalous
-    if_norm = normalize_if(raw_if)
-    Xt = torch.tensor(Xs, dtype=torch.float32)
-    with torch.no_grad():
-        rec = ae(Xt).numpy()
-    rec_err = float(((Xs - rec)**2).mean())
-    ae_norm = normalize_ae(rec_err)
-    return {"if_raw": raw_if, "if_norm": if_norm, "ae_err": rec_err, "ae_norm": ae_norm}
+def _scored(raw_if, rec_err):
+    """Record raw scores in the live distribution and normalise them"""
+    score_stats.record("if_raw", raw_if)
+    score_stats.record("ae_err", rec_err)
+    return {"if_raw": raw_if, "if_norm": normalize_if(raw_if), "ae_err": rec_err, "ae_norm": normalize_ae(rec_err)}
+
+def raw_scores(feature_rows):
+    """(raw IF score, AE reconstruction error) per row straight from the models; raw_if: higher -> more anomalous"""
+    raw_if, rec_err = models.score(np.array(feature_rows, dtype=float).reshape(-1, dim))
+    return list(zip(raw_if.tolist(), rec_err.tolist()))
+
+def _cached_raw_scores(feature_rows, scorer):
+    """Raw scores per row from the cache; only the misses are scored, by scorer(rows)"""
+    if not _cache_enabled():
+        return scorer(feature_rows)
+    keys = [cache.key(row) for row in feature_rows]
+    raw = [cache.get(key) for key in keys]
+    missing = [i for i, r in enumerate(raw) if r is None]
+    if metrics is not None:
+        metrics.inc("score_cache_hits_total", len(raw) - len(missing))
+        metrics.inc("score_cache_misses_total", len(missing))
+    if missing:
+        for i, r in zip(missing, scorer([feature_rows[i] for i in missing])):
+            raw[i] = tuple(r)
+            cache.put(keys[i], raw[i], normalize_ae)
+    return raw
+
+def score_features(feature_vector, scorer=raw_scores):
+    """
+    Scores of one feature vector. scorer(rows) computes raw scores for cache
+    misses, e.g. in another process; the cache and live stats stay in this one.
+    """
+    with timed("ml_scoring"):
+        return _scored(*_cached_raw_scores([feature_vector], scorer)[0])
+
+def score_batch(feature_rows, scorer=raw_scores):
+    """Vectorised score_features for many rows; returns (if_norm array, ae_norm array)"""
+    with timed("ml_scoring"):
+        scored = [_scored(r, e) for r, e in _cached_raw_scores(feature_rows, scorer)]
+        return np.array([s["if_norm"] for s in scored]), np.array([s["ae_norm"] for s in scored])
+
+def score_summary():
+    """Live percentiles of the raw and combined scores across processes, with drift against training"""
+    return {
+        "normalization": NORMALIZATION,
+        "scores": score_stats.summary({
+            "if_raw": (if_stats.get("if_mean",0.0), if_stats.get("if_std",1.0)),
+            "ae_err": (ae_stats.get("ae_mean",0.0), ae_stats.get("ae_std",1.0)),
+        }),
+    }
 
 def combine(rule_score_0_100, if_norm, ae_norm, w_rule=0.5, w_if=0.3, w_ae=0.2):
     r = rule_score_0_100 / 100.0
-    combined = w_rule*r + w_if*if_norm + w_ae*ae_norm
-    return float(combined * 100.0)   # final 0..100
+    combined = float(w_rule*r + w_if*if_norm + w_ae*ae_norm) * 100.0   # final 0..100
+    score_stats.record("ml_score", combined)
+    return combined
+
+if metrics is not None and cache is not None:
+    metrics.register_gauge("score_cache_entries", "Entries in the ML score cache", lambda: len(cache._entries))
+    metrics.describe_counter("score_cache_hits_total", "ML score lookups served from the cache")
+    metrics.describe_counter("score_cache_misses_total", "ML score lookups that ran the models (misses and always-scored bins)")
+    metrics.register_gauge("score_cache_hit_ratio", "Share of ML score lookups served from the cache", lambda: cache.stats()["hit_rate"])
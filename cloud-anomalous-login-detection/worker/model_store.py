@@ -0,0 +1,201 @@
+# worker/model_store.py
+"""
+Model arrays shared between scoring processes.
+
+publish() flattens the scaler, the IsolationForest trees and the autoencoder
+weights into one file; attach() maps that file read-only, so every process
+scoring logins reads the same physical pages instead of unpickling its own
+copy of the models (and none of them needs sklearn or torch to score).
+"""
+import json
+import os
+import struct
+
+import numpy as np
+
+#configurations
+MODELS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "models")
+STORE_PATH = os.path.join(MODELS_DIR, "shared_models.bin")
+SOURCE_FILES = ["scaler.pkl", "isolation_forest.joblib", "autoencoder.pth", "if_stats.json", "ae_stats.json"]
+ALIGN = 64                  # byte alignment of every array in the file
+
+_MAGIC = b"LGNMODL1"
+_PREFIX = struct.Struct("<8sQ")   # magic, header length
+_AE_LAYERS = ["enc.0", "enc.2", "dec.0", "dec.2"]
+
+
+def _average_path_length(n):
+    """Expected depth of an unsuccessful search in a tree of n samples (as in sklearn)"""
+    n = np.asarray(n, dtype=float)
+    out = np.zeros_like(n)
+    out[n == 2] = 1.0
+    big = n > 2
+    out[big] = 2.0 * (np.log(n[big] - 1.0) + np.euler_gamma) - 2.0 * (n[big] - 1.0) / n[big]
+    return out
+
+
+def _source_stamp(models_dir: str) -> dict:
+    return {name: os.stat(os.path.join(models_dir, name)).st_mtime_ns for name in SOURCE_FILES}
+
+
+def _export_forest(if_model) -> tuple:
+    """Concatenate every tree into global node arrays; leaves point at themselves."""
+    lefts, rights, features, thresholds, paths, roots = [], [], [], [], [], []
+    offset = 0
+    subsampled = if_model._max_features != if_model.n_features_in_
+    for tree, cols in zip(if_model.estimators_, if_model.estimators_features_):
+        t = tree.tree_
+        n = t.node_count
+        left = t.children_left.astype(np.int64)
+        right = t.children_right.astype(np.int64)
+        leaf = left == -1
+
+        depth = np.zeros(n, dtype=float)
+        for node in range(n):   # children always come after their parent
+            if not leaf[node]:
+                depth[left[node]] = depth[right[node]] = depth[node] + 1
+
+        node_ids = np.arange(n)
+        feature = np.where(leaf, 0, t.feature)
+        if subsampled:
+            feature = np.asarray(cols)[feature]
+        lefts.append(np.where(leaf, node_ids, left) + offset)
+        rights.append(np.where(leaf, node_ids, right) + offset)
+        features.append(feature)
+        thresholds.append(np.where(leaf, 0.0, t.threshold))
+        paths.append(np.where(leaf, depth + _average_path_length(t.n_node_samples), 0.0))
+        roots.append(offset)
+        offset += n
+
+    arrays = {
+        "if_left": np.concatenate(lefts).astype(np.int32),
+        "if_right": np.concatenate(rights).astype(np.int32),
+        "if_feature": np.concatenate(features).astype(np.int32),
+        "if_threshold": np.concatenate(thresholds).astype(np.float64),
+        "if_path": np.concatenate(paths).astype(np.float64),
+        "if_roots": np.array(roots, dtype=np.int32),
+    }
+    meta = {
+        "if_depth": int(max(e.tree_.max_depth for e in if_model.estimators_)),
+        "if_denominator": float(len(if_model.estimators_) * _average_path_length([if_model.max_samples_])[0]),
+    }
+    return arrays, meta
+
+
+def publish(path: str = STORE_PATH, models_dir: str = MODELS_DIR) -> str:
+    """Load the trained models once and write them as flat arrays to `path` (atomically)."""
+    import joblib
+    import torch
+
+    stamp = _source_stamp(models_dir)
+    scaler = joblib.load(os.path.join(models_dir, "scaler.pkl"))
+    if_model = joblib.load(os.path.join(models_dir, "isolation_forest.joblib"))
+    state = torch.load(os.path.join(models_dir, "autoencoder.pth"), map_location="cpu")
+    with open(os.path.join(models_dir, "if_stats.json")) as f:
+        if_stats = json.load(f)
+    with open(os.path.join(models_dir, "ae_stats.json")) as f:
+        ae_stats = json.load(f)
+
+    dim = scaler.n_features_in_
+    arrays, meta = _export_forest(if_model)
+    arrays["scaler_mean"] = np.zeros(dim) if scaler.mean_ is None else np.asarray(scaler.mean_, dtype=np.float64)
+    arrays["scaler_scale"] = np.ones(dim) if scaler.scale_ is None else np.asarray(scaler.scale_, dtype=np.float64)
+    for layer in _AE_LAYERS:
+        arrays[f"{layer}.weight"] = state[f"{layer}.weight"].numpy().astype(np.float32)
+        arrays[f"{layer}.bias"] = state[f"{layer}.bias"].numpy().astype(np.float32)
+    meta.update({"dim": dim, "if_stats": if_stats, "ae_stats": ae_stats, "sources": stamp})
+
+    layout, offset = {}, 0
+    for name, arr in arrays.items():
+        offset = -(-offset // ALIGN) * ALIGN
+        layout[name] = {"dtype": arr.dtype.str, "shape": list(arr.shape), "offset": offset}
+        offset += arr.nbytes
+    header = json.dumps({"arrays": layout, "meta": meta}).encode()
+    data_start = -(-(_PREFIX.size + len(header)) // ALIGN) * ALIGN
+
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(_PREFIX.pack(_MAGIC, len(header)))
+        f.write(header)
+        for name, arr in arrays.items():
+            f.seek(data_start + layout[name]["offset"])
+            f.write(np.ascontiguousarray(arr).tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)   # processes attached to the old file keep their mapping
+    return path
+
+
+class SharedModels:
+    """Read-only views over a published model file; scoring is plain numpy."""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            magic, header_len = _PREFIX.unpack(f.read(_PREFIX.size))
+            if magic != _MAGIC:
+                raise ValueError(f"{path} is not a model store file")
+            header = json.loads(f.read(header_len))
+        data_start = -(-(_PREFIX.size + header_len) // ALIGN) * ALIGN
+
+        self.path = path
+        self.meta = header["meta"]
+        self._map = np.memmap(path, dtype=np.uint8, mode="r")
+        self.arrays = {}
+        for name, spec in header["arrays"].items():
+            dtype = np.dtype(spec["dtype"])
+            start = data_start + spec["offset"]
+            count = int(np.prod(spec["shape"], dtype=np.int64))
+            view = self._map[start:start + count * dtype.itemsize].view(dtype)
+            self.arrays[name] = view.reshape(spec["shape"])
+
+    def stale(self, models_dir: str = MODELS_DIR) -> bool:
+        try:
+            return self.meta["sources"] != _source_stamp(models_dir)
+        except OSError:   # sources gone (e.g. only the store was shipped): keep serving it
+            return False
+
+    def scale(self, X: np.ndarray) -> np.ndarray:
+        return (X - self.arrays["scaler_mean"]) / self.arrays["scaler_scale"]
+
+    def if_raw(self, Xs: np.ndarray) -> np.ndarray:
+        """-IsolationForest.score_samples(Xs): higher -> more anomalous"""
+        a = self.arrays
+        Xf = Xs.astype(np.float32)    # sklearn trees compare float32 inputs
+        rows = np.arange(len(Xf))[:, None]
+        nodes = np.broadcast_to(a["if_roots"], (len(Xf), len(a["if_roots"]))).copy()
+        for _ in range(self.meta["if_depth"]):
+            go_left = Xf[rows, a["if_feature"][nodes]] <= a["if_threshold"][nodes]
+            nodes = np.where(go_left, a["if_left"][nodes], a["if_right"][nodes])
+        depths = a["if_path"][nodes].sum(axis=1)
+        return 2.0 ** (-depths / self.meta["if_denominator"])
+
+    def ae_error(self, Xs: np.ndarray) -> np.ndarray:
+        """Mean squared reconstruction error of the autoencoder"""
+        a = self.arrays
+        h = Xs.astype(np.float32)
+        for i, layer in enumerate(_AE_LAYERS):
+            h = h @ a[f"{layer}.weight"].T + a[f"{layer}.bias"]
+            if i < len(_AE_LAYERS) - 1:
+                h = np.maximum(h, 0)
+        return ((Xs - h) ** 2).mean(axis=1)
+
+    def score(self, X: np.ndarray) -> tuple:
+        """Raw features (n, dim) -> (raw IF score array, AE error array)"""
+        Xs = self.scale(np.asarray(X, dtype=float).reshape(-1, self.meta["dim"]))
+        return self.if_raw(Xs), self.ae_error(Xs)
+
+
+def attach(path: str = STORE_PATH) -> SharedModels:
+    return SharedModels(path)
+
+
+def load(path: str = STORE_PATH, models_dir: str = MODELS_DIR) -> SharedModels:
+    """Attach to the published models, (re)publishing first if missing or older than the model files."""
+    try:
+        models = attach(path)
+        if not models.stale(models_dir):
+            return models
+    except (OSError, ValueError):
+        pass
+    publish(path, models_dir)
+    return attach(path)
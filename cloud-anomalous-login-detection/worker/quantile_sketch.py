@@ -0,0 +1,147 @@
+# worker/quantile_sketch.py
+"""
+KLL quantile sketch (Karnin, Lang, Liberty 2016): constant memory, O(1)
+amortised updates, mergeable, rank error ~1.7/k with high probability.
+"""
+import math
+import random
+import threading
+from bisect import bisect_right
+
+import msgspec
+
+#configurations
+DEFAULT_K = 200        # items kept at the top level; memory ~3k floats
+C = 2.0 / 3.0          # capacity shrink per level below the top
+RESORT_EVERY = 0.01    # the sorted view used for queries is rebuilt after this share of new items
+
+
+class KLLSketch:
+    def __init__(self, k: int = DEFAULT_K):
+        self.k = k
+        self.levels = [[]]       # items at level h stand for 2**h observations each
+        self.n = 0
+        self.sum = 0.0
+        self.sumsq = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self._size = 0
+        self._max_size = self._capacity(0)
+        self._view = None        # (sorted items, cumulative weights) for queries
+        self._view_n = 0
+        self._lock = threading.Lock()
+
+    def _capacity(self, h: int) -> int:
+        depth = len(self.levels) - h - 1
+        return int(math.ceil(self.k * C ** depth)) + 1
+
+    def _compress(self):
+        for h in range(len(self.levels)):
+            items = self.levels[h]
+            if len(items) < self._capacity(h):
+                continue
+            if h + 1 == len(self.levels):
+                self.levels.append([])
+                self._max_size = sum(self._capacity(i) for i in range(len(self.levels)))
+            items.sort()
+            keep = items[:1] if len(items) % 2 else []
+            pairs = items[len(keep):]
+            promoted = pairs[random.getrandbits(1)::2]
+            self.levels[h + 1].extend(promoted)
+            self.levels[h] = keep
+            self._size -= len(pairs) - len(promoted)
+            if self._size < self._max_size:
+                break
+
+    def update(self, x: float):
+        x = float(x)
+        with self._lock:
+            self.levels[0].append(x)
+            self._size += 1
+            self.n += 1
+            self.sum += x
+            self.sumsq += x * x
+            if x < self.min:
+                self.min = x
+            if x > self.max:
+                self.max = x
+            if self._size >= self._max_size:
+                self._compress()
+
+    def merge(self, other: "KLLSketch"):
+        with self._lock:
+            while len(self.levels) < len(other.levels):
+                self.levels.append([])
+            for h, items in enumerate(other.levels):
+                self.levels[h].extend(items)
+            self.n += other.n
+            self.sum += other.sum
+            self.sumsq += other.sumsq
+            self.min = min(self.min, other.min)
+            self.max = max(self.max, other.max)
+            self._size = sum(len(items) for items in self.levels)
+            self._max_size = sum(self._capacity(i) for i in range(len(self.levels)))
+            while self._size >= self._max_size:
+                self._compress()
+            self._view = None
+
+    def _sorted(self):
+        with self._lock:
+            if self._view is None or self.n - self._view_n > max(16, self._view_n * RESORT_EVERY):
+                weighted = sorted((x, 1 << h) for h, items in enumerate(self.levels) for x in items)
+                values, cumulative, total = [], [], 0
+                for x, w in weighted:
+                    total += w
+                    values.append(x)
+                    cumulative.append(total)
+                self._view = (values, cumulative)
+                self._view_n = self.n
+            return self._view
+
+    def cdf(self, x: float) -> float:
+        """Estimated share of observations <= x"""
+        values, cumulative = self._sorted()
+        if not values:
+            return 0.0
+        i = bisect_right(values, x)
+        return cumulative[i - 1] / cumulative[-1] if i else 0.0
+
+    def quantile(self, q: float) -> float:
+        values, cumulative = self._sorted()
+        if not values:
+            return math.nan
+        target = q * cumulative[-1]
+        i = min(bisect_right(cumulative, target), len(values) - 1)
+        return values[i]
+
+    def points(self) -> list:
+        """(value, cdf) at every retained item, for distribution comparisons"""
+        values, cumulative = self._sorted()
+        total = cumulative[-1] if cumulative else 1
+        return [(x, c / total) for x, c in zip(values, cumulative)]
+
+    def mean(self) -> float:
+        return self.sum / self.n if self.n else math.nan
+
+    def std(self) -> float:
+        if not self.n:
+            return math.nan
+        return math.sqrt(max(0.0, self.sumsq / self.n - self.mean() ** 2))
+
+    def to_bytes(self) -> bytes:
+        with self._lock:
+            return msgspec.msgpack.encode({
+                "k": self.k, "n": self.n, "sum": self.sum, "sumsq": self.sumsq,
+                "min": self.min, "max": self.max, "levels": self.levels,
+            })
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "KLLSketch":
+        state = msgspec.msgpack.decode(data)
+        sketch = cls(state["k"])
+        sketch.levels = state["levels"] or [[]]
+        sketch.n, sketch.sum, sketch.sumsq = state["n"], state["sum"], state["sumsq"]
+        sketch.min, sketch.max = state["min"], state["max"]
+        sketch._size = sum(len(items) for items in sketch.levels)
+        sketch._max_size = sum(sketch._capacity(i) for i in range(len(sketch.levels)))
+        return sketch
@@ -0,0 +1,142 @@
+# worker/score_cache.py
+"""
+LRU cache of raw model scores keyed on a quantized feature vector.
+
+hour_of_day, day_of_week, device_change and failed_prev_5 are used as-is;
+delta_minutes and geodistance_km are binned (BIN_WIDTHS). The cached entry was
+scored at the first vector seen in its bin, and is only reused where that is
+provably close enough:
+
+- IsolationForest: the key also carries, per binned feature, the cell between
+  the forest's split thresholds the value falls in. Every tree takes the same
+  path for every vector of a cell, so the cached IF score is exact.
+- Autoencoder: with e(x) = x - AE(x) and L the product of the layers' spectral
+  norms (ReLU is 1-Lipschitz), |e(x) - e(x0)| <= (1 + L) |x - x0|, so inside a
+  bin of diagonal D the reconstruction error moves by at most
+  (2 |e(x0)| d + d^2) / n with d = (1 + L) D. The normalisation is monotonic,
+  so mapping the ends of that interval through it bounds the ae_norm error
+  (tiny where the logistic saturates, e.g. first logins). Bins whose bound
+  exceeds MAX_SCORE_ERROR are never served from the cache. The bound only holds
+  for a fixed normalisation, so worker/ensemble.py skips the cache in
+  percentile mode.
+"""
+import math
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+
+import numpy as np
+
+#configurations
+SCORE_CACHE_SIZE = 50000                                       # entries; 0 disables the cache
+BIN_WIDTHS = {"delta_minutes": 1.0, "geodistance_km": 1.0}     # raw feature units
+MAX_SCORE_ERROR = 0.01                                         # max |error| of if_norm / ae_norm (0..1 scale);
+                                                               # ml_score moves by at most 20x this (w_ae = 0.2)
+
+_BYPASS = object()   # bin whose error bound is too large: always score exactly
+
+
+class ScoreCache:
+    def __init__(self, models, feature_names: list, ae_stats: dict, size: int = SCORE_CACHE_SIZE,
+                 bin_widths: dict = None, max_error: float = MAX_SCORE_ERROR):
+        self.size = size
+        self.max_error = max_error
+        self.bin_widths = dict(BIN_WIDTHS if bin_widths is None else bin_widths)
+        self.binned = [feature_names.index(name) for name in self.bin_widths]
+        self.widths = [self.bin_widths[name] for name in self.bin_widths]
+        self.dim = len(feature_names)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.bypassed = self.evictions = 0
+        self.generation = 0
+        self._fit(models, ae_stats)
+
+    def _fit(self, models, ae_stats: dict):
+        a = models.arrays
+        self.mean = [float(v) for v in a["scaler_mean"]]
+        self.scale = [float(v) for v in a["scaler_scale"]]
+
+        # sorted split thresholds (in the scaled float32 space the trees compare in) per binned feature
+        internal = a["if_left"] != np.arange(len(a["if_left"]))
+        self.thresholds = [
+            np.unique(a["if_threshold"][internal & (a["if_feature"] == col)]).tolist() for col in self.binned
+        ]
+
+        lipschitz = 1.0
+        for name in sorted(n for n in a if n.endswith(".weight")):
+            lipschitz *= float(np.linalg.norm(a[name].astype(np.float64), 2))
+        self.expansion = 1.0 + lipschitz
+        diagonal = float(np.sqrt(sum((w / self.scale[col]) ** 2 for col, w in zip(self.binned, self.widths))))
+        self.delta = self.expansion * diagonal
+        self.ae_mean = ae_stats.get("ae_mean", 0.0)
+        self.ae_std = ae_stats.get("ae_std", 1.0)
+
+    def key(self, features) -> tuple:
+        key = list(features)
+        for i, (col, width) in enumerate(zip(self.binned, self.widths)):
+            value = float(features[col])
+            scaled = float(np.float32((value - self.mean[col]) / self.scale[col]))
+            key[col] = (int(value // width), bisect_left(self.thresholds[i], scaled))
+        # scores computed with old models but stored after a reset can never be looked up
+        key.append(self.generation)
+        return tuple(key)
+
+    def _ae_norm(self, err: float) -> float:
+        z = (err - self.ae_mean) / (self.ae_std + 1e-9)
+        return 1.0 / (1.0 + math.exp(-max(-500.0, min(500.0, z))))
+
+    def error_bound(self, ae_err: float, normalize=None) -> float:
+        """
+        Max ae_norm error over the bin of a vector whose reconstruction error is
+        ae_err; normalize is the (monotonic) ae normalisation, logistic by default.
+        """
+        normalize = normalize or self._ae_norm
+        residual = math.sqrt(ae_err * self.dim)     # |e(x0)|
+        spread = (2.0 * residual * self.delta + self.delta ** 2) / self.dim
+        at = normalize(ae_err)
+        return max(at - normalize(max(0.0, ae_err - spread)), normalize(ae_err + spread) - at)
+
+    def get(self, key):
+        """Cached (raw IF score, AE error), or None (a miss, or a bin that is always scored exactly)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            if entry is _BYPASS:
+                self.bypassed += 1
+                return None
+            self.hits += 1
+            return entry
+
+    def put(self, key, raw: tuple, normalize=None):
+        entry = raw if self.error_bound(raw[1], normalize) <= self.max_error else _BYPASS
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def reset(self, models, ae_stats: dict):
+        """Drop every entry and adopt new models (after a reload)"""
+        with self._lock:
+            self._entries.clear()
+            self.generation += 1
+            self._fit(models, ae_stats)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses + self.bypassed
+            return {
+                "size": len(self._entries),
+                "capacity": self.size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "bypassed": self.bypassed,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "bin_widths": self.bin_widths,
+                "max_score_error": self.max_error,
+            }
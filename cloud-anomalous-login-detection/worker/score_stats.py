@@ -0,0 +1,186 @@
+# worker/score_stats.py
+"""
+Live score distributions: one KLL sketch per score (raw IF score, AE
+reconstruction error, combined ml_score) per process. No raw scores are kept.
+
+Every process publishes its sketches to SKETCH_DIR; summary() merges the
+recently published ones with the local sketches, so the numbers cover every
+worker process.
+"""
+import atexit
+import glob
+import logging
+import math
+import os
+import socket
+import threading
+import time
+
+try:
+    from quantile_sketch import KLLSketch   # run from worker/
+except ImportError:
+    from worker.quantile_sketch import KLLSketch
+
+logger = logging.getLogger(__name__)
+
+#configurations
+SCORES = ("if_raw", "ae_err", "ml_score")
+SKETCH_K = 200
+SKETCH_DIR = "score_sketches"
+PUBLISH_INTERVAL = 10.0      # seconds between writes of this process's sketches
+STALE_AFTER = 15 * 60        # sketches of processes that stopped publishing this long ago are ignored (other hosts)
+PERCENTILES = (1, 5, 25, 50, 75, 95, 99, 99.9)
+
+sketches = {name: KLLSketch(SKETCH_K) for name in SCORES}
+
+_host = socket.gethostname()
+_path = os.path.join(SKETCH_DIR, f"{_host}-{os.getpid()}.sketch")
+_publisher = None
+_start_lock = threading.Lock()
+
+
+def record(name: str, value: float):
+    sketches[name].update(value)
+    if _publisher is None:
+        _start_publisher()
+
+
+def _start_publisher():
+    global _publisher
+    with _start_lock:
+        if _publisher is None:
+            _publisher = threading.Thread(target=_publish_loop, name="score-sketches", daemon=True)
+            _publisher.start()
+            atexit.register(_unpublish)
+
+
+def _publish_loop():
+    published_n = -1
+    while True:
+        time.sleep(PUBLISH_INTERVAL)
+        n = sum(s.n for s in sketches.values())
+        if n != published_n:
+            try:
+                publish()
+                published_n = n
+            except OSError as e:
+                logger.warning("could not publish score sketches: %s", e)
+
+
+def _encode() -> bytes:
+    blobs = [sketches[name].to_bytes() for name in SCORES]
+    return b"".join(len(b).to_bytes(4, "little") + b for b in blobs)
+
+
+def _decode(data: bytes) -> dict:
+    out, pos = {}, 0
+    for name in SCORES:
+        length = int.from_bytes(data[pos:pos + 4], "little")
+        out[name] = KLLSketch.from_bytes(data[pos + 4:pos + 4 + length])
+        pos += 4 + length
+    return out
+
+
+def publish():
+    os.makedirs(SKETCH_DIR, exist_ok=True)
+    tmp = f"{_path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(_encode())
+    os.replace(tmp, _path)
+
+
+def _unpublish():
+    try:
+        os.remove(_path)
+    except OSError:
+        pass
+
+
+def _exited(path: str) -> bool:
+    """Whether path was published by a process on this host that is gone (crashed before _unpublish)"""
+    host, _, pid = os.path.basename(path)[:-len(".sketch")].rpartition("-")
+    if host != _host or not pid.isdigit() or os.name != "posix":   # os.kill(pid, 0) terminates on Windows
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except OSError:   # PermissionError: alive, another user's
+        pass
+    return False
+
+
+def merged() -> dict:
+    """Local sketches merged with those recently published by other processes"""
+    out = {name: KLLSketch.from_bytes(sketches[name].to_bytes()) for name in SCORES}
+    now = time.time()
+    for path in glob.glob(os.path.join(SKETCH_DIR, "*.sketch")):
+        if os.path.abspath(path) == os.path.abspath(_path):
+            continue
+        try:
+            if _exited(path):
+                # its replacement publishes the scores from here on; merging both double counts
+                os.remove(path)
+                continue
+            if now - os.path.getmtime(path) > STALE_AFTER:
+                continue
+            with open(path, "rb") as f:
+                peer = _decode(f.read())
+        except (OSError, ValueError) as e:
+            logger.warning("skipping score sketch %s: %s", path, e)
+            continue
+        for name in SCORES:
+            out[name].merge(peer[name])
+    return out
+
+
+def _normal_cdf(x: float, mean: float, std: float) -> float:
+    return 0.5 * (1.0 + math.erf((x - mean) / (std * math.sqrt(2.0))))
+
+
+def drift(sketch: KLLSketch, mean: float, std: float) -> dict:
+    """
+    Live distribution against the training mean/std (the normal the logistic
+    normalisation assumes): mean shift in training sigmas, spread ratio, the
+    Kolmogorov-Smirnov distance to that normal and the share of scores above
+    the training 99th percentile.
+    """
+    if not sketch.n or not std:
+        return {}
+    ks = 0.0
+    previous = 0.0
+    for x, cdf in sketch.points():
+        expected = _normal_cdf(x, mean, std)
+        ks = max(ks, abs(cdf - expected), abs(previous - expected))
+        previous = cdf
+    p99 = mean + 2.3263 * std
+    return {
+        "training_mean": mean,
+        "training_std": std,
+        "mean_shift_sigma": (sketch.mean() - mean) / std,
+        "std_ratio": sketch.std() / std,
+        "ks_distance": ks,
+        "above_training_p99": 1.0 - sketch.cdf(p99),
+    }
+
+
+def summary(training: dict = None) -> dict:
+    """
+    Percentiles, mean and std per score across processes. training maps a score
+    name to its (mean, std) at training time to add drift figures.
+    """
+    training = training or {}
+    out = {}
+    for name, sketch in merged().items():
+        entry = {
+            "count": sketch.n,
+            "mean": sketch.mean() if sketch.n else None,
+            "std": sketch.std() if sketch.n else None,
+            "min": sketch.min if sketch.n else None,
+            "max": sketch.max if sketch.n else None,
+            "percentiles": {f"p{p:g}": sketch.quantile(p / 100.0) for p in PERCENTILES} if sketch.n else {},
+        }
+        if name in training:
+            entry["drift"] = drift(sketch, *training[name])
+        out[name] = entry
+    return out